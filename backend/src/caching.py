@@ -0,0 +1,120 @@
+"""
+Общие примитивы кэширования внутри процесса.
+
+- TTLCache — ограниченный LRU-кэш с временем жизни записи (initData, доступ к комнатам, агрегаты, очереди).
+- SingleFlight — одновременные вызовы с одним ключом ждут один общий вызов (Kinopoisk, постеры, пересчёты).
+- KeyVersions — версии ключей для кэшей, которые правятся на месте (статистика и рекомендации комнат).
+"""
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+class TTLCache:
+    """Ограниченный по размеру LRU-кэш с временем жизни записи. Потокобезопасный (sync-зависимости идут в threadpool)."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now: float | None = None):
+        now = now or time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float | None = None, now: float | None = None) -> None:
+        now = now or time.monotonic()
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (now + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в один.
+    Общий вызов идёт в своей задаче: отмена любого ожидающего, в том числе первого, его не прерывает
+    и остальным не передаётся. Поэтому fn не должна использовать ресурсы вызвавшего запроса (его сессию БД).
+    """
+
+    def __init__(self):
+        self._inflight: dict[object, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        # shield: отмена ожидающего запроса снимает только его ожидание
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # помечаем как прочитанное, если ожидающих не осталось
+
+
+class KeyVersions:
+    """
+    Версия ключа растёт с каждой правкой: построение, начатое до правки, в кэш не попадает.
+    Хранится в TTLCache с теми же размером и TTL, что и сам кэш, — не копится по всем ключам за жизнь процесса.
+    Версии берутся из общего счётчика, поэтому забытая и выданная заново версия больше любой прежней
+    и не совпадёт с версией построения, которое ещё идёт.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._versions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counter = itertools.count(1)
+
+    def get(self, key) -> int:
+        version = self._versions.get(key)
+        if version is None:
+            version = self.bump(key)
+        return version
+
+    def bump(self, key) -> int:
+        version = next(self._counter)
+        self._versions.set(key, version)
+        return version
+
+    def __len__(self) -> int:
+        return len(self._versions)
@@ -1,6 +1,17 @@
+import asyncio
 import os
-from sqlalchemy import create_engine
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only
 from dotenv import load_dotenv
 
 # Загружаем переменные из .env (для безопасности конфигурации)
@@ -11,13 +22,282 @@ load_dotenv()
 # Или sqlite:///./test.db для локальной SQLite
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Асинхронные драйверы для тех же баз: sqlite -> aiosqlite, postgresql -> asyncpg
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# Настройки engine/пула из окружения (значения по умолчанию — для одного воркера uvicorn)
+DB_ECHO = env_bool("DB_ECHO", False)  # Логирование всех SQL-запросов — только для отладки
+DB_POOL_SIZE = env_int("DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = env_int("DB_POOL_TIMEOUT", 30)  # секунд ожидания свободного соединения
+DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 1800)  # секунд жизни соединения
+DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+
+# PRAGMA для SQLite, выполняются на каждом новом соединении
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+SQLITE_BUSY_TIMEOUT_MS = env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+SQLITE_WRITE_QUEUE_TIMEOUT = env_int("SQLITE_WRITE_QUEUE_TIMEOUT", 30)  # секунд в очереди пишущих транзакций процесса
+
+
+class PoolMetrics:
+    """
+    Счётчики пула соединений: сколько раз брали соединение, сколько ждали
+    свободного и сколько раз не дождались. Нужны, чтобы подбирать размер
+    пула и число воркеров по данным.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+
+
+class _MeteredPoolMixin:
+    """Замеряет ожидание соединения в пуле (время внутри _do_get)."""
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - started)
+        return connection
+
+
+class MeteredQueuePool(_MeteredPoolMixin, QueuePool):
+    metrics = PoolMetrics()
+
+
+class MeteredAsyncQueuePool(_MeteredPoolMixin, AsyncAdaptedQueuePool):
+    metrics = PoolMetrics()
+
+
+def _is_sqlite_memory(url: URL) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(database_url: str, is_async: bool = False) -> dict:
+    """
+    Параметры create_engine/create_async_engine из окружения.
+    Для SQLite в памяти пул не настраивается (там одно соединение на поток).
+    """
+    url = make_url(database_url)
+    options = {"echo": DB_ECHO}
+    if _is_sqlite_memory(url):
+        return options
+
+    options.update(
+        poolclass=MeteredAsyncQueuePool if is_async else MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+_SQLITE_WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class SqliteWriteQueue:
+    """
+    Очередь пишущих транзакций SQLite внутри процесса (для async engine).
+
+    Писатель у файла SQLite один. Без очереди остальные ждут в busy_timeout, а обработчик SQLite
+    опрашивает блокировку с паузами до 100 мс: под нагрузкой кто-то раз за разом опаздывает и через
+    SQLITE_BUSY_TIMEOUT_MS получает «database is locked». Здесь ждут в asyncio.Lock — по очереди и без опроса.
+
+    Очередь занимается перед первой записью транзакции и отпускается на её commit/rollback
+    (события engine); инвалидация соединения и возврат в пул отпускают её на случай, если до них
+    транзакция не дошла. В info соединения лежит метка захвата: отпускание идемпотентно,
+    копия info у отсоединённого (detach) соединения не отпустит очередь дважды.
+    Задача, которая уже держит очередь, во второй сессии её не ждёт (ждала бы сама себя) —
+    дальше решает busy_timeout SQLite, как и без очереди.
+    """
+
+    def __init__(self, timeout: float = SQLITE_WRITE_QUEUE_TIMEOUT):
+        self._lock = asyncio.Lock()
+        self._loop = None
+        self._holder: object | None = None  # метка текущего захвата
+        self._owner: asyncio.Task | None = None
+        self.timeout = timeout
+        self.metrics = PoolMetrics()
+
+    def acquire(self, info: dict) -> None:
+        """info — словарь соединения пула. Вызывается из событий engine, то есть внутри greenlet async engine."""
+        if info.get("sqlite_write_queue") is not None:
+            return
+        task = asyncio.current_task()
+        if self._holder is not None and self._owner is task:
+            return
+        started = time.perf_counter()
+        try:
+            await_only(self._acquire())
+        except TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - started, timed_out=True)
+            raise sqlite3.OperationalError("database is locked") from None
+        self.metrics.record_wait(time.perf_counter() - started)
+        self._holder, self._owner = object(), task
+        info["sqlite_write_queue"] = self._holder
+
+    async def _acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio.Lock привязан к циклу событий (скрипты могут вызывать asyncio.run несколько раз)
+            self._lock, self._loop = asyncio.Lock(), loop
+            self._holder = self._owner = None
+        async with asyncio.timeout(self.timeout):
+            await self._lock.acquire()
+
+    def release(self, info: dict) -> None:
+        holder = info.pop("sqlite_write_queue", None)
+        if holder is not None and holder is self._holder:
+            self._holder = self._owner = None
+            self._lock.release()
+
+    def held(self) -> bool:
+        return self._holder is not None
+
+
+sqlite_write_queue = SqliteWriteQueue()
+
+
+def _begin_immediate_before_write(conn, cursor, statement, parameters, context, executemany) -> None:
+    """
+    Пишущая транзакция начинается с BEGIN IMMEDIATE: блокировка записи берётся сразу и с ожиданием
+    в busy_timeout, а не при переходе от чтения к записи, где SQLite отвечает «database is locked» без ожидания.
+    Иначе драйвер сам начал бы DEFERRED-транзакцию перед этим же INSERT/UPDATE/DELETE.
+    """
+    if conn.info.get("sqlite_write") or not statement.lstrip()[:7].upper().startswith(_SQLITE_WRITE_STATEMENTS):
+        return
+    try:
+        if conn.dialect.is_async:
+            sqlite_write_queue.acquire(conn.info)
+        cursor.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as e:
+        sqlite_write_queue.release(conn.info)
+        raise OperationalError(statement, parameters, e) from e
+    conn.info["sqlite_write"] = True
+
+
+def _end_sqlite_write(conn) -> None:
+    if conn.invalidated:
+        return  # info недоступен; очередь уже отпущена событием пула invalidate
+    conn.info.pop("sqlite_write", None)
+    sqlite_write_queue.release(conn.info)
+
+
+def _release_sqlite_write(dbapi_connection, connection_record, *args) -> None:
+    """checkin/invalidate: транзакция уже не завершится через commit/rollback этого соединения."""
+    connection_record.info.pop("sqlite_write", None)
+    sqlite_write_queue.release(connection_record.info)
+
+
+def get_async_database_url(database_url: str) -> str:
+    """
+    URL для AsyncEngine. Можно задать явно через ASYNC_DATABASE_URL,
+    иначе выводится из DATABASE_URL заменой драйвера.
+    """
+    url = make_url(database_url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"Нет асинхронного драйвера для {url.drivername}, задайте ASYNC_DATABASE_URL")
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(DATABASE_URL)
+
 # Создаём engine — объект для управления подключением к БД
-# echo=True для логирования SQL-запросов (удобно для отладки, отключите в продакшене)
-engine = create_engine(DATABASE_URL, echo=True)
+# Логирование SQL (echo) включается через DB_ECHO=true, по умолчанию выключено
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+# Асинхронный engine для async-эндпоинтов: запросы не блокируют event loop
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+
+for _engine in (engine, async_engine.sync_engine):
+    if _engine.dialect.name == "sqlite":
+        event.listen(_engine, "connect", _set_sqlite_pragmas)
+        event.listen(_engine, "before_cursor_execute", _begin_immediate_before_write)
+        event.listen(_engine, "commit", _end_sqlite_write)
+        event.listen(_engine, "rollback", _end_sqlite_write)
+        event.listen(_engine.pool, "invalidate", _release_sqlite_write)
+        event.listen(_engine.pool, "checkin", _release_sqlite_write)
+
+
+def get_pool_stats() -> dict:
+    """Состояние пулов и счётчики ожидания для sync и async engine."""
+    stats = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        stats[name] = {"pool": pool.status()}
+        if isinstance(pool, _MeteredPoolMixin):
+            stats[name].update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+                **pool.metrics.snapshot(),
+            )
+    if async_engine.dialect.name == "sqlite":
+        stats["async"]["write_queue"] = {"held": sqlite_write_queue.held(), **sqlite_write_queue.metrics.snapshot()}
+    return stats
 
 # Настраиваем фабрику сессий: sessionmaker создаёт сессии для работы с БД
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# expire_on_commit=False: после commit объекты остаются доступны без ленивой подгрузки (в async она запрещена)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # Функция для dependency injection в FastAPI
 # Она предоставляет сессию БД для эндпоинтов и закрывает её после использования
 def get_db() -> Session:
@@ -25,4 +305,10 @@ def get_db() -> Session:
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# То же для async def эндпоинтов
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
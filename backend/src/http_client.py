@@ -0,0 +1,51 @@
+"""
+Общий httpx.AsyncClient на всё время жизни приложения.
+
+Один клиент = один пул соединений с keep-alive: к Кинопоиску и CDN постеров
+не открывается новое TCP/TLS соединение на каждый запрос.
+Создаётся на startup и закрывается на shutdown (см. main.py).
+"""
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+from observability import MeteredTransport
+
+load_dotenv()
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 50))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+
+# Таймауты по внешним сервисам (секунды): API отвечает быстро, картинки качаются дольше
+KINOPOISK_TIMEOUT = httpx.Timeout(float(os.getenv("KINOPOISK_TIMEOUT", 5)), connect=3.0)
+POSTER_TIMEOUT = httpx.Timeout(float(os.getenv("POSTER_TIMEOUT", 10)), connect=3.0)
+
+_client: httpx.AsyncClient | None = None
+
+
+def create_http_client() -> httpx.AsyncClient:
+    # limits задаются транспорту: клиенту с явным transport они не передаются
+    transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    ))
+    # MeteredTransport: время каждого вызова Кинопоиска/постеров — в /metrics и в лог запроса
+    return httpx.AsyncClient(transport=MeteredTransport(transport), timeout=KINOPOISK_TIMEOUT)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Клиент приложения. Вне приложения (скрипты) создаётся лениво при первом обращении."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,308 @@
+"""
+Фоновая загрузка новых фильмов: добавление в комнату не ждёт Кинопоиск и постеры.
+
+1. add_movie_to_room и массовый импорт (movie_import.py) для неизвестного kinopoisk_id создают фильм-заглушку,
+   привязывают его к комнате и задачу IngestionJob в той же транзакции (enqueue_movie); add_movie_to_room отвечает 202 с id задачи
+2. Пул из INGESTION_WORKERS задач в процессе приложения забирает задачи из БД (claim_job),
+   грузит метаданные и постеры (не чаще INGESTION_RATE_LIMIT запросов/с к Кинопоиску на процесс) и заполняет заглушку
+3. Временная ошибка (сеть, 429, 5xx) — повтор через INGESTION_BACKOFF_SECONDS * 2^(попытка-1),
+   не больше INGESTION_MAX_ATTEMPTS попыток. Окончательная (404 и прочие 4xx) — заглушка убирается из комнат
+4. Итог — событие комнаты movie_ready / movie_failed (SSE, WebSocket) и GET /rooms/{room_id}/movies/jobs/{job_id}
+
+Задачи лежат в таблице ingestion_jobs: переживают перезапуск, running-задача упавшего процесса
+снова берётся в работу через INGESTION_LEASE_SECONDS. Один kinopoisk_id — одна задача:
+повторное добавление того же фильма (в эту или другую комнату) ждёт уже созданную.
+Счётчики — GET /metrics/ingestion.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import select, update, delete, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from kinopoisk_urls import canonical_kinopoisk_url
+from models import IngestionJob, Movie, MoviesInRoom, Rating, RoomMovieStats
+from observability import log_event
+from poster_variants import movie_card
+from room_events import room_event_hub
+from room_stats import record_room_rating
+from search_index import movie_search
+from recommender import room_recommender
+from schemas import MovieCreate
+from services import bump_room_version
+from utilites import get_movie_info_from_kp_url
+
+load_dotenv()
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", 2))
+INGESTION_MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", 5))
+INGESTION_BACKOFF_SECONDS = float(os.getenv("INGESTION_BACKOFF_SECONDS", 2))
+INGESTION_POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", 5))  # повторы и задачи других процессов
+INGESTION_LEASE_SECONDS = int(os.getenv("INGESTION_LEASE_SECONDS", 120))
+INGESTION_RATE_LIMIT = float(os.getenv("INGESTION_RATE_LIMIT", 5))  # запросов в секунду к Кинопоиску
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+MOVIE_COLUMNS = ("title", "year", "kinopoisk_url", "kinopoisk_id", "poster_url", "poster_preview_url")
+
+PLACEHOLDER_YEAR = 0  # у заглушки нет года; карточка показывает "загружается"
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+class RateLimiter:
+    """Не чаще rate вызовов в секунду (равномерно), общий на процесс."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+kinopoisk_rate_limiter = RateLimiter(INGESTION_RATE_LIMIT)
+
+
+def _http_status(error: BaseException) -> int | None:
+    cause = error.__cause__ if isinstance(error, RuntimeError) else error
+    return cause.status_code if isinstance(cause, HTTPException) else None
+
+
+def placeholder_title(kinopoisk_id: int) -> str:
+    return f"Кинопоиск #{kinopoisk_id} (загружается)"
+
+
+async def enqueue_movie(db: AsyncSession, kinopoisk_id: int) -> tuple[Movie, IngestionJob]:
+    """
+    Заглушка фильма и задача на загрузку — в транзакции вызывающего (коммит на его стороне).
+    Задача, которая раньше закончилась неудачей, перезапускается для новой заглушки.
+    IntegrityError — тот же фильм одновременно добавлен другим запросом.
+    """
+    movie = Movie(title=placeholder_title(kinopoisk_id), year=PLACEHOLDER_YEAR,
+                  kinopoisk_url=canonical_kinopoisk_url(kinopoisk_id), kinopoisk_id=kinopoisk_id)
+    db.add(movie)
+    await db.flush()
+
+    now = datetime.utcnow()
+    job = await db.scalar(select(IngestionJob).where(IngestionJob.kinopoisk_id == kinopoisk_id))
+    if job is None:
+        job = IngestionJob(kinopoisk_id=kinopoisk_id, movie_id=movie.id, status=PENDING,
+                           next_attempt_at=now, created_at=now, updated_at=now)
+        db.add(job)
+    else:
+        job.movie_id, job.status, job.attempts, job.last_error = movie.id, PENDING, 0, None
+        job.next_attempt_at = job.updated_at = now
+    await db.flush()
+    return movie, job
+
+
+async def get_pending_job(db: AsyncSession, movie_id: int) -> IngestionJob | None:
+    """Незавершённая задача фильма — фильм ещё заглушка."""
+    return await db.scalar(
+        select(IngestionJob).where(IngestionJob.movie_id == movie_id, IngestionJob.status.in_((PENDING, RUNNING)))
+    )
+
+
+def job_view(job: IngestionJob) -> dict:
+    return {
+        "id": job.id,
+        "kinopoisk_id": job.kinopoisk_id,
+        "movie_id": job.movie_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.last_error,
+    }
+
+
+async def claim_job() -> int | None:
+    """
+    Следующая задача, готовая к работе: pending с наступившим next_attempt_at
+    или running с истёкшей арендой. Захват — условным UPDATE, поэтому безопасен и между процессами.
+    """
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        candidates = (await db.execute(
+            select(IngestionJob.id, IngestionJob.status, IngestionJob.updated_at)
+            .where(or_(
+                and_(IngestionJob.status == PENDING, IngestionJob.next_attempt_at <= now),
+                and_(IngestionJob.status == RUNNING,
+                     IngestionJob.updated_at < now - timedelta(seconds=INGESTION_LEASE_SECONDS)),
+            ))
+            .order_by(IngestionJob.next_attempt_at)
+            .limit(INGESTION_WORKERS)
+        )).all()
+        for job_id, job_status, updated_at in candidates:
+            claimed = await db.execute(
+                update(IngestionJob)
+                .where(IngestionJob.id == job_id, IngestionJob.status == job_status,
+                       IngestionJob.updated_at == updated_at)
+                .values(status=RUNNING, attempts=IngestionJob.attempts + 1, updated_at=now)
+            )
+            if claimed.rowcount == 1:
+                await db.commit()
+                return job_id
+        await db.rollback()
+    return None
+
+
+async def _rooms_with_movie(db: AsyncSession, movie_id: int) -> list[str]:
+    return list(await db.scalars(select(MoviesInRoom.room_id).where(MoviesInRoom.movie_id == movie_id)))
+
+
+class IngestionPool:
+    """Воркеры в event loop приложения; start() на startup, close() на shutdown (main.py)."""
+
+    def __init__(self, workers: int = INGESTION_WORKERS):
+        self.workers = workers
+        self._tasks: list[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.running = 0
+
+    async def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self) -> None:
+        """Вызывать после коммита новой задачи: воркер заберёт её сразу, а не на следующем опросе."""
+        self.enqueued += 1
+        self._wake.set()
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job_id = await claim_job()
+            except Exception as e:
+                log_event("ingestion_claim_failed", logging.ERROR, error=str(e))
+                job_id = None
+            if job_id is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=INGESTION_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.running += 1
+            try:
+                await self.process(job_id)
+            except Exception as e:
+                # Задача останется running и вернётся в работу по истечении аренды
+                log_event("ingestion_job_crashed", logging.ERROR, job_id=job_id, error=str(e))
+            finally:
+                self.running -= 1
+
+    async def process(self, job_id: int) -> None:
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestionJob, job_id)
+            kinopoisk_id, attempts = job.kinopoisk_id, job.attempts
+
+        # Сеть — без открытой транзакции и соединения с БД
+        await kinopoisk_rate_limiter.wait()
+        try:
+            loaded = await get_movie_info_from_kp_url(MovieCreate(kinopoisk_url=canonical_kinopoisk_url(kinopoisk_id)))
+        except Exception as e:
+            status_code = _http_status(e)
+            retryable = status_code is None or status_code in RETRYABLE_STATUS_CODES
+            if retryable and attempts < INGESTION_MAX_ATTEMPTS:
+                await self._retry(job_id, attempts, e)
+            else:
+                await self._fail(job_id, e)
+            return
+        await self._finish(job_id, loaded)
+
+    async def _retry(self, job_id: int, attempts: int, error: Exception) -> None:
+        delay = INGESTION_BACKOFF_SECONDS * 2 ** (attempts - 1)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(IngestionJob).where(IngestionJob.id == job_id).values(
+                    status=PENDING, last_error=str(error), updated_at=datetime.utcnow(),
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+                )
+            )
+            await db.commit()
+        self.retried += 1
+        log_event("ingestion_job_retry", logging.WARNING, job_id=job_id, attempt=attempts, delay_seconds=delay, error=str(error))
+
+    async def _finish(self, job_id: int, loaded: Movie) -> None:
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestionJob, job_id)
+            movie = await db.get(Movie, job.movie_id)
+            for column in MOVIE_COLUMNS:
+                if column != "kinopoisk_id":
+                    setattr(movie, column, getattr(loaded, column))
+            job.status, job.last_error, job.updated_at = DONE, None, datetime.utcnow()
+            room_ids = await _rooms_with_movie(db, movie.id)
+            for room_id in room_ids:
+                await db.run_sync(bump_room_version, room_id)
+            await db.commit()
+            card = movie_card(movie)
+
+        self.completed += 1
+        movie_search.record_movie(movie.id, movie.title, movie.year)
+        for room_id in room_ids:
+            await room_event_hub.publish(room_id, "movie_ready", job_id=job_id, movie=card)
+
+    async def _fail(self, job_id: int, error: Exception) -> None:
+        """Фильм не загрузить: заглушка (с оценками, если успели поставить) убирается из всех комнат."""
+        async with AsyncSessionLocal() as db:
+            job = await db.get(IngestionJob, job_id)
+            movie_id = job.movie_id
+            room_ids = await _rooms_with_movie(db, movie_id)
+            rated = (await db.execute(
+                select(Rating.room_id, Rating.user_id).where(Rating.movie_id == movie_id)
+            )).all()
+            for model in (Rating, RoomMovieStats, MoviesInRoom):
+                await db.execute(delete(model).where(model.movie_id == movie_id))
+            job.status, job.last_error, job.movie_id, job.updated_at = FAILED, str(error), None, datetime.utcnow()
+            await db.flush()
+            await db.execute(delete(Movie).where(Movie.id == movie_id))
+            for room_id in room_ids:
+                await db.run_sync(bump_room_version, room_id)
+            await db.commit()
+
+        self.failed += 1
+        movie_search.forget_movie(movie_id)
+        for room_id in room_ids:
+            movie_search.forget_room(room_id)
+        for room_id, user_id in rated:
+            record_room_rating(room_id, user_id, movie_id, None)  # статистика комнаты перечитается
+            room_recommender.record_rating(room_id, user_id, movie_id, None)
+        log_event("ingestion_job_failed", logging.WARNING, job_id=job_id, movie_id=movie_id, error=str(error))
+        for room_id in room_ids:
+            await room_event_hub.publish(room_id, "movie_failed", job_id=job_id, movie_id=movie_id, error=str(error))
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "running": self.running,
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+ingestion_pool = IngestionPool()
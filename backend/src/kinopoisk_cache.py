@@ -0,0 +1,96 @@
+"""
+Кэш метаданных Kinopoisk перед get_film_data_from_kinopoisk.
+
+- Хранилище в БД (таблица kinopoisk_responses) с TTL: сырой JSON ответа по kinopoisk_id.
+- Негативный кэш: 404 запоминается на KINOPOISK_NEGATIVE_TTL, несуществующий id не дёргает API повторно.
+- Single-flight: одновременные запросы одного id внутри процесса ждут один общий вызов API.
+
+Счётчики hits/misses/coalesced/negative_hits — GET /metrics/kinopoisk-cache.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from httpx import Response
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from caching import SingleFlight
+from database import AsyncSessionLocal
+from models import KinopoiskResponse
+
+load_dotenv()
+KINOPOISK_CACHE_TTL = int(os.getenv("KINOPOISK_CACHE_TTL", 30 * 24 * 60 * 60))
+KINOPOISK_NEGATIVE_TTL = int(os.getenv("KINOPOISK_NEGATIVE_TTL", 24 * 60 * 60))
+
+
+class KinopoiskCache:
+    def __init__(self, ttl: int = KINOPOISK_CACHE_TTL, negative_ttl: int = KINOPOISK_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    async def get_film_json(self, film_id: int, fetch: Callable[[int], Awaitable[Response]]) -> str:
+        """
+        Сырой JSON фильма. Для закэшированного 404 поднимает HTTPException(404), как и сам API-вызов.
+        """
+        cached = await self._load(film_id)
+        if cached is not None:
+            return self._from_cache(cached)
+
+        return await self._flight.do(film_id, lambda: self._fetch_and_store(film_id, fetch))
+
+    def _from_cache(self, cached: KinopoiskResponse) -> str:
+        if cached.status_code == 404:
+            self.negative_hits += 1
+            raise HTTPException(status_code=404, detail=cached.body)
+        self.hits += 1
+        return cached.body
+
+    async def _load(self, film_id: int) -> KinopoiskResponse | None:
+        async with AsyncSessionLocal() as db:
+            cached = await db.get(KinopoiskResponse, film_id)
+        if cached is None or cached.expires_at <= datetime.utcnow():
+            return None
+        return cached
+
+    async def _fetch_and_store(self, film_id: int, fetch: Callable[[int], Awaitable[Response]]) -> str:
+        self.misses += 1
+        try:
+            response = await fetch(film_id)
+        except HTTPException as e:
+            if e.status_code == 404:
+                await self._store(film_id, 404, str(e.detail), self.negative_ttl)
+            raise
+
+        await self._store(film_id, response.status_code, response.text, self.ttl)
+        return response.text
+
+    async def _store(self, film_id: int, status_code: int, body: str, ttl: int) -> None:
+        now = datetime.utcnow()
+        values = dict(kinopoisk_id=film_id, status_code=status_code, body=body,
+                      fetched_at=now, expires_at=now + timedelta(seconds=ttl))
+        async with AsyncSessionLocal() as db:
+            insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+            stmt = insert(KinopoiskResponse).values(**values)
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=[KinopoiskResponse.kinopoisk_id],
+                set_={k: stmt.excluded[k] for k in ("status_code", "body", "fetched_at", "expires_at")},
+            ))
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self._flight.coalesced,
+        }
+
+
+kinopoisk_cache = KinopoiskCache()
@@ -0,0 +1,41 @@
+"""
+Разбор ссылок на Кинопоиск: любая допустимая ссылка -> kinopoisk_id, без сетевых запросов.
+
+Принимаются варианты одной и той же страницы:
+    https://www.kinopoisk.ru/film/594/
+    http://kinopoisk.ru/film/594?utm_referrer=www.google.com
+    https://m.kinopoisk.ru/series/594/episodes/#season
+    www.kinopoisk.ru/film/594
+"""
+from urllib.parse import urlsplit
+
+KINOPOISK_HOSTS = {"kinopoisk.ru", "www.kinopoisk.ru", "m.kinopoisk.ru"}
+KINOPOISK_SECTIONS = {"film", "series"}
+
+
+def extract_kinopoisk_id(url: str) -> int:
+    """kinopoisk_id из ссылки или ValueError, если это не ссылка на фильм/сериал."""
+    value = url.strip()
+    if "://" not in value:
+        value = f"https://{value}"
+
+    parts = urlsplit(value)
+    host = (parts.hostname or "").lower()
+    if parts.scheme.lower() not in ("http", "https") or host not in KINOPOISK_HOSTS:
+        raise ValueError("Некорректная ссылка на Кинопоиск")
+
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if len(segments) < 2 or segments[0].lower() not in KINOPOISK_SECTIONS or not segments[1].isascii() \
+            or not segments[1].isdigit():
+        raise ValueError(f"Не удалось извлечь ID фильма из ссылки: {url}")
+
+    return int(segments[1])
+
+
+def canonical_kinopoisk_url(kinopoisk_id: int) -> str:
+    """Единый вид ссылки (так же хранится Movie.kinopoisk_url: webUrl из API без завершающего /)."""
+    return f"https://www.kinopoisk.ru/film/{kinopoisk_id}"
+
+
+def canonicalize_kinopoisk_url(url: str) -> str:
+    return canonical_kinopoisk_url(extract_kinopoisk_id(url))
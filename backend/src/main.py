@@ -3,25 +3,58 @@ from fastapi import FastAPI, Depends, HTTPException
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from starlette.responses import HTMLResponse, FileResponse
-from starlette.templating import Jinja2Templates
+from starlette.responses import HTMLResponse, FileResponse, PlainTextResponse
 
 from models import Base, User, Room  # Импорт моделей
-from database import engine, get_db  # Файл database.py с настройкой сессий
+from database import engine, get_db, get_pool_stats  # Файл database.py с настройкой сессий
 from schemas import RoomCreate
-from routers import rooms, auth
+from manage import check_schema
+from routers import rooms, auth, posters, stats, search
+from http_client import get_http_client, close_http_client
+from kinopoisk_cache import kinopoisk_cache
+from poster_storage import CachedStaticFiles
+from poster_variants import poster_variants, close_process_pool
+from room_events import room_event_hub
+from room_stats import room_stats_cache
+from recommender import room_recommender
+from room_access import room_access
+from search_index import movie_search
+from response_cache import room_page_cache
+from templating import precompile_templates, render_timings
+from ingestion import ingestion_pool
+from observability import ObservabilityMiddleware, register_stats, register_collector, render_metrics, log_event
 app = FastAPI()
+app.add_middleware(ObservabilityMiddleware)
 
 app.include_router(rooms.rooms)
 app.include_router(auth.auth)
+app.include_router(posters.posters)
+app.include_router(stats.stats)
+app.include_router(search.search)
 app.mount("/templates", StaticFiles(directory="templates", html=True), name="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 
 
 @app.on_event("startup")
 def on_startup():
+    check_schema()  # Старая схема, которую create_all не обновит, — не стартуем, в ошибке команда миграции
     Base.metadata.create_all(bind=engine)  # Создать таблицы
+    get_http_client()  # Общий HTTP-клиент для Кинопоиска и постеров
+    log_event("templates_precompiled", count=precompile_templates())
+
+
+@app.on_event("startup")
+async def start_workers():
+    await ingestion_pool.start()  # Подхватывает и незавершённые задачи прошлого запуска
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await ingestion_pool.close()
+    await close_http_client()
+    close_process_pool()
+    await room_event_hub.close()
 
 # @app.on_event("shutdown")
 # def on_shutdown():
@@ -37,10 +70,95 @@ def register(telegram_token: str, db: Session = Depends(get_db)):
 
 @app.get("/", response_class=HTMLResponse)
 def hello_world():
-    print('RUN: main.py -> hello_world')
     return FileResponse("templates/index.html")
 
 
+@app.get("/metrics/db-pool")
+def db_pool_metrics():
+    # Заполненность пулов и время ожидания соединения — для подбора DB_POOL_SIZE и числа воркеров
+    return get_pool_stats()
+
+
+@app.get("/metrics/kinopoisk-cache")
+def kinopoisk_cache_metrics():
+    return kinopoisk_cache.stats()
+
+
+@app.get("/metrics/poster-variants")
+def poster_variants_metrics():
+    return poster_variants.stats()
+
+
+@app.get("/metrics/room-events")
+def room_events_metrics():
+    return room_event_hub.stats()
+
+
+@app.get("/metrics/room-stats")
+def room_stats_metrics():
+    return room_stats_cache.stats()
+
+
+@app.get("/metrics/room-access")
+def room_access_metrics():
+    return room_access.stats()
+
+
+@app.get("/metrics/recommender")
+def recommender_metrics():
+    return room_recommender.stats()
+
+
+@app.get("/metrics/search")
+def search_metrics():
+    return movie_search.stats()
+
+
+@app.get("/metrics/response-cache")
+def response_cache_metrics():
+    return room_page_cache.stats()
+
+
+@app.get("/metrics/ingestion")
+def ingestion_metrics():
+    return ingestion_pool.stats()
+
+
+@app.get("/metrics/templates")
+def templates_metrics():
+    return render_timings.stats()
+
+
+def _template_summary() -> list[str]:
+    """Время рендера шаблонов (окно последних рендеров) — summary с квантилями 0.5 и 0.99."""
+    lines = ["# TYPE template_render_seconds summary"]
+    for name, timings in render_timings.stats()["templates"].items():
+        lines.append(f'template_render_seconds{{template="{name}",quantile="0.5"}} {timings["p50_ms"] / 1000}')
+        lines.append(f'template_render_seconds{{template="{name}",quantile="0.99"}} {timings["p99_ms"] / 1000}')
+        lines.append(f'template_render_seconds_count{{template="{name}"}} {timings["renders"]}')
+    return lines
+
+
+register_stats("db_pool_sync", lambda: get_pool_stats()["sync"])
+register_stats("db_pool_async", lambda: get_pool_stats()["async"])
+register_stats("kinopoisk_cache", kinopoisk_cache.stats)
+register_stats("poster_variants", poster_variants.stats)
+register_stats("room_events", room_event_hub.stats)
+register_stats("room_stats", room_stats_cache.stats)
+register_stats("room_access", room_access.stats)
+register_stats("recommender", room_recommender.stats)
+register_stats("search", movie_search.stats)
+register_stats("response_cache", room_page_cache.stats)
+register_stats("ingestion", ingestion_pool.stats)
+register_collector(_template_summary)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Всё из /metrics/* и гистограммы запросов в текстовом формате Prometheus
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 
 
 @app.post("/rooms/{room_id}/movies/add")
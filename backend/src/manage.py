@@ -0,0 +1,187 @@
+"""
+Служебные команды для обслуживания БД.
+
+Запуск из backend/src:
+    python manage.py migrate-ratings   # перенос старых оценок (user_id, movie_id) в оценки по комнатам
+    python manage.py rebuild-stats [--room ROOM_ID]
+    python manage.py check-stats [--room ROOM_ID]
+    python manage.py create-indexes    # индексы, добавленные в models.py после создания таблиц
+    python manage.py backfill-members  # участники комнат по данным до проверки доступа (room_access.py)
+
+Приложение при старте вызывает check_schema: со схемой, которой нужна миграция, оно не запускается
+и пишет, какую команду выполнить. Недостающих участников комнат check_schema дописывает сама.
+"""
+import argparse
+import sys
+
+from sqlalchemy import column, exists, inspect, select, table, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import engine, SessionLocal
+from models import Base, MoviesInRoom, Rating, Room, RoomMember, User
+from services import rebuild_room_movie_stats, check_room_movie_stats
+
+
+def ratings_need_migration() -> bool:
+    """Таблица ratings ещё старая: без room_id и с первичным ключом (user_id, movie_id)."""
+    inspector = inspect(engine)
+    return inspector.has_table("ratings") and "room_id" not in {c["name"] for c in inspector.get_columns("ratings")}
+
+
+def member_sources(conn) -> list:
+    """
+    Кто заведомо был в комнате до проверки доступа: создатель (колонка rooms.created_by — если есть в этой базе),
+    добавлявшие фильмы и ставившие оценки. Выборки (room_id, user_id) только по существующим комнатам и пользователям.
+    """
+    inspector = inspect(conn)
+    sources = []
+    if inspector.has_table("rooms") and "created_by" in {c["name"] for c in inspector.get_columns("rooms")}:
+        rooms = table("rooms", column("id"), column("created_by"))
+        sources.append(select(rooms.c.id, rooms.c.created_by).join(User, User.id == rooms.c.created_by)
+                       .where(rooms.c.created_by.is_not(None)))
+    if inspector.has_table("movies_in_room"):
+        sources.append(select(MoviesInRoom.room_id, MoviesInRoom.added_by).join(Room, Room.id == MoviesInRoom.room_id)
+                       .join(User, User.id == MoviesInRoom.added_by).where(MoviesInRoom.added_by.is_not(None)))
+    if inspector.has_table("ratings") and not ratings_need_migration():
+        sources.append(select(Rating.room_id, Rating.user_id).join(Room, Room.id == Rating.room_id)
+                       .join(User, User.id == Rating.user_id).where(Rating.user_id.is_not(None)))
+    return sources
+
+
+def _missing_members(source):
+    """Строки источника, которых ещё нет в room_members."""
+    room_id, user_id = source.selected_columns
+    return source.where(~exists().where(RoomMember.room_id == room_id, RoomMember.user_id == user_id))
+
+
+def room_members_need_backfill() -> bool:
+    if not inspect(engine).has_table("room_members"):
+        return False  # новая база: таблицы создаст create_all, заполнять нечего
+    with engine.connect() as conn:
+        return any(conn.scalar(select(exists(_missing_members(source)))) for source in member_sources(conn))
+
+
+def backfill_room_members() -> int:
+    """Дописывает недостающих участников (INSERT ... ON CONFLICT DO NOTHING — безопасно при параллельном запуске)."""
+    Base.metadata.create_all(bind=engine)
+    insert_ = postgresql_insert if engine.dialect.name == "postgresql" else sqlite_insert
+    added = 0
+    with engine.begin() as conn:
+        for source in member_sources(conn):
+            result = conn.execute(insert_(RoomMember).from_select(
+                ["room_id", "user_id"], _missing_members(source).distinct()
+            ).on_conflict_do_nothing(index_elements=[RoomMember.room_id, RoomMember.user_id]))
+            added += result.rowcount
+    print(f"room_members: добавлено {added} участников")
+    return added
+
+
+def check_schema() -> None:
+    """
+    Вызывается при старте приложения. create_all не меняет существующие таблицы: со старой ratings
+    приложение упало бы на первом же запросе к оценкам — лучше не стартовать и сказать, что делать.
+    Участники комнат, созданных до room_members, иначе получили бы 403 в своей же комнате — дописываются сразу.
+    """
+    if ratings_need_migration():
+        raise RuntimeError("Таблица ratings в старом формате (без room_id). "
+                           "Остановите приложение и выполните в backend/src: python manage.py migrate-ratings")
+    if room_members_need_backfill():
+        backfill_room_members()
+
+
+def migrate_ratings() -> None:
+    """
+    Старая таблица ratings не содержит room_id: оценка копируется во все комнаты,
+    где есть этот фильм. После переноса агрегаты пересобираются.
+    """
+    if not ratings_need_migration():
+        print("ratings: миграция не требуется")
+    else:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE ratings RENAME TO ratings_legacy"))
+            # Индексы переименованной таблицы остаются со старыми именами — убираем, чтобы create_all создал новые
+            for index in inspect(conn).get_indexes("ratings_legacy"):
+                conn.execute(text(f"DROP INDEX {index['name']}"))
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("ALTER TABLE ratings_legacy RENAME CONSTRAINT ratings_pkey TO ratings_legacy_pkey"))
+            Base.metadata.create_all(bind=conn)
+            result = conn.execute(text(
+                "INSERT INTO ratings (user_id, movie_id, room_id, score, skipped) "
+                "SELECT r.user_id, r.movie_id, mir.room_id, r.score, r.skipped "
+                "FROM ratings_legacy r JOIN movies_in_room mir ON mir.movie_id = r.movie_id"
+            ))
+            conn.execute(text("DROP TABLE ratings_legacy"))
+        print(f"ratings: перенесено {result.rowcount} оценок")
+
+    rebuild_stats()
+
+
+def rebuild_stats(room_id: str | None = None) -> None:
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        rebuild_room_movie_stats(db, room_id=room_id)
+        db.commit()
+    print("room_movie_stats: пересобрано")
+
+
+def check_stats(room_id: str | None = None) -> int:
+    with SessionLocal() as db:
+        problems = check_room_movie_stats(db, room_id=room_id)
+    for problem in problems:
+        print(f"MISMATCH room={problem['room_id']} movie={problem['movie_id']} "
+              f"expected={problem['expected']} actual={problem['actual']}")
+    print(f"room_movie_stats: расхождений {len(problems)}")
+    return 1 if problems else 0
+
+
+def create_indexes() -> None:
+    """create_all не добавляет новые индексы в уже существующие таблицы — создаём недостающие."""
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+            columns = {column["name"] for column in inspect(conn).get_columns(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                # Индекс на выражении: литералы внутри него тоже попадают в index.columns, но без таблицы
+                missing = [column.name for column in index.columns
+                           if column.table is not None and column.name not in columns]
+                if missing:
+                    # Например, ratings до migrate-ratings ещё без room_id
+                    print(f"{table.name}: индекс {index.name} пропущен, нет колонок {', '.join(missing)}")
+                    continue
+                index.create(bind=conn)
+                print(f"{table.name}: создан индекс {index.name}")
+    print("индексы: готово")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="MovieRater: служебные команды")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("migrate-ratings", help="перенести оценки в разрезе комнат и пересобрать агрегаты")
+    rebuild = commands.add_parser("rebuild-stats", help="пересобрать room_movie_stats из ratings")
+    rebuild.add_argument("--room", dest="room_id")
+    check = commands.add_parser("check-stats", help="сверить room_movie_stats с ratings")
+    check.add_argument("--room", dest="room_id")
+    commands.add_parser("create-indexes", help="создать недостающие индексы в существующих таблицах")
+    commands.add_parser("backfill-members", help="дописать участников комнат: создатели, добавлявшие фильмы, оценившие")
+
+    args = parser.parse_args(argv)
+    if args.command == "migrate-ratings":
+        migrate_ratings()
+    elif args.command == "rebuild-stats":
+        rebuild_stats(args.room_id)
+    elif args.command == "check-stats":
+        return check_stats(args.room_id)
+    elif args.command == "create-indexes":
+        create_indexes()
+    elif args.command == "backfill-members":
+        backfill_room_members()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
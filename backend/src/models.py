@@ -2,7 +2,8 @@ from datetime import datetime
 from typing import List
 from nanoid import generate
 
-from sqlalchemy import ForeignKey, Boolean, DateTime, Integer, String, Float
+from sqlalchemy import ForeignKey, Boolean, DateTime, Integer, String, Float, Index, Text, case, literal_column
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 class Base(DeclarativeBase):
@@ -44,8 +45,14 @@ class Movie(Base):
 
 class Rating(Base):
     __tablename__ = 'ratings'
+    __table_args__ = (
+        Index('ix_ratings_room_movie', 'room_id', 'movie_id'),
+        # Страницы истории по моей оценке (services.get_room_history_page)
+        Index('ix_ratings_room_user_score', 'room_id', 'user_id', 'score', 'movie_id'),
+    )
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'), primary_key=True)
     movie_id: Mapped[int] = mapped_column(ForeignKey('movies.id'), primary_key=True)
+    room_id: Mapped[str] = mapped_column(String(255), ForeignKey('rooms.id'), primary_key=True)  # Оценка привязана к комнате
     score: Mapped[float] = mapped_column(Float, nullable=True)  # 1-10 с шагом 0.5
     skipped: Mapped[bool] = mapped_column()
 
@@ -57,8 +64,24 @@ class RoomMember(Base):  # Для Many-to-Many
     room_id: Mapped[str] = mapped_column(ForeignKey('rooms.id'), primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey('users.id'), primary_key=True)
 
+class RoomInvite(Base):
+    """
+    Приглашение в комнату (room_access.py): по коду из ссылки входят и в закрытую комнату.
+    Код многоразовый, действует до expires_at.
+    """
+    __tablename__ = 'room_invites'
+    code: Mapped[str] = mapped_column(String(32), primary_key=True)
+    room_id: Mapped[str] = mapped_column(String(255), ForeignKey('rooms.id'), index=True)
+    created_by: Mapped[int] = mapped_column(ForeignKey('users.id'))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+
 class MoviesInRoom(Base):
     __tablename__ = 'movies_in_room'
+    __table_args__ = (
+        # Порядок выдачи фильмов на оценку и курсор очереди (rating_queue)
+        Index('ix_movies_in_room_room_added', 'room_id', 'added_date', 'movie_id'),
+    )
     movie_id: Mapped[int] = mapped_column(ForeignKey('movies.id'), primary_key=True)
     room_id: Mapped[str] = mapped_column(String(255), ForeignKey('rooms.id'), primary_key=True)
     added_by: Mapped[int] = mapped_column(ForeignKey('users.id'))
@@ -69,3 +92,86 @@ class MoviesInRoom(Base):
     movie: Mapped["Movie"] = relationship()
 
 
+class RoomMovieStats(Base):
+    """
+    Материализованный агрегат оценок фильма в комнате.
+    Обновляется инкрементально в services.save_rating в той же транзакции, что и сама оценка.
+    Пересобрать/проверить: python manage.py rebuild-stats / check-stats
+    """
+    __tablename__ = 'room_movie_stats'
+    room_id: Mapped[str] = mapped_column(String(255), ForeignKey('rooms.id'), primary_key=True)
+    movie_id: Mapped[int] = mapped_column(ForeignKey('movies.id'), primary_key=True)
+    ratings_count: Mapped[int] = mapped_column(Integer, default=0)  # Только оценки с score (пропуски не считаем)
+    score_sum: Mapped[float] = mapped_column(Float, default=0)
+    score_sq_sum: Mapped[float] = mapped_column(Float, default=0)
+    score_min: Mapped[float | None] = mapped_column(Float, nullable=True)
+    score_max: Mapped[float | None] = mapped_column(Float, nullable=True)
+
+    @hybrid_property
+    def avg_score(self) -> float | None:
+        return self.score_sum / self.ratings_count if self.ratings_count else None
+
+    @avg_score.expression
+    def avg_score(cls):
+        return case((cls.ratings_count > 0, cls.score_sum / cls.ratings_count), else_=None)
+
+    @hybrid_property
+    def avg_sort_key(self) -> float:
+        """Средняя для сортировки истории: без оценок — -1 (в конце), без NULL для курсора."""
+        return self.score_sum / self.ratings_count if self.ratings_count else -1
+
+    @avg_sort_key.expression
+    def avg_sort_key(cls):
+        # Литералы, а не параметры: иначе выражение в запросе не совпадёт с индексом ix_room_movie_stats_room_avg
+        return case((cls.ratings_count > literal_column("0"), cls.score_sum / cls.ratings_count),
+                    else_=literal_column("-1"))
+
+
+# Страницы истории по средней оценке (services.get_room_history_page)
+Index('ix_room_movie_stats_room_avg', RoomMovieStats.room_id, RoomMovieStats.avg_sort_key, RoomMovieStats.movie_id)
+
+
+class RoomVersion(Base):
+    """
+    Версия содержимого комнаты для HTTP-кэша страниц (response_cache.py).
+    Растёт на 1 в той же транзакции, что и изменение: добавление фильма, оценка (services.bump_room_version).
+    Нет строки — версия 0.
+    """
+    __tablename__ = 'room_versions'
+    room_id: Mapped[str] = mapped_column(String(255), ForeignKey('rooms.id'), primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class IngestionJob(Base):
+    """
+    Фоновая загрузка фильма из Кинопоиска (ingestion.py). Одна задача на kinopoisk_id.
+    Пока задача не выполнена, movie_id указывает на фильм-заглушку, уже привязанный к комнатам.
+    status: pending -> running -> done | failed; running с просроченным updated_at снова берётся в работу.
+    """
+    __tablename__ = 'ingestion_jobs'
+    __table_args__ = (
+        Index('ix_ingestion_jobs_status_next', 'status', 'next_attempt_at'),
+    )
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kinopoisk_id: Mapped[int] = mapped_column(Integer, unique=True)
+    movie_id: Mapped[int | None] = mapped_column(ForeignKey('movies.id'), nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default='pending')
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class KinopoiskResponse(Base):
+    """
+    Кэш сырых ответов Kinopoisk API по kinopoisk_id (см. kinopoisk_cache.py).
+    Ответы 404 тоже хранятся (негативный кэш) с более коротким сроком.
+    """
+    __tablename__ = 'kinopoisk_responses'
+    kinopoisk_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    status_code: Mapped[int] = mapped_column(Integer)
+    body: Mapped[str] = mapped_column(Text)
+    fetched_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
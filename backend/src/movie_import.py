@@ -0,0 +1,137 @@
+"""
+Массовый импорт фильмов в комнату по списку ссылок на Кинопоиск.
+
+1. Ссылки -> kinopoisk_id, дубликаты отбрасываются, известные фильмы находятся одним IN-запросом
+2. Неизвестные фильмы импорт не грузит сам: как и add_movie_to_room, ставит заглушку и задачу загрузки
+   (ingestion.enqueue_movie) — метаданные и постеры догружает ingestion_pool с общим ограничением частоты
+   и повторами, итог по фильму — событие комнаты movie_ready / movie_failed
+3. Movie / MoviesInRoom / RoomMovieStats / IngestionJob пишутся пачками по IMPORT_BATCH_SIZE в одной транзакции
+4. По каждой ссылке отдаётся событие прогресса (словарь), по окончании — итоговая сводка
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database import AsyncSessionLocal
+from ingestion import enqueue_movie, ingestion_pool
+from models import Movie, MoviesInRoom, RoomMovieStats, User
+from poster_variants import movie_card
+from room_events import room_event_hub
+from search_index import movie_search
+from services import resolve_kinopoisk_urls, bump_room_version
+
+load_dotenv()
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 20))
+IMPORT_MAX_URLS = int(os.getenv("IMPORT_MAX_URLS", 1000))
+
+_URL_SEPARATORS = re.compile(r"[\s,;\"'<>]+")
+
+
+def parse_import_text(text: str) -> list[str]:
+    """Ссылки из текстового/CSV файла: всё, что похоже на ссылку на kinopoisk.ru, в любой колонке."""
+    return [token for token in _URL_SEPARATORS.split(text) if "kinopoisk.ru" in token.lower()]
+
+
+@dataclass
+class ImportItem:
+    url: str
+    kinopoisk_id: int
+
+
+async def _write_batch(room_id: str, added_by: int, batch: list[ImportItem]) -> list[dict]:
+    """Пачка фильмов в одной транзакции. При гонке с параллельным добавлением пачка повторяется один раз."""
+    for attempt in range(2):
+        try:
+            return await _write_batch_once(room_id, added_by, batch)
+        except IntegrityError:
+            if attempt:
+                raise
+
+
+async def _write_batch_once(room_id: str, added_by: int, batch: list[ImportItem]) -> list[dict]:
+    async with AsyncSessionLocal() as db:
+        kinopoisk_ids = [item.kinopoisk_id for item in batch]
+        saved = {m.kinopoisk_id: m for m in await db.scalars(select(Movie).where(Movie.kinopoisk_id.in_(kinopoisk_ids)))}
+
+        # Новые фильмы — заглушки с задачей загрузки; при повторе пачки уже сохранённые найдутся выше
+        jobs = {}
+        for kinopoisk_id in kinopoisk_ids:
+            if kinopoisk_id not in saved:
+                saved[kinopoisk_id], jobs[kinopoisk_id] = await enqueue_movie(db, kinopoisk_id)
+
+        movie_ids = [saved[kp_id].id for kp_id in kinopoisk_ids]
+        in_room = set(await db.scalars(
+            select(MoviesInRoom.movie_id).where(MoviesInRoom.room_id == room_id, MoviesInRoom.movie_id.in_(movie_ids))
+        ))
+
+        events, added = [], []
+        for item in batch:
+            movie, job = saved[item.kinopoisk_id], jobs.get(item.kinopoisk_id)
+            payload = {"url": item.url, "kinopoisk_id": item.kinopoisk_id, "movie_id": movie.id, "title": movie.title}
+            if movie.id in in_room:
+                payload["status"] = "already_in_room"
+            else:
+                db.add(MoviesInRoom(movie_id=movie.id, room_id=room_id, added_by=added_by))
+                db.add(RoomMovieStats(room_id=room_id, movie_id=movie.id))
+                in_room.add(movie.id)
+                added.append((movie_card(movie), job.id if job else None))
+                payload["status"] = "queued" if job else "added"
+            if job:
+                payload["job_id"] = job.id
+            events.append(payload)
+
+        user = await db.get(User, added_by) if added else None
+        if added:
+            await db.run_sync(bump_room_version, room_id)
+        await db.commit()
+
+    if added:
+        movie_search.forget_room(room_id)
+    for _ in jobs:
+        ingestion_pool.wake()
+    for card, job_id in added:
+        await room_event_hub.publish(room_id, "movie_added", movie=card, added_by=user.username if user else None,
+                                     job_id=job_id)
+    return events
+
+
+async def import_movies(room_id: str, added_by: int, urls: list[str]) -> AsyncIterator[dict]:
+    """
+    Импортирует ссылки в комнату, отдавая событие по каждой ссылке по мере записи пачек.
+    Статусы: added (фильм уже был в базе), queued (новый — заглушка, job_id — задача загрузки),
+    already_in_room, duplicate, invalid.
+    """
+    summary = {"added": 0, "queued": 0, "already_in_room": 0, "duplicate": 0, "invalid": 0}
+
+    def event(payload: dict) -> dict:
+        summary[payload["status"]] += 1
+        return payload
+
+    async with AsyncSessionLocal() as db:
+        resolved = await resolve_kinopoisk_urls(db, urls)
+
+    items: list[ImportItem] = []
+    seen_ids = set()
+    for url in urls:
+        found = resolved[url]
+        if found is None:
+            yield event({"url": url, "status": "invalid", "error": "Некорректная ссылка на Кинопоиск"})
+            continue
+        kinopoisk_id = found.kinopoisk_id if isinstance(found, Movie) else found
+        if kinopoisk_id in seen_ids:
+            yield event({"url": url, "kinopoisk_id": kinopoisk_id, "status": "duplicate"})
+            continue
+        seen_ids.add(kinopoisk_id)
+        items.append(ImportItem(url, kinopoisk_id))
+
+    # Кинопоиск здесь не вызывается: каждая пачка — одна транзакция, и импорт заканчивается за время записи
+    for start in range(0, len(items), IMPORT_BATCH_SIZE):
+        for payload in await _write_batch(room_id, added_by, items[start:start + IMPORT_BATCH_SIZE]):
+            yield event(payload)
+
+    yield {"status": "done", "summary": summary}
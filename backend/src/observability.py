@@ -0,0 +1,405 @@
+"""
+Метрики и профилирование запросов.
+
+- ObservabilityMiddleware (ASGI, подключается в main.py) на каждый HTTP-запрос:
+  гистограмма длительности по маршруту (шаблон пути, а не конкретный URL), число SQL-запросов и время в БД,
+  время исходящих вызовов (Кинопоиск, постеры) и рендера шаблонов — в структурированном логе запроса
+- SQL считается событиями SQLAlchemy (before/after_cursor_execute) на sync и async engine,
+  исходящие HTTP — транспортом MeteredTransport общего httpx-клиента (время до заголовков ответа)
+- Счётчики запроса лежат в contextvar: видны и в async-эндпоинтах, и в sync-эндпоинтах в пуле потоков
+- GET /metrics — всё в текстовом формате Prometheus, включая счётчики кэшей (register_stats)
+- Сэмплирующий профайлер (PROFILER_ENABLED=true): пока есть запросы в работе, поток раз в
+  PROFILER_INTERVAL_MS снимает стеки всех потоков. Для запроса дольше PROFILER_SLOW_MS стеки за время
+  запроса пишутся в PROFILER_DIR в свёрнутом формате (flamegraph.pl, speedscope).
+  Запросы делят один event loop — в дамп попадает всё, что процесс делал в это время, а не только этот запрос
+- Логи — одна JSON-строка на событие в stdout (log_event); ACCESS_LOG=false отключает строку на каждый запрос
+
+Выключенный профайлер ничего не запускает; остальное — несколько perf_counter() и словарей на запрос.
+"""
+import bisect
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable
+
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from database import engine, async_engine, env_bool, env_int
+
+load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+ACCESS_LOG = env_bool("ACCESS_LOG", True)
+PROFILER_ENABLED = env_bool("PROFILER_ENABLED", False)
+PROFILER_INTERVAL_MS = env_int("PROFILER_INTERVAL_MS", 5)
+PROFILER_SLOW_MS = env_int("PROFILER_SLOW_MS", 500)
+PROFILER_DIR = os.getenv("PROFILER_DIR", os.path.join("cache", "profiles"))
+PROFILER_WINDOW_SECONDS = env_int("PROFILER_WINDOW_SECONDS", 30)  # сколько секунд стеков держать в памяти
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+# --- структурированные логи ---
+
+logger = logging.getLogger("movierater")
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = {"ts": round(record.created, 3), "level": record.levelname.lower(), "event": record.getMessage()}
+        line.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            line["exc"] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+
+def _configure_logger() -> None:
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+_configure_logger()
+
+
+def log_event(event_name: str, level: int = logging.INFO, exc_info: bool = False, **fields) -> None:
+    """Одна JSON-строка: {"ts", "level", "event", **fields}."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event_name, exc_info=exc_info, extra={"fields": fields})
+
+
+# --- метрики в формате Prometheus ---
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма Prometheus с метками: счётчики по корзинам, сумма и количество."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: dict[tuple, list] = {}  # метки -> [счётчики корзин (+Inf последним), сумма, количество]
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self._series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                bucket_labels = _format_labels((*self.label_names, "le"), (*labels, le))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Длительность HTTP-запроса по маршруту",
+                            ("method", "route", "status"), LATENCY_BUCKETS)
+REQUEST_SQL_STATEMENTS = Histogram("http_request_sql_statements", "Число SQL-запросов на HTTP-запрос",
+                                   ("method", "route"), SQL_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Время в БД на HTTP-запрос",
+                               ("method", "route"), LATENCY_BUCKETS)
+SQL_SECONDS = Histogram("db_statement_duration_seconds", "Длительность SQL-запроса",
+                        ("engine",), LATENCY_BUCKETS)
+OUTBOUND_SECONDS = Histogram("http_outbound_duration_seconds", "Исходящие HTTP-запросы до получения заголовков",
+                             ("host", "status"), LATENCY_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_DB_SECONDS, SQL_SECONDS, OUTBOUND_SECONDS)
+
+_stats_sources: list[tuple[str, Callable[[], dict]]] = []
+_collectors: list[Callable[[], list[str]]] = []
+
+
+def register_stats(prefix: str, stats: Callable[[], dict]) -> None:
+    """Числовые поля stats() (как у /metrics/*-эндпоинтов) попадут в /metrics гаугами movierater_<prefix>_<поле>."""
+    _stats_sources.append((prefix, stats))
+
+
+def register_collector(collector: Callable[[], list[str]]) -> None:
+    """Произвольные строки в формате Prometheus (для метрик, которые не укладываются в register_stats)."""
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    for prefix, stats in _stats_sources:
+        for key, value in stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = re.sub(r"[^a-zA-Z0-9_]", "_", f"movierater_{prefix}_{key}")
+            lines += [f"# TYPE {name} gauge", f"{name} {_format_value(value)}"]
+    for collector in _collectors:
+        lines += collector()
+    return "\n".join(lines) + "\n"
+
+
+# --- счётчики текущего запроса ---
+
+@dataclass
+class RequestStats:
+    sql_statements: int = 0
+    sql_seconds: float = 0.0
+    outbound_calls: int = 0
+    outbound_seconds: float = 0.0
+    template_seconds: float = 0.0
+
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> RequestStats | None:
+    """Счётчики HTTP-запроса, в контексте которого идёт выполнение; None — вне запроса (фон, скрипты)."""
+    return _request_stats.get()
+
+
+def _instrument_engine(target, label: str) -> None:
+    """Время каждого SQL-запроса: в гистограмму по engine и в счётчики текущего HTTP-запроса."""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        finish(conn)
+
+    def handle_error(exception_context) -> None:
+        if exception_context.connection is not None:
+            finish(exception_context.connection)
+
+    def finish(conn) -> None:
+        started = conn.info.get("query_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        SQL_SECONDS.observe((label,), elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_seconds += elapsed
+
+    event.listen(target, "before_cursor_execute", before_cursor_execute)
+    event.listen(target, "after_cursor_execute", after_cursor_execute)
+    event.listen(target, "handle_error", handle_error)
+
+
+_instrument_engine(engine, "sync")
+_instrument_engine(async_engine.sync_engine, "async")
+
+
+# --- исходящие HTTP ---
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """Обёртка транспорта httpx: время до заголовков ответа (тело постера стримится отдельно)."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            OUTBOUND_SECONDS.observe((request.url.host, status), elapsed)
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.outbound_calls += 1
+                stats.outbound_seconds += elapsed
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+# --- сэмплирующий профайлер ---
+
+class SamplingProfiler:
+    """
+    Фоновый поток снимает sys._current_frames() раз в interval секунд, пока есть активные запросы.
+    Стеки копятся в окне последних window секунд; медленный запрос выгружает свою часть окна в файл.
+    """
+
+    def __init__(self, interval: float, slow_seconds: float, directory: str, window: float):
+        self.interval = interval
+        self.slow_seconds = slow_seconds
+        self.directory = directory
+        self._samples: deque[tuple[float, str]] = deque(maxlen=max(1, int(window / interval)))
+        self._active = 0
+        self._lock = threading.Lock()
+        self._samples_lock = threading.Lock()  # окно пишет поток профайлера, читают выгрузки медленных запросов
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.dumps = 0
+
+    def request_started(self) -> None:
+        with self._lock:
+            self._active += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def request_finished(self, started: float, elapsed: float, method: str, route: str) -> str | None:
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self._wake.clear()
+        if elapsed < self.slow_seconds:
+            return None
+        return self._dump(started, started + elapsed, method, route, elapsed)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [_fold_stack(names.get(ident, str(ident)), frame)
+                      for ident, frame in sys._current_frames().items() if ident != own]
+            with self._samples_lock:
+                self._samples.extend((now, stack) for stack in stacks)
+            time.sleep(self.interval)
+
+    def _dump(self, started: float, finished: float, method: str, route: str, elapsed: float) -> str | None:
+        counts: dict[str, int] = {}
+        with self._samples_lock:
+            samples = list(self._samples)
+        for taken, stack in samples:
+            if started <= taken <= finished:
+                counts[stack] = counts.get(stack, 0) + 1
+        if not counts:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r"[^a-zA-Z0-9_-]+", "_", f"{method}{route}").strip("_")
+        path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{name}-{int(elapsed * 1000)}ms.folded")
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        self.dumps += 1
+        return path
+
+
+def _fold_stack(thread_name: str, frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name}@{os.path.basename(code.co_filename)}:{frame.f_lineno}")
+        frame = frame.f_back
+    # Пробел в свёрнутом формате отделяет счётчик — в именах потоков его быть не должно
+    return ";".join([thread_name.replace(" ", "_"), *reversed(frames)])
+
+
+profiler = SamplingProfiler(PROFILER_INTERVAL_MS / 1000, PROFILER_SLOW_MS / 1000, PROFILER_DIR,
+                            PROFILER_WINDOW_SECONDS) if PROFILER_ENABLED else None
+
+
+# --- middleware ---
+
+def _route_label(scope) -> str:
+    """Шаблон пути маршрута (/rooms/{room_id}), для смонтированных приложений — префикс (/static)."""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    return scope.get("root_path") or "unmatched"
+
+
+class ObservabilityMiddleware:
+    """ASGI-middleware (без BaseHTTPMiddleware: не ломает стриминг и не создаёт лишних задач)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        response = {"status": 500, "stream": False}
+
+        async def send_with_status(message) -> None:
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                content_type = dict(message.get("headers") or ()).get(b"content-type", b"")
+                response["stream"] = content_type.startswith(b"text/event-stream")
+            await send(message)
+
+        if profiler is not None:
+            profiler.request_started()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            self._record(scope, stats, response, started, elapsed)
+
+    @staticmethod
+    def _record(scope, stats: RequestStats, response: dict, started: float, elapsed: float) -> None:
+        method, route = scope["method"], _route_label(scope)
+        profile = profiler.request_finished(started, elapsed, method, route) if profiler is not None else None
+        if not response["stream"]:
+            # SSE-подписка живёт минутами — в гистограмме задержек она только мешает
+            REQUEST_SECONDS.observe((method, route, str(response["status"])), elapsed)
+        REQUEST_SQL_STATEMENTS.observe((method, route), stats.sql_statements)
+        REQUEST_DB_SECONDS.observe((method, route), stats.sql_seconds)
+        if ACCESS_LOG or profile:
+            log_event(
+                "request",
+                method=method,
+                route=route,
+                path=scope["path"],
+                status=response["status"],
+                duration_ms=round(elapsed * 1000, 2),
+                sql_statements=stats.sql_statements,
+                sql_ms=round(stats.sql_seconds * 1000, 2),
+                outbound_calls=stats.outbound_calls,
+                outbound_ms=round(stats.outbound_seconds * 1000, 2),
+                template_ms=round(stats.template_seconds * 1000, 2),
+                **({"profile": profile} if profile else {}),
+            )
@@ -0,0 +1,216 @@
+"""
+Хранилище постеров в static/film_posters.
+
+1. Картинка качается потоком (POSTER_CHUNK_SIZE байт за раз) во временный файл,
+   запись и хеширование идут в потоке, а не в event loop — память на загрузку не зависит от размера картинки
+2. Имя файла — sha256 содержимого: одинаковые картинки (одна заглушка у разных фильмов) хранятся один раз
+3. Готовый файл появляется атомарно (os.replace), недокачанный никогда не виден по своему имени
+4. Для каждой исходной ссылки запоминается, в какой файл она сохранилась (.sources/),
+   повторная загрузка того же постера не идёт в сеть
+5. Отдаётся URL (/static/film_posters/<sha256>.<ext>), а не путь в файловой системе
+
+Файлы с хешем в имени не меняются никогда, поэтому StaticFiles отдаёт их с immutable-кэшем.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from typing import BinaryIO
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+from http_client import get_http_client, POSTER_TIMEOUT
+
+load_dotenv()
+STATIC_DIR = "static"
+STATIC_URL = "/static"
+POSTERS_DIR = os.path.join(STATIC_DIR, "film_posters")
+POSTER_SOURCES_DIR = os.path.join(POSTERS_DIR, ".sources")
+
+POSTER_CHUNK_SIZE = int(os.getenv("POSTER_CHUNK_SIZE", 64 * 1024))
+POSTER_MAX_BYTES = int(os.getenv("POSTER_MAX_BYTES", 20 * 1024 * 1024))
+# Cache-Control для /static: постеры с хешем в имени — навсегда, остальное — ненадолго
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 60 * 60))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "image/avif": "avif",
+}
+DEFAULT_EXTENSION = "jpg"
+
+_CONTENT_ADDRESSED_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+
+def is_content_addressed(file_name: str) -> bool:
+    """Имя вида <sha256>.<ext>: содержимое такого файла никогда не меняется."""
+    return bool(_CONTENT_ADDRESSED_NAME.match(file_name))
+
+
+def poster_extension(poster_url: str, content_type: str | None = None) -> str:
+    """Расширение по Content-Type, иначе по пути ссылки (без query и fragment)."""
+    if content_type:
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower())
+        if extension:
+            return extension
+    _, extension = os.path.splitext(urlsplit(poster_url).path)
+    extension = extension.lstrip(".").lower()
+    if extension == "jpeg":
+        extension = "jpg"
+    return extension if extension in CONTENT_TYPE_EXTENSIONS.values() else DEFAULT_EXTENSION
+
+
+def static_url(file_path: str) -> str:
+    """static/film_posters/x.jpg -> /static/film_posters/x.jpg"""
+    relative = os.path.relpath(file_path, STATIC_DIR).replace(os.sep, "/")
+    return f"{STATIC_URL}/{relative}"
+
+
+def public_url(stored: str | None, default: str | None = None) -> str | None:
+    """
+    URL постера из значения в БД. Старые записи хранят путь без ведущего слеша (static/film_posters/...,
+    в том числе с "\\" из os.path.join на Windows), новые — готовый URL; в шаблоны и JSON всегда уходит абсолютный путь.
+    """
+    if not stored:
+        return default
+    if "://" in stored:
+        return stored
+    return "/" + stored.replace("\\", "/").lstrip("/")
+
+
+def _source_marker_path(poster_url: str) -> str:
+    return os.path.join(POSTER_SOURCES_DIR, hashlib.sha256(poster_url.encode()).hexdigest())
+
+
+def _lookup_saved(poster_url: str) -> str | None:
+    """Файл, в который эта ссылка уже была сохранена, если он на месте."""
+    try:
+        with open(_source_marker_path(poster_url), encoding="utf-8") as f:
+            file_name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    file_path = os.path.join(POSTERS_DIR, file_name)
+    return file_path if os.path.isfile(file_path) else None
+
+
+def _remember_saved(poster_url: str, file_path: str) -> None:
+    marker = _source_marker_path(poster_url)
+    _write_atomic(marker, os.path.basename(file_path).encode())
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+
+
+def _open_temp() -> tuple[BinaryIO, str]:
+    # Временный файл в той же папке: os.replace тогда атомарен (одна файловая система)
+    os.makedirs(POSTERS_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=POSTERS_DIR, prefix=".tmp-", suffix=".part")
+    return os.fdopen(fd, "wb"), tmp_path
+
+
+def _write_chunk(f: BinaryIO, digest, chunk: bytes) -> None:
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def _commit_temp(f: BinaryIO, tmp_path: str, file_path: str) -> None:
+    f.close()
+    if os.path.exists(file_path):
+        # Такая картинка уже есть (тот же хеш) — дубликат не нужен
+        _remove_quietly(tmp_path)
+    else:
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+
+
+def _discard_temp(f: BinaryIO, tmp_path: str) -> None:
+    f.close()
+    _remove_quietly(tmp_path)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def save_poster(poster_url: str) -> str:
+    """Сохраняет постер по ссылке и возвращает его URL на /static."""
+    saved = await asyncio.to_thread(_lookup_saved, poster_url)
+    if saved:
+        return static_url(saved)
+
+    try:
+        async with get_http_client().stream("GET", poster_url, follow_redirects=True, timeout=POSTER_TIMEOUT) as response:
+            if response.is_error:
+                await response.aread()
+                raise HTTPException(status_code=response.status_code, detail=response.text)
+
+            extension = poster_extension(str(response.url), response.headers.get("content-type"))
+            f, tmp_path = await asyncio.to_thread(_open_temp)
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                async for chunk in response.aiter_bytes(POSTER_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > POSTER_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail="Постер слишком большой")
+                    await asyncio.to_thread(_write_chunk, f, digest, chunk)
+            except BaseException:
+                await asyncio.to_thread(_discard_temp, f, tmp_path)
+                raise
+
+    except httpx.RequestError:
+        raise HTTPException(
+            status_code=502,
+            detail="External API unavailable",
+        )
+
+    file_path = os.path.join(POSTERS_DIR, f"{digest.hexdigest()}.{extension}")
+    await asyncio.to_thread(_commit_temp, f, tmp_path, file_path)
+    await asyncio.to_thread(_remember_saved, poster_url, file_path)
+    return static_url(file_path)
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles с Cache-Control. ETag/Last-Modified и ответ 304 на If-None-Match даёт сам Starlette;
+    для файлов с хешем содержимого в имени ETag — сам хеш.
+    """
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200):
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        file_name = os.path.basename(full_path)
+        if is_content_addressed(file_name):
+            response.headers["ETag"] = f'"{file_name.split(".")[0]}"'
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}"
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,255 @@
+"""
+Уменьшенные копии постеров под ширину экрана.
+
+URL: /posters/{width}/{format}/{file_name}, где file_name — файл из static/film_posters,
+width — одна из POSTER_VARIANT_WIDTHS, format — webp или jpg. Пример:
+    /posters/320/webp/f8e72b95...c42ab.jpg
+
+- Копия генерируется при первом запросе в пуле процессов (Pillow держит GIL, в event loop не попадает)
+- Готовые копии лежат в POSTER_VARIANTS_DIR, общий размер ограничен POSTER_VARIANTS_MAX_BYTES,
+  при превышении удаляются давно не запрашивавшиеся (LRU по времени последнего обращения)
+- Одновременные запросы одной копии ждут одну генерацию (SingleFlight)
+- Копии постеров с хешем в имени не меняются, отдаются с immutable-кэшем
+
+Счётчики — GET /metrics/poster-variants.
+"""
+import asyncio
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+
+from caching import SingleFlight
+from poster_storage import POSTERS_DIR, public_url
+
+load_dotenv()
+POSTER_VARIANT_WIDTHS = tuple(int(w) for w in os.getenv("POSTER_VARIANT_WIDTHS", "160,320,640").split(","))
+POSTER_VARIANTS_DIR = os.getenv("POSTER_VARIANTS_DIR", os.path.join("cache", "poster_variants"))
+POSTER_VARIANTS_MAX_BYTES = int(os.getenv("POSTER_VARIANTS_MAX_BYTES", 256 * 1024 * 1024))
+POSTER_VARIANT_WORKERS = int(os.getenv("POSTER_VARIANT_WORKERS", 2))
+
+# format в URL -> (формат Pillow, параметры сохранения, media type)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}, "image/webp"),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}, "image/jpeg"),
+}
+
+_SOURCE_NAME = re.compile(r"^[\w-]+\.[a-z0-9]+$")
+_POSTERS_URL_PREFIX = "/static/film_posters/"
+
+
+def render_variant(source_path: str, target_path: str, width: int, image_format: str) -> int:
+    """Выполняется в процессе пула: уменьшает картинку до ширины width и пишет в target_path. Возвращает размер."""
+    pil_format, save_options, _ = VARIANT_FORMATS[image_format]
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(target_path, pil_format, **save_options)
+    return os.path.getsize(target_path)
+
+
+class DiskLRU:
+    """Учёт файлов в каталоге кэша: имя -> размер в порядке обращений. Используется только из event loop."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self.total_bytes = 0
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _scan(self) -> list[tuple[str, int]]:
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".tmp-"):
+                # Недописанная копия после падения процесса
+                _remove_files([entry.path])
+            elif entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        return [(name, size) for _, name, size in sorted(files)]
+
+    async def load(self) -> None:
+        """Восстанавливает порядок по mtime (при обращении файл «трогается»), чтобы LRU переживал рестарт."""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            for name, size in await asyncio.to_thread(self._scan):
+                self._entries[name] = size
+                self.total_bytes += size
+            self._loaded = True
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    async def get(self, name: str) -> str | None:
+        await self.load()
+        if name not in self._entries:
+            self.misses += 1
+            return None
+        path = self.path(name)
+        try:
+            await asyncio.to_thread(os.utime, path)
+        except FileNotFoundError:
+            # Удалён снаружи — забываем и генерируем заново
+            self.total_bytes -= self._entries.pop(name)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(name)
+        self.hits += 1
+        return path
+
+    async def add(self, name: str, size: int) -> None:
+        await self.load()
+        self.total_bytes += size - self._entries.pop(name, 0)
+        self._entries[name] = size
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            old_name, old_size = self._entries.popitem(last=False)
+            self.total_bytes -= old_size
+            evicted.append(self.path(old_name))
+        if evicted:
+            self.evictions += len(evicted)
+            await asyncio.to_thread(_remove_files, evicted)
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _remove_files(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _new_temp_path(directory: str, suffix: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=suffix)
+    os.close(fd)
+    return tmp_path
+
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POSTER_VARIANT_WORKERS)
+    return _pool
+
+
+def close_process_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class PosterVariants:
+    def __init__(self, cache: DiskLRU):
+        self.cache = cache
+        self.single_flight = SingleFlight()
+        self.generated = 0
+
+    async def get_path(self, file_name: str, width: int, image_format: str) -> str:
+        """Путь к готовой копии; HTTPException(404), если такой копии не бывает или нет исходника."""
+        if width not in POSTER_VARIANT_WIDTHS or image_format not in VARIANT_FORMATS or not _SOURCE_NAME.match(file_name):
+            raise HTTPException(status_code=404, detail="Not found")
+
+        name = f"{file_name}.{width}.{image_format}"
+        path = await self.cache.get(name)
+        if path:
+            return path
+        return await self.single_flight.do(name, lambda: self._generate(name, file_name, width, image_format))
+
+    async def _generate(self, name: str, file_name: str, width: int, image_format: str) -> str:
+        source_path = os.path.join(POSTERS_DIR, file_name)
+        if not await asyncio.to_thread(os.path.isfile, source_path):
+            raise HTTPException(status_code=404, detail="Not found")
+
+        target_path = self.cache.path(name)
+        tmp_path = await asyncio.to_thread(_new_temp_path, self.cache.directory, f".{image_format}")
+        try:
+            size = await asyncio.get_running_loop().run_in_executor(
+                get_process_pool(), render_variant, source_path, tmp_path, width, image_format
+            )
+            await asyncio.to_thread(os.replace, tmp_path, target_path)
+        except OSError:
+            # Исходник не картинка (Pillow: UnidentifiedImageError) или не читается
+            await asyncio.to_thread(_remove_files, [tmp_path])
+            raise HTTPException(status_code=404, detail="Not found")
+        except BaseException:
+            await asyncio.to_thread(_remove_files, [tmp_path])
+            raise
+
+        self.generated += 1
+        await self.cache.add(name, size)
+        return target_path
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "generated": self.generated, "coalesced": self.single_flight.coalesced}
+
+
+poster_variants = PosterVariants(DiskLRU(POSTER_VARIANTS_DIR, POSTER_VARIANTS_MAX_BYTES))
+
+
+def media_type_for(image_format: str) -> str:
+    return VARIANT_FORMATS[image_format][2]
+
+
+def poster_variant_url(stored: str | None, width: int, image_format: str = "jpg", default: str | None = None) -> str | None:
+    """
+    URL уменьшенной копии постера из значения в БД.
+    Для внешних ссылок и заглушки копий нет — возвращается обычный URL.
+    """
+    url = public_url(stored, default)
+    if not url or not url.startswith(_POSTERS_URL_PREFIX):
+        return url
+    return f"/posters/{width}/{image_format}/{url[len(_POSTERS_URL_PREFIX):]}"
+
+
+def poster_srcset(stored: str | None, image_format: str = "jpg", default: str | None = None) -> str | None:
+    """srcset со всеми ширинами: браузер сам выбирает копию по sizes и плотности экрана."""
+    url = public_url(stored, default)
+    if not url or not url.startswith(_POSTERS_URL_PREFIX):
+        return url
+    return ", ".join(f"{poster_variant_url(url, width, image_format)} {width}w" for width in POSTER_VARIANT_WIDTHS)
+
+
+def movie_card(movie) -> dict:
+    """Фильм с URL постеров для карточек Mini App (оценка, очередь, события комнаты)."""
+    return {
+        "id": movie.id,
+        "title": movie.title,
+        "poster_url": poster_variant_url(movie.poster_url, 320, "jpg", "/static/default.jpg"),
+        "poster_srcset": {
+            image_format: poster_srcset(movie.poster_url, image_format, "/static/default.jpg")
+            for image_format in ("webp", "jpg")
+        },
+    }
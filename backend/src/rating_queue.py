@@ -0,0 +1,79 @@
+"""
+Очередь следующих неоценённых фильмов пользователя в комнате.
+
+Вместо полного anti-join по всей комнате на каждый показ фильма держим для пары (комната, пользователь)
+пачку из RATING_QUEUE_SIZE id фильмов по порядку добавления и курсор (added_date, movie_id) — позицию,
+до которой комната уже просмотрена. Выдача следующего фильма — один запрос по первичным ключам
+среди id из очереди (services.get_next_unrated_movie_for_user), дозаполнение — индексный диапазон после курсора.
+
+Инвалидация:
+- оценка: после коммита фильм убирается из очереди (mark_rated). Оценки из других процессов
+  отсеиваются тем же запросом выдачи — он всегда проверяет ratings;
+- новый фильм: added_date у него самый поздний, он всегда после курсора и попадёт в очередь
+  при следующем дозаполнении — сбрасывать ничего не нужно;
+- фильмы, добавленные с прошлой added_date (восстановление комнаты), — очередь сбрасывается (reset_rating_queue).
+Из очереди фильм удаляется, только когда он точно оценён.
+
+Курсор — не закоммиченная последовательность: на PostgreSQL фильм с меньшим (added_date, movie_id) может
+закоммититься позже того, как дозаполнение уже прочитало соседей после него, и курсор его пройдёт.
+Поэтому, когда после курсора пусто, выдача один раз перепроверяет всю комнату и возвращает такие фильмы в очередь.
+Полный anti-join случается только у пользователя, оценившего всё, — обычная выдача остаётся по очереди.
+
+Очередь общая для одновременных запросов пары, а выдача ждёт БД между чтением и правкой очереди.
+Поэтому дозаполнение не добавляет уже стоящие в очереди id и двигает курсор только вперёд
+(два наложившихся дозаполнения не дают дублей), а выдача идёт по id, а не по позиции в списке
+(mark_rated из другого запроса посередине не сдвигает её и не пропускает фильм).
+"""
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from caching import TTLCache
+
+load_dotenv()
+RATING_QUEUE_SIZE = int(os.getenv("RATING_QUEUE_SIZE", 20))
+RATING_QUEUE_CACHE_SIZE = int(os.getenv("RATING_QUEUE_CACHE_SIZE", 10_000))
+RATING_QUEUE_TTL = int(os.getenv("RATING_QUEUE_TTL", 30 * 60))
+
+
+@dataclass
+class RatingQueue:
+    movie_ids: list[int] = field(default_factory=list)  # в порядке (added_date, movie_id)
+    cursor: tuple[datetime, int] | None = None  # позиция последнего фильма, взятого в очередь
+
+    def extend(self, rows) -> None:
+        """Строки дозаполнения (movie_id, added_date) по порядку: после cursor или перепроверка всей комнаты."""
+        queued = set(self.movie_ids)
+        self.movie_ids.extend(row.movie_id for row in rows if row.movie_id not in queued)
+        last = (rows[-1].added_date, rows[-1].movie_id)
+        if self.cursor is None or last > self.cursor:
+            self.cursor = last
+
+    def discard(self, movie_id: int) -> None:
+        if movie_id in self.movie_ids:
+            self.movie_ids.remove(movie_id)
+
+
+rating_queues = TTLCache(maxsize=RATING_QUEUE_CACHE_SIZE, ttl=RATING_QUEUE_TTL)
+
+
+def get_rating_queue(room_id: str, user_id: int) -> RatingQueue:
+    queue = rating_queues.get((room_id, user_id))
+    if queue is None:
+        queue = RatingQueue()
+        rating_queues.set((room_id, user_id), queue)
+    return queue
+
+
+def mark_rated(room_id: str, user_id: int, movie_id: int) -> None:
+    """Вызывается после коммита оценки."""
+    queue = rating_queues.get((room_id, user_id))
+    if queue is not None:
+        queue.discard(movie_id)
+
+
+def reset_rating_queue(room_id: str, user_id: int) -> None:
+    """Фильмы добавлены не в конец комнаты (восстановление из файла, room_export.py): очередь собирается заново."""
+    rating_queues.delete((room_id, user_id))
@@ -0,0 +1,283 @@
+"""
+Рекомендации «что смотреть дальше» внутри комнаты: неоценённые фильмы по предсказанной оценке всей группы.
+
+Коллаборативная фильтрация user-user по оценкам комнаты:
+- сходство участников — корреляция Пирсона по общим фильмам, ослабленная при малом числе общих
+  (common / (common + RECOMMENDER_SHRINK)); пары меньше чем с RECOMMENDER_MIN_COMMON общими не учитываются
+- предсказание участнику u фильма m: его средняя + взвешенное сходством отклонение оценок соседей
+  от их средних; никто из соседей фильм не оценил — среднее отклонение фильма (сжатое к 0)
+- оценка группы для фильма — среднее по участникам: своя оценка, если есть, иначе предсказанная
+
+Индекс комнаты (RoomIndex) — матрица оценок и попарные суммы участников (число общих фильмов, суммы оценок,
+квадратов и произведений по общим фильмам), из которых корреляция считается без обхода фильмов.
+Новая оценка (record_rating после коммита) правит одну клетку матрицы и пересчитывает одну строку
+и один столбец попарных сумм — O(участники x фильмы), без чтения БД. Предсказания (одно матричное
+произведение участники x участники x фильмы) считаются при первом запросе после изменения — в потоке
+(asyncio.to_thread, как compute_room_stats) по копии матриц: оценки тем временем правят индекс в event loop.
+Из БД индекс строится один раз на комнату и не дольше RECOMMENDER_TTL — страховка для оценок из других процессов.
+Для комнаты на тысячи фильмов и десятки участников всё это — миллисекунды (tests/load/recommender_bench.py).
+
+Используется в GET /rooms/{room_id}/recommendations и GET /rooms/{room_id}/queue?order=recommended.
+Счётчики — GET /metrics/recommender.
+"""
+import asyncio
+import os
+from dataclasses import dataclass
+
+import numpy as np
+from dotenv import load_dotenv
+
+from caching import KeyVersions, SingleFlight, TTLCache
+from room_stats import load_room_ratings, RoomRatings
+
+load_dotenv()
+RECOMMENDER_TTL = int(os.getenv("RECOMMENDER_TTL", 30 * 60))
+RECOMMENDER_CACHE_SIZE = int(os.getenv("RECOMMENDER_CACHE_SIZE", 256))
+RECOMMENDER_MIN_COMMON = int(os.getenv("RECOMMENDER_MIN_COMMON", 3))
+RECOMMENDER_SHRINK = float(os.getenv("RECOMMENDER_SHRINK", 10))
+RECOMMENDER_ITEM_SHRINK = float(os.getenv("RECOMMENDER_ITEM_SHRINK", 2))
+
+MAX_SCORE = 10
+
+
+@dataclass
+class Predictions:
+    user_ids: np.ndarray  # (U,)
+    movie_ids: np.ndarray  # (M,)
+    user_mean: np.ndarray  # (U,)
+    item_offset: np.ndarray  # (M,) среднее отклонение оценок фильма от средних участников
+    scores: np.ndarray  # (U, M) своя оценка или предсказанная
+    group: np.ndarray  # (M,) оценка группы
+    prior: float  # оценка группы для фильма без оценок
+
+
+class RoomIndex:
+    """
+    Матрица оценок комнаты и попарные суммы участников по общим фильмам.
+    known[i, m] — 1, если i оценил m; values — оценки (0 там, где оценки нет).
+    common[i, j] = known[i] @ known[j], sum_x[i, j] = values[i] @ known[j],
+    sum_xx[i, j] = values[i]² @ known[j], sum_xy[i, j] = values[i] @ values[j].
+    """
+
+    def __init__(self, ratings: RoomRatings):
+        rated = ~np.isnan(ratings.scores)
+        self.user_ids = ratings.user_ids.copy()
+        self.movie_ids = ratings.movie_ids.copy()
+        self.known = rated.astype(np.float64)
+        self.values = np.where(rated, ratings.scores, 0).astype(np.float64)
+        squares = self.values * self.values
+        self.common = self.known @ self.known.T
+        self.sum_x = self.values @ self.known.T
+        self.sum_xx = squares @ self.known.T
+        self.sum_xy = self.values @ self.values.T
+        self.version = 0  # версия комнаты в RoomRecommender, которой соответствует индекс
+        self._predictions: Predictions | None = None
+
+    @property
+    def stale(self) -> bool:
+        """Предсказания нужно пересчитать."""
+        return self._predictions is None
+
+    def snapshot(self) -> "RoomIndex":
+        """Копия матриц для расчёта предсказаний в потоке."""
+        copy = object.__new__(RoomIndex)
+        for name in ("user_ids", "movie_ids", "known", "values", "common", "sum_x", "sum_xx", "sum_xy"):
+            setattr(copy, name, getattr(self, name).copy())
+        copy.version = self.version
+        copy._predictions = None
+        return copy
+
+    async def compute_predictions(self) -> Predictions:
+        """predictions() вне event loop. Результат остаётся в индексе, если за время расчёта его не правили."""
+        snapshot = self.snapshot()
+        predictions = await asyncio.to_thread(snapshot.predictions)
+        if self.version == snapshot.version and self._predictions is None:
+            self._predictions = predictions
+        return predictions
+
+    def _insert_user(self, row: int, user_id: int) -> None:
+        self.user_ids = np.insert(self.user_ids, row, user_id)
+        self.known = np.insert(self.known, row, 0, axis=0)
+        self.values = np.insert(self.values, row, 0, axis=0)
+        for name in ("common", "sum_x", "sum_xx", "sum_xy"):
+            pairwise = getattr(self, name)
+            setattr(self, name, np.insert(np.insert(pairwise, row, 0, axis=0), row, 0, axis=1))
+
+    def _insert_movie(self, column: int, movie_id: int) -> None:
+        # Новый столбец без оценок попарные суммы не меняет
+        self.movie_ids = np.insert(self.movie_ids, column, movie_id)
+        self.known = np.insert(self.known, column, 0, axis=1)
+        self.values = np.insert(self.values, column, 0, axis=1)
+
+    def update(self, user_id: int, movie_id: int, score: float | None) -> None:
+        """Оценка (None — снята или пропуск): одна клетка матрицы, строка и столбец попарных сумм участника."""
+        row = int(np.searchsorted(self.user_ids, user_id))
+        if row == len(self.user_ids) or self.user_ids[row] != user_id:
+            if score is None:
+                return
+            self._insert_user(row, user_id)
+        column = int(np.searchsorted(self.movie_ids, movie_id))
+        if column == len(self.movie_ids) or self.movie_ids[column] != movie_id:
+            if score is None:
+                return
+            self._insert_movie(column, movie_id)
+
+        self.known[row, column] = 0 if score is None else 1
+        self.values[row, column] = 0 if score is None else score
+        known, values = self.known, self.values
+        k, v = known[row], values[row]
+        self.common[row, :] = self.common[:, row] = known @ k
+        self.sum_x[row, :] = known @ v
+        self.sum_x[:, row] = values @ k
+        self.sum_xx[row, :] = known @ (v * v)
+        self.sum_xx[:, row] = (values * values) @ k
+        self.sum_xy[row, :] = self.sum_xy[:, row] = values @ v
+        self._predictions = None
+
+    def similarity(self) -> np.ndarray:
+        """(U, U) корреляция Пирсона по общим фильмам с ослаблением; 0 — мало общих или нет разброса, и на диагонали."""
+        common, sum_x, sum_xx, sum_xy = self.common, self.sum_x, self.sum_xx, self.sum_xy
+        sum_y, sum_yy = sum_x.T, sum_xx.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = common * sum_xy - sum_x * sum_y
+            variance = (common * sum_xx - sum_x ** 2) * (common * sum_yy - sum_y ** 2)
+            correlation = np.where(
+                (common >= RECOMMENDER_MIN_COMMON) & (variance > 0),
+                covariance / np.sqrt(variance), 0.0,
+            )
+        weights = np.clip(correlation, -1, 1) * common / (common + RECOMMENDER_SHRINK)
+        np.fill_diagonal(weights, 0)
+        return weights
+
+    def predictions(self) -> Predictions:
+        if self._predictions is not None:
+            return self._predictions
+        known, values = self.known, self.values
+        counts = known.sum(axis=1)
+        total = counts.sum()
+        room_mean = values.sum() / total if total else MAX_SCORE / 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            user_mean = np.where(counts > 0, values.sum(axis=1) / counts, room_mean)
+        centered = known * (values - user_mean[:, None])
+        item_offset = centered.sum(axis=0) / (known.sum(axis=0) + RECOMMENDER_ITEM_SHRINK)
+
+        weights = self.similarity()
+        numerator = weights @ centered
+        denominator = np.abs(weights) @ known
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deviation = np.where(denominator > 0, numerator / denominator, item_offset[None, :])
+        predicted = np.clip(user_mean[:, None] + deviation, 0, MAX_SCORE)
+        scores = np.where(known > 0, values, predicted)
+
+        self._predictions = Predictions(
+            user_ids=self.user_ids,
+            movie_ids=self.movie_ids,
+            user_mean=user_mean,
+            item_offset=item_offset,
+            scores=scores,
+            group=scores.mean(axis=0) if len(self.user_ids) else np.full(len(self.movie_ids), room_mean),
+            prior=float(user_mean.mean()) if len(self.user_ids) else room_mean,
+        )
+        return self._predictions
+
+
+def rank_movies(predictions: Predictions, user_id: int, movie_ids: list[int]) -> list[tuple[int, float, float]]:
+    """
+    (movie_id, оценка группы, предсказание для user_id) по убыванию оценки группы.
+    Фильмы без оценок в комнате — по prior; при равенстве сохраняется порядок movie_ids (порядок добавления).
+    """
+    if not movie_ids:
+        return []
+    ids = np.asarray(movie_ids, dtype=np.int64)
+    group = np.full(len(ids), predictions.prior)
+    mine = np.full(len(ids), predictions.prior)
+    row = int(np.searchsorted(predictions.user_ids, user_id))
+    member = row < len(predictions.user_ids) and predictions.user_ids[row] == user_id
+    if member:
+        mine[:] = predictions.user_mean[row]
+
+    if len(predictions.movie_ids):
+        columns = np.searchsorted(predictions.movie_ids, ids).clip(0, len(predictions.movie_ids) - 1)
+        found = predictions.movie_ids[columns] == ids
+        group[found] = predictions.group[columns[found]]
+        if member:
+            mine[found] = predictions.scores[row, columns[found]]
+        else:
+            mine[found] = np.clip(predictions.prior + predictions.item_offset[columns[found]], 0, MAX_SCORE)
+
+    order = np.argsort(-group, kind="stable")
+    return list(zip(ids[order].tolist(), group[order].tolist(), mine[order].tolist()))
+
+
+class RoomRecommender:
+    """
+    Индексы комнат в памяти процесса. Устроен как RoomStatsCache: версия комнаты растёт с каждой оценкой,
+    индекс, построение которого началось до оценки, в кэш не попадёт.
+    """
+
+    def __init__(self, maxsize: int = RECOMMENDER_CACHE_SIZE, ttl: float = RECOMMENDER_TTL):
+        # room_id -> RoomIndex; TTL отсчитывается от построения, правки на месте его не продлевают
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions = KeyVersions(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.built = 0
+        self.updated = 0
+        self.predicted = 0
+
+    async def get(self, room_id: str) -> RoomIndex:
+        version = self._versions.get(room_id)
+        cached = self._cache.get(room_id)
+        if cached is not None and cached.version == version:
+            self.hits += 1
+            return cached
+        return await self._flight.do((room_id, version), lambda: self._build(room_id, version))
+
+    async def _build(self, room_id: str, version: int) -> RoomIndex:
+        ratings = await load_room_ratings(room_id)
+        index = await asyncio.to_thread(RoomIndex, ratings)
+        index.version = version
+        self.built += 1
+        if self._versions.get(room_id) == version:
+            self._cache.set(room_id, index)
+        return index
+
+    async def predictions(self, room_id: str) -> Predictions:
+        index = await self.get(room_id)
+        if not index.stale:
+            return index.predictions()
+        # Одновременные запросы к изменившейся комнате ждут один расчёт
+        return await self._flight.do(("predictions", room_id, index.version), lambda: self._predict(index))
+
+    async def _predict(self, index: RoomIndex) -> Predictions:
+        self.predicted += 1
+        return await index.compute_predictions()
+
+    def record_rating(self, room_id: str, user_id: int, movie_id: int, score: float | None) -> None:
+        """После коммита оценки: индекс в кэше правится на месте, версия комнаты растёт."""
+        version = self._versions.get(room_id)
+        new_version = self._versions.bump(room_id)
+        cached = self._cache.get(room_id)
+        if cached is None or cached.version != version:
+            return
+        cached.update(user_id, movie_id, score)
+        cached.version = new_version
+        self.updated += 1
+
+    def invalidate(self, room_id: str) -> None:
+        """Оценки комнаты менялись в обход record_rating (восстановление из файла) — построить индекс заново."""
+        self._versions.bump(room_id)
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._cache),
+            "versions": len(self._versions),
+            "hits": self.hits,
+            "built": self.built,
+            "updated": self.updated,
+            "predicted": self.predicted,
+            "coalesced": self._flight.coalesced,
+        }
+
+
+room_recommender = RoomRecommender()
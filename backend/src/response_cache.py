@@ -0,0 +1,131 @@
+"""
+HTTP-кэш страниц комнаты (show_room, история) по версии комнаты.
+
+1. Версия комнаты (RoomVersion) растёт при добавлении фильма и оценке — в той же транзакции
+2. ETag страницы = хеш (комната, версия, зритель, вариант страницы, шаблоны). Запрос с совпавшим
+   If-None-Match получает 304 после одного запроса версии по первичному ключу — без рендера и запросов данных
+3. Отрендеренные страницы лежат в LRU по (комната, версия, вариант, зритель), ограниченном
+   RESPONSE_CACHE_MAX_ENTRIES записями и RESPONSE_CACHE_MAX_BYTES байтами. Новая версия — новый ключ,
+   старые записи просто вытесняются
+Версия читается до данных страницы: закэшированное под версией N не старее N.
+
+Cache-Control: private, no-cache — браузер (и fetch в Mini App) каждый раз переспрашивает с If-None-Match.
+В ETag входит хеш файлов шаблонов, чтобы после выкладки новой вёрстки старые копии не отдавались по 304.
+Счётчики (доля попаданий, сэкономленные байты) — GET /metrics/response-cache.
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import Response
+
+from services import get_room_version
+from templating import TEMPLATES_DIR
+
+load_dotenv()
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+
+def _templates_digest(directory: str = TEMPLATES_DIR) -> str:
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(path.encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._pages: OrderedDict[tuple, bytes] = OrderedDict()
+        self._bytes = 0
+        self._templates = _templates_digest()
+        self.requests = 0
+        self.not_modified = 0  # ответили 304
+        self.hits = 0  # отдали из LRU без рендера
+        self.misses = 0  # рендер
+        self.bytes_not_sent = 0  # тела, не отправленные благодаря 304
+        self.bytes_from_cache = 0  # тела, отданные без повторного рендера
+
+    def etag(self, room_id: str, version: int, user_id: int, variant: str) -> str:
+        key = f"{room_id}:{version}:{user_id}:{variant}:{self._templates}"
+        return f'W/"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+    async def respond(self, request: Request, db: AsyncSession, room_id: str, user_id: int, variant: str,
+                      render: Callable[[], Awaitable[bytes]], media_type: str = "text/html") -> Response:
+        """
+        Страница комнаты через кэш: 304, готовая из LRU или render().
+        variant — всё, кроме комнаты и зрителя, от чего зависит страница (сортировка, курсор).
+        """
+        room_version = await get_room_version(db, room_id)
+        if room_version is None:
+            raise HTTPException(status_code=404, detail="Room not found")
+        version, updated_at = room_version
+
+        self.requests += 1
+        key = (room_id, version, variant, user_id)
+        etag = self.etag(room_id, version, user_id, variant)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "X-Telegram-Init-Data"}
+        if updated_at is not None:
+            headers["Last-Modified"] = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+
+        body = self._pages.get(key)
+        if etag in _parse_if_none_match(request.headers.get("if-none-match")):
+            self.not_modified += 1
+            if body is not None:
+                self.bytes_not_sent += len(body)
+            return Response(status_code=304, headers=headers)
+
+        if body is not None:
+            self._pages.move_to_end(key)
+            self.hits += 1
+            self.bytes_from_cache += len(body)
+        else:
+            self.misses += 1
+            body = await render()
+            self._store(key, body)
+        return Response(body, media_type=media_type, headers=headers)
+
+    def _store(self, key: tuple, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        self._pages[key] = body
+        self._bytes += len(body)
+        while len(self._pages) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._pages.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        served = self.not_modified + self.hits
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(served / self.requests, 3) if self.requests else None,
+            "bytes_not_sent": self.bytes_not_sent,
+            "bytes_from_cache": self.bytes_from_cache,
+            "entries": len(self._pages),
+            "bytes": self._bytes,
+        }
+
+
+def _parse_if_none_match(value: str | None) -> set[str]:
+    if not value:
+        return set()
+    return {tag.strip() for tag in value.split(",")}
+
+
+room_page_cache = ResponseCache()
@@ -0,0 +1,178 @@
+"""
+Участники комнат: вход, приглашения и проверка доступа на каждом эндпоинте комнаты.
+
+- вход (join_room) — INSERT ... ON CONFLICT DO NOTHING в room_members: повторный вход — не IntegrityError
+  с откатом, а ноль вставленных строк
+- в публичную комнату (is_private=False) входит кто угодно, в закрытую — по приглашению (RoomInvite):
+  участник получает код ссылки (create_invite), по коду входят до expires_at
+- доступ — зависимость get_room_member: 404 — комнаты нет, 403 — пользователь не участник.
+  Проверка идёт по кэшу состава комнат (room_id -> RoomAccess: закрытая ли комната и множество user_id),
+  на попадании — без запросов в БД. Состав читается на промахе одной общей загрузкой на комнату (SingleFlight)
+  в своей сессии и живёт не дольше ROOM_ACCESS_TTL. Если сессия запроса уже держит соединение (транзакция начата),
+  состав читается в ней же: транзакцию запроса проверка доступа не завершает, а ждать общую загрузку,
+  держа соединение, нельзя — при исчерпанном пуле запросы ждали бы загрузку, а она — их соединения.
+- вход в этом процессе дописывает участника в кэш на месте. Участников, вошедших через другой процесс,
+  кэш может ещё не знать: перед отказом членство перепроверяется по первичному ключу room_members
+  (отказов мало — разрешения так и остаются без запросов).
+Счётчики — GET /metrics/room-access.
+"""
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, status
+from nanoid import generate
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from caching import SingleFlight, TTLCache
+from database import AsyncSessionLocal, get_async_db
+from models import Room, RoomInvite, RoomMember, User
+from utilites import get_current_user_async
+
+load_dotenv()
+ROOM_ACCESS_TTL = int(os.getenv("ROOM_ACCESS_TTL", 10 * 60))
+ROOM_ACCESS_CACHE_SIZE = int(os.getenv("ROOM_ACCESS_CACHE_SIZE", 1024))
+ROOM_INVITE_TTL_DAYS = int(os.getenv("ROOM_INVITE_TTL_DAYS", 7))
+
+
+@dataclass
+class RoomAccess:
+    is_private: bool
+    members: set[int]
+
+
+@asynccontextmanager
+async def _session(db: AsyncSession | None):
+    """Сессия запроса; без неё (SSE, WebSocket) — короткая своя, чтобы не держать соединение всё время подписки."""
+    if db is not None:
+        yield db
+    else:
+        async with AsyncSessionLocal() as own:
+            yield own
+
+
+async def load_room_access(db: AsyncSession, room_id: str) -> RoomAccess | None:
+    is_private = await db.scalar(select(Room.is_private).where(Room.id == room_id))
+    if is_private is None:
+        return None
+    members = await db.scalars(select(RoomMember.user_id).where(RoomMember.room_id == room_id))
+    return RoomAccess(is_private=is_private, members=set(members))
+
+
+async def is_member_in_db(db: AsyncSession, room_id: str, user_id: int) -> bool:
+    return await db.get(RoomMember, (room_id, user_id)) is not None
+
+
+class RoomAccessCache:
+    """Состав комнат процесса. Нет комнаты — не кэшируется: её могли только что создать в другом процессе."""
+
+    def __init__(self, maxsize: int = ROOM_ACCESS_CACHE_SIZE, ttl: float = ROOM_ACCESS_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+        self.checks = 0
+        self.loaded = 0
+        self.rechecked = 0
+        self.denied = 0
+        self.joined = 0
+
+    async def get(self, room_id: str, db: AsyncSession | None = None) -> RoomAccess | None:
+        """db — сессия запроса: с начатой транзакцией состав читается в ней, без коммита и без общей загрузки."""
+        access = self._cache.get(room_id)
+        if access is None:
+            if db is not None and db.in_transaction():
+                access = self._store(room_id, await load_room_access(db, room_id))
+            else:
+                access = await self._flight.do(room_id, lambda: self._load(room_id))
+        return access
+
+    async def _load(self, room_id: str) -> RoomAccess | None:
+        async with AsyncSessionLocal() as db:
+            return self._store(room_id, await load_room_access(db, room_id))
+
+    def _store(self, room_id: str, access: RoomAccess | None) -> RoomAccess | None:
+        self.loaded += 1
+        if access is not None:
+            self._cache.set(room_id, access)
+        return access
+
+    async def check(self, room_id: str, user_id: int, db: AsyncSession | None = None) -> None:
+        """404 — комнаты нет, 403 — не участник."""
+        self.checks += 1
+        access = await self.get(room_id, db)
+        if access is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Room not found")
+        if user_id in access.members:
+            return
+        self.rechecked += 1
+        async with _session(db) as session:
+            if await is_member_in_db(session, room_id, user_id):
+                access.members.add(user_id)
+                return
+        self.denied += 1
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this room")
+
+    def record_member(self, room_id: str, user_id: int) -> None:
+        """После коммита входа. Множество правится на месте — срок жизни записи не продлевается."""
+        access = self._cache.get(room_id)
+        if access is not None:
+            access.members.add(user_id)
+
+    def invalidate(self, room_id: str) -> None:
+        """Состав менялся в обход join_room (восстановление из файла)."""
+        self._cache.delete(room_id)
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self._cache),
+            "checks": self.checks,
+            "loaded": self.loaded,
+            "rechecked": self.rechecked,
+            "denied": self.denied,
+            "joined": self.joined,
+            "coalesced": self._flight.coalesced,
+        }
+
+
+room_access = RoomAccessCache()
+
+
+async def get_room_member(room_id: str, db: AsyncSession = Depends(get_async_db),
+                          user: User = Depends(get_current_user_async)) -> User:
+    """Зависимость эндпоинтов комнаты: текущий пользователь, если он участник room_id."""
+    await room_access.check(room_id, user.id, db)
+    return user
+
+
+def _insert_member_if_missing(dialect_name: str, room_id: str, user_id: int):
+    insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+    return insert(RoomMember).values(room_id=room_id, user_id=user_id).on_conflict_do_nothing(
+        index_elements=[RoomMember.room_id, RoomMember.user_id])
+
+
+async def join_room(db: AsyncSession, room_id: str, user_id: int) -> bool:
+    """Сделать участником (с коммитом). True — вошёл сейчас, False — уже был участником."""
+    result = await db.execute(_insert_member_if_missing(db.get_bind().dialect.name, room_id, user_id))
+    await db.commit()
+    room_access.record_member(room_id, user_id)
+    if result.rowcount == 1:
+        room_access.joined += 1
+        return True
+    return False
+
+
+async def create_invite(db: AsyncSession, room_id: str, user_id: int) -> RoomInvite:
+    invite = RoomInvite(code=generate(size=16), room_id=room_id, created_by=user_id,
+                        expires_at=datetime.utcnow() + timedelta(days=ROOM_INVITE_TTL_DAYS))
+    db.add(invite)
+    await db.commit()
+    return invite
+
+
+async def get_valid_invite(db: AsyncSession, code: str) -> RoomInvite | None:
+    return await db.scalar(select(RoomInvite).where(RoomInvite.code == code,
+                                                    RoomInvite.expires_at > datetime.utcnow()))
@@ -0,0 +1,172 @@
+"""
+События комнаты в реальном времени: новый фильм, изменённая оценка и новая средняя.
+
+Эндпоинты публикуют событие после коммита (room_event_hub.publish), клиенты подписываются
+по SSE (GET /rooms/{room_id}/events) или WebSocket (/rooms/{room_id}/ws) и получают компактные дельты:
+    {"type": "movie_added", "room_id": ..., "movie": {...карточка...}, "added_by": "..."}
+    {"type": "rating_changed", "room_id": ..., "movie_id": 1, "user_id": 2, "username": "...",
+     "score": 7.5, "avg_score": 7.25, "ratings_count": 4}
+
+- Событие сериализуется один раз (EncodedEvent: JSON для WebSocket и готовый SSE-кадр), а не на каждого подписчика
+- У каждого подписчика своя очередь на ROOM_EVENTS_QUEUE_SIZE событий: медленный клиент не тормозит остальных.
+  Переполнилась — очередь очищается и клиент получает {"type": "resync"} (перечитать состояние целиком)
+- Доставка между процессами — через брокер (ROOM_EVENTS_BROKER="модуль:Класс"). По умолчанию InProcessBroker:
+  события видят подписчики только этого процесса. Для нескольких воркеров подключается брокер,
+  который рассылает событие всем процессам (например, поверх Redis pub/sub) и в каждом вызывает deliver.
+
+Счётчики — GET /metrics/room-events.
+"""
+import asyncio
+import importlib
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Protocol
+
+from dotenv import load_dotenv
+
+from observability import log_event
+
+load_dotenv()
+ROOM_EVENTS_QUEUE_SIZE = int(os.getenv("ROOM_EVENTS_QUEUE_SIZE", 100))
+ROOM_EVENTS_HEARTBEAT = float(os.getenv("ROOM_EVENTS_HEARTBEAT", 15))
+ROOM_EVENTS_BROKER = os.getenv("ROOM_EVENTS_BROKER")  # "модуль:Класс"; не задан — InProcessBroker
+
+
+@dataclass(frozen=True)
+class EncodedEvent:
+    type: str
+    json: str  # кадр WebSocket
+    sse: bytes  # кадр text/event-stream
+
+    @classmethod
+    def encode(cls, event: dict) -> "EncodedEvent":
+        data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+        return cls(event["type"], data, f"event: {event['type']}\ndata: {data}\n\n".encode())
+
+
+RESYNC = EncodedEvent.encode({"type": "resync"})
+
+
+class Subscriber:
+    def __init__(self, room_id: str, maxsize: int):
+        self.room_id = room_id
+        self.queue: asyncio.Queue[EncodedEvent] = asyncio.Queue(maxsize=maxsize)
+        self.lagged = 0  # сколько раз не успел забрать события
+
+    def offer(self, event: EncodedEvent) -> bool:
+        """Без ожидания: публикующий никогда не ждёт подписчика. False — подписчик отстал."""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.lagged += 1
+            return False
+
+    async def get(self) -> EncodedEvent:
+        return await self.queue.get()
+
+
+Deliver = Callable[[str, EncodedEvent], None]
+
+
+class Broker(Protocol):
+    """Доставка событий до всех процессов. deliver(room_id, event) вызывается в каждом процессе из event loop."""
+
+    async def start(self, deliver: Deliver) -> None: ...
+
+    async def publish(self, room_id: str, event: EncodedEvent) -> None: ...
+
+    async def close(self) -> None: ...
+
+
+class InProcessBroker:
+    """Один процесс: опубликованное сразу доставляется локальным подписчикам."""
+
+    def __init__(self):
+        self._deliver: Deliver | None = None
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, room_id: str, event: EncodedEvent) -> None:
+        if self._deliver is not None:
+            self._deliver(room_id, event)
+
+    async def close(self) -> None:
+        self._deliver = None
+
+
+def load_broker(path: str) -> Broker:
+    module_name, _, class_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class RoomEventHub:
+    def __init__(self, broker: Broker, queue_size: int = ROOM_EVENTS_QUEUE_SIZE):
+        self.broker = broker
+        self.queue_size = queue_size
+        self._rooms: dict[str, set[Subscriber]] = {}
+        self._started = False
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        if not self._started:
+            await self.broker.start(self.deliver)
+            self._started = True
+
+    async def close(self) -> None:
+        if self._started:
+            await self.broker.close()
+            self._started = False
+
+    async def publish(self, room_id: str, event_type: str, **payload) -> None:
+        """Вызывать после коммита. Ошибка доставки не должна ломать сам запрос — она только логируется."""
+        event = EncodedEvent.encode({"type": event_type, "room_id": room_id, **payload})
+        self.published += 1
+        try:
+            await self.start()
+            await self.broker.publish(room_id, event)
+        except Exception as e:
+            log_event("room_event_publish_failed", logging.WARNING, room_id=room_id, event_type=event_type, error=str(e))
+
+    def deliver(self, room_id: str, event: EncodedEvent) -> None:
+        for subscriber in self._rooms.get(room_id, ()):
+            if subscriber.offer(event):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+
+    @asynccontextmanager
+    async def subscribe(self, room_id: str) -> AsyncIterator[Subscriber]:
+        await self.start()
+        subscriber = Subscriber(room_id, self.queue_size)
+        self._rooms.setdefault(room_id, set()).add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            subscribers = self._rooms.get(room_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._rooms[room_id]
+
+    def stats(self) -> dict:
+        return {
+            "broker": type(self.broker).__name__,
+            "rooms": len(self._rooms),
+            "subscribers": sum(len(subscribers) for subscribers in self._rooms.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+room_event_hub = RoomEventHub(load_broker(ROOM_EVENTS_BROKER) if ROOM_EVENTS_BROKER else InProcessBroker())
@@ -0,0 +1,313 @@
+"""
+Выгрузка комнаты в CSV / JSON Lines и восстановление комнаты из такого файла.
+
+Строка файла — фильм комнаты и оценка одного участника (фильм без оценок — одна строка с пустой оценкой):
+поля фильма, кто и когда добавил, кто оценил, оценка, пропуск. Пользователи — по telegram_id,
+фильмы — по kinopoisk_id: файл переносится между базами.
+
+Выгрузка (GET /rooms/{room_id}/export?format=csv|jsonl) — потоком: запрос идёт через db.stream
+с yield_per (в PostgreSQL — серверный курсор), строки читаются и отдаются пачками по EXPORT_BATCH,
+память не зависит от размера комнаты. Заголовок CSV уходит клиенту до первого запроса к БД.
+CSV — в UTF-8 с BOM (Excel иначе не узнаёт кириллицу); переводы строк в текстовых полях заменяются пробелом:
+одна запись — одна строка файла.
+
+Восстановление (POST /rooms/{room_id}/import) читает тело запроса потоком и пишет пачками по RESTORE_BATCH строк,
+каждая пачка — своя транзакция: недостающие фильмы, фильмы в комнате и оценки. Уже существующее не перезаписывается —
+повторный импорт того же файла ничего не меняет. Файл присылает любой участник, поэтому от чужого имени
+он ничего не создаёт: пользователей и участников комнаты не добавляет, оценки пишет только свои
+(чужие — считаются в skipped_ratings), а «кто добавил» берёт из файла, только если это участник комнаты,
+иначе — восстанавливающий. Формат проверяется строго: заголовок CSV — ровно EXPORT_COLUMNS, запись JSON — объект.
+В конце — пересборка room_movie_stats комнаты и сброс кэшей комнаты (статистика, рекомендации, очереди оценки),
+клиентам комнаты уходит resync.
+"""
+import codecs
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+from sqlalchemy import select, and_, insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, aliased
+
+from database import AsyncSessionLocal
+from models import Movie, MoviesInRoom, Rating, RoomMember, User
+from rating_queue import reset_rating_queue
+from recommender import room_recommender
+from room_events import room_event_hub
+from room_stats import room_stats_cache
+from search_index import movie_search
+from services import bump_room_version, rebuild_room_movie_stats
+
+load_dotenv()
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", 1000))
+RESTORE_BATCH = int(os.getenv("RESTORE_BATCH", 500))
+
+EXPORT_COLUMNS = (
+    "kinopoisk_id", "title", "year", "kinopoisk_url", "poster_url", "poster_preview_url",
+    "added_by_telegram_id", "added_by_username", "added_date", "discussion_date",
+    "rater_telegram_id", "rater_username", "score", "skipped",
+)
+EXPORT_MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson"}
+
+
+def _export_query(room_id: str):
+    adder, rater = aliased(User), aliased(User)
+    return select(
+        Movie.kinopoisk_id, Movie.title, Movie.year, Movie.kinopoisk_url, Movie.poster_url, Movie.poster_preview_url,
+        adder.telegram_id, adder.username, MoviesInRoom.added_date, MoviesInRoom.discussion_date,
+        rater.telegram_id, rater.username, Rating.score, Rating.skipped,
+    ).select_from(MoviesInRoom) \
+     .join(Movie, Movie.id == MoviesInRoom.movie_id) \
+     .outerjoin(adder, adder.id == MoviesInRoom.added_by) \
+     .outerjoin(Rating, and_(Rating.room_id == MoviesInRoom.room_id, Rating.movie_id == MoviesInRoom.movie_id)) \
+     .outerjoin(rater, rater.id == Rating.user_id) \
+     .where(MoviesInRoom.room_id == room_id) \
+     .order_by(MoviesInRoom.added_date, MoviesInRoom.movie_id, Rating.user_id) \
+     .execution_options(yield_per=EXPORT_BATCH)
+
+
+def _export_record(row) -> dict:
+    record = dict(zip(EXPORT_COLUMNS, row))
+    for column in ("added_date", "discussion_date"):
+        if record[column] is not None:
+            record[column] = record[column].isoformat()
+    return record
+
+
+async def _export_partitions(room_id: str) -> AsyncIterator[list[dict]]:
+    # Своя сессия: генератор живёт дольше обработчика запроса
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(_export_query(room_id))
+        async for rows in result.partitions():
+            yield [_export_record(row) for row in rows]
+
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value).replace("\r", " ").replace("\n", " ")
+
+
+async def export_csv(room_id: str) -> AsyncIterator[bytes]:
+    yield ("\ufeff" + ",".join(EXPORT_COLUMNS) + "\r\n").encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    async for records in _export_partitions(room_id):
+        writer.writerows([_csv_value(record[column]) for column in EXPORT_COLUMNS] for record in records)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+async def export_jsonl(room_id: str) -> AsyncIterator[bytes]:
+    async for records in _export_partitions(room_id):
+        yield "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode()
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Строки тела запроса по мере получения (UTF-8, BOM в начале отбрасывается)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def _parse_number(value, kind):
+    if value is None or value == "":
+        return None
+    return kind(value)
+
+
+def _parse_date(value) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _parse_record(record: dict) -> dict:
+    """Поля строки файла -> значения для записи; ошибка формата — ValueError/KeyError."""
+    skipped = record.get("skipped")
+    return {
+        "kinopoisk_id": int(record["kinopoisk_id"]),
+        "title": record["title"],
+        "year": _parse_number(record.get("year"), int) or 0,
+        "kinopoisk_url": record.get("kinopoisk_url") or "",
+        "poster_url": record.get("poster_url") or None,
+        "poster_preview_url": record.get("poster_preview_url") or None,
+        "added_by_telegram_id": str(record["added_by_telegram_id"]) if record.get("added_by_telegram_id") else None,
+        "added_by_username": record.get("added_by_username") or "",
+        "added_date": _parse_date(record.get("added_date")),
+        "discussion_date": _parse_date(record.get("discussion_date")),
+        "rater_telegram_id": str(record["rater_telegram_id"]) if record.get("rater_telegram_id") else None,
+        "rater_username": record.get("rater_username") or "",
+        "score": _parse_number(record.get("score"), float),
+        "skipped": skipped in (True, 1, "1", "true", "True"),
+    }
+
+
+async def _records(lines: AsyncIterator[str]) -> AsyncIterator[dict]:
+    """CSV с заголовком EXPORT_COLUMNS или JSON Lines — по первой непустой строке. Ошибка формата — ValueError."""
+    header = None
+    is_json = False
+    async for line in lines:
+        if not line.strip():
+            continue
+        if header is None and not is_json:
+            is_json = line.lstrip().startswith("{")
+            if not is_json:
+                header = next(csv.reader([line]))
+                if tuple(header) != EXPORT_COLUMNS:
+                    raise ValueError(f"первая строка — не заголовок выгрузки ({', '.join(EXPORT_COLUMNS)})")
+                continue
+        if is_json:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError(f"ожидался объект JSON, а не {type(record).__name__}")
+            yield record
+        else:
+            values = next(csv.reader([line]))
+            if len(values) != len(header):
+                raise ValueError(f"полей {len(values)}, а в заголовке {len(header)}")
+            yield dict(zip(header, values))
+
+
+def _insert_movies_if_missing(dialect_name: str):
+    insert_ = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+    return insert_(Movie).on_conflict_do_nothing(index_elements=[Movie.kinopoisk_id])
+
+
+def restore_batch(db: Session, room_id: str, restored_by: int, rows: list[dict]) -> dict[str, int]:
+    """
+    Одна пачка строк файла. Только вставки недостающего; коммит — на вызывающей стороне.
+    restored_by — восстанавливающий участник: из чужих оценок файла не пишется ни одна.
+    """
+    counts = {"movies": 0, "room_movies": 0, "ratings": 0, "skipped_ratings": 0}
+
+    telegram_ids = {row[f"{prefix}_telegram_id"] for row in rows for prefix in ("added_by", "rater")} - {None}
+    # Только уже существующие участники этой комнаты: файл не создаёт пользователей и не добавляет в комнату
+    members = dict(db.execute(
+        select(User.telegram_id, User.id).join(RoomMember, RoomMember.user_id == User.id)
+        .where(RoomMember.room_id == room_id, User.telegram_id.in_(telegram_ids))
+    ).all()) if telegram_ids else {}
+
+    by_kinopoisk_id = {row["kinopoisk_id"]: row for row in rows}
+    movies = dict(db.execute(select(Movie.kinopoisk_id, Movie.id).where(Movie.kinopoisk_id.in_(by_kinopoisk_id))).all())
+    new_movies = [
+        {column: row[column] for column in ("kinopoisk_id", "title", "year", "kinopoisk_url", "poster_url", "poster_preview_url")}
+        for kinopoisk_id, row in by_kinopoisk_id.items() if kinopoisk_id not in movies
+    ]
+    if new_movies:
+        # Тот же фильм мог параллельно сохранить другой запрос или загрузка: его строка пропускается, id перечитывается
+        inserted = dict(db.execute(
+            _insert_movies_if_missing(db.get_bind().dialect.name).returning(Movie.kinopoisk_id, Movie.id), new_movies
+        ).all())
+        movies.update(inserted)
+        lost = [movie["kinopoisk_id"] for movie in new_movies if movie["kinopoisk_id"] not in inserted]
+        if lost:
+            movies.update(db.execute(select(Movie.kinopoisk_id, Movie.id).where(Movie.kinopoisk_id.in_(lost))).all())
+        counts["movies"] = len(inserted)
+
+    in_room = set(db.scalars(select(MoviesInRoom.movie_id).where(
+        MoviesInRoom.room_id == room_id, MoviesInRoom.movie_id.in_(movies.values()))))
+    new_room_movies = []
+    for kinopoisk_id, row in by_kinopoisk_id.items():
+        movie_id = movies[kinopoisk_id]
+        if movie_id not in in_room:
+            new_room_movies.append({
+                "room_id": room_id, "movie_id": movie_id,
+                "added_by": members.get(row["added_by_telegram_id"], restored_by),
+                "added_date": row["added_date"] or datetime.utcnow(),
+                "discussion_date": row["discussion_date"],
+            })
+    if new_room_movies:
+        db.execute(insert(MoviesInRoom), new_room_movies)
+        counts["room_movies"] = len(new_room_movies)
+
+    ratings = {}
+    for row in rows:
+        if not row["rater_telegram_id"]:
+            continue
+        if members.get(row["rater_telegram_id"]) != restored_by:
+            counts["skipped_ratings"] += 1
+            continue
+        ratings[restored_by, movies[row["kinopoisk_id"]]] = row
+    # По индексу ix_ratings_room_movie; пары (user_id, movie_id) через IN кортежей SQLite ищет обходом комнаты
+    existing = set(db.execute(select(Rating.user_id, Rating.movie_id).where(
+        Rating.room_id == room_id, Rating.movie_id.in_({movie_id for _, movie_id in ratings})
+    )).all()) if ratings else set()
+    new_ratings = [
+        {"room_id": room_id, "user_id": user_id, "movie_id": movie_id, "score": row["score"], "skipped": row["skipped"]}
+        for (user_id, movie_id), row in ratings.items() if (user_id, movie_id) not in existing
+    ]
+    if new_ratings:
+        db.execute(insert(Rating), new_ratings)
+        counts["ratings"] = len(new_ratings)
+    return counts
+
+
+def finish_restore(db: Session, room_id: str) -> None:
+    """Агрегаты комнаты с нуля по восстановленным оценкам и новая версия комнаты (HTTP-кэш страниц)."""
+    rebuild_room_movie_stats(db, room_id)
+    bump_room_version(db, room_id)
+
+
+async def restore_room(room_id: str, restored_by: int, chunks: AsyncIterator[bytes]) -> dict[str, int]:
+    """
+    Восстанавливает комнату из потока байт файла выгрузки. Возвращает счётчики добавленного.
+    Ошибка в записи — ValueError с её номером; пачки до неё уже записаны, агрегаты и кэши комнаты всё равно обновляются.
+    """
+    totals = {"rows": 0, "movies": 0, "room_movies": 0, "ratings": 0, "skipped_ratings": 0}
+    batch = []
+
+    async def write(rows: list[dict]) -> None:
+        async with AsyncSessionLocal() as db:
+            counts = await db.run_sync(restore_batch, room_id, restored_by, rows)
+            await db.commit()
+        for key, value in counts.items():
+            totals[key] += value
+
+    try:
+        records = _records(_lines(chunks))
+        while True:
+            try:
+                record = _parse_record(await anext(records))
+            except StopAsyncIteration:
+                break
+            except (KeyError, TypeError, ValueError) as e:  # в т.ч. json.JSONDecodeError
+                raise ValueError(f"запись {totals['rows'] + 1}: {e!r}") from e
+            batch.append(record)
+            totals["rows"] += 1
+            if len(batch) == RESTORE_BATCH:
+                await write(batch)
+                batch = []
+        if batch:
+            await write(batch)
+    finally:
+        await _finish(room_id)
+    return totals
+
+
+async def _finish(room_id: str) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(finish_restore, room_id)
+        await db.commit()
+        member_ids = list(await db.scalars(select(RoomMember.user_id).where(RoomMember.room_id == room_id)))
+
+    # Восстановленные фильмы добавлены «в прошлое» (added_date из файла) — очереди оценки комнаты строятся заново
+    for user_id in member_ids:
+        reset_rating_queue(room_id, user_id)
+    room_stats_cache.invalidate(room_id)
+    room_recommender.invalidate(room_id)
+    movie_search.forget_room(room_id)
+    await room_event_hub.publish(room_id, "resync")
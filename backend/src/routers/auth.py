@@ -11,15 +11,14 @@ from typing import Annotated
 
 from starlette.responses import HTMLResponse
 from fastapi import Request
-from starlette.templating import Jinja2Templates
 
 from database import get_db
 from models import Movie, Room, User
-from utilites import parse_init_data
+from telegram_auth import check_init_data, InitDataError
 from schemas import MovieCreate, TelegramAuth  # создадим схемы ниже
 from utilites import get_movie_info_from_kp_url
+from templating import templates
 # from ..dependencies import get_current_user  # пока закомментируем или сделаем заглушку
-templates = Jinja2Templates(directory="templates")
 
 load_dotenv()  # Уже есть в database.py, но для безопасности
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -39,24 +38,11 @@ def validate_telegram_hash(data: TelegramAuth) -> bool:
 
 
 @auth.post("/validate-mini-app")
-def validate_mini_app(db: Session = Depends(get_db)):
-    parsed_data = parse_init_data(data.init_data)
-    user_str = parsed_data.get('user')
-    if not user_str:
-        raise HTTPException(401, "Invalid initData")
-    user_data = json.loads(urllib.parse.unquote(user_str))
-
-    auth_data = TelegramAuth(  # Используйте схему из предыдущего ответа
-        id=int(user_data['id']),
-        username=user_data.get('username'),
-        first_name=user_data.get('first_name'),
-        last_name=user_data.get('last_name'),
-        auth_date=int(parsed_data['auth_date']),
-        hash=parsed_data['hash']
-    )
-
-    if not validate_telegram_hash(auth_data):
-        raise HTTPException(401, "Invalid hash")
-
-    # Создайте/обновите пользователя в DB (как в /auth/telegram)
-    return {"valid": True, "user_id": auth_data.id}
\ No newline at end of file
+def validate_mini_app(x_telegram_init_data: str = Header(None)):
+    # Проверка initData Mini App (ключ — HMAC("WebAppData", bot_token), в отличие от Login Widget выше)
+    try:
+        telegram_data = check_init_data(x_telegram_init_data)
+    except InitDataError as e:
+        raise HTTPException(401, f"Invalid initData: {e}")
+
+    return {"valid": True, "user_id": telegram_data["user"]["id"]}
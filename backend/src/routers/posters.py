@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from starlette.responses import FileResponse
+
+from poster_storage import is_content_addressed, IMMUTABLE_CACHE_CONTROL, STATIC_MAX_AGE
+from poster_variants import poster_variants, media_type_for
+
+posters = APIRouter(
+    prefix="/posters",
+    tags=["posters"],
+    responses={404: {"description": "Not found"}}
+)
+
+
+@posters.get("/{width}/{image_format}/{file_name}")
+async def get_poster_variant(width: int, image_format: str, file_name: str):
+    """Уменьшенная копия постера (см. poster_variants): генерируется при первом запросе, дальше — из кэша."""
+    path = await poster_variants.get_path(file_name, width, image_format)
+    cache_control = IMMUTABLE_CACHE_CONTROL if is_content_addressed(file_name) else f"public, max-age={STATIC_MAX_AGE}"
+    return FileResponse(path, media_type=media_type_for(image_format), headers={"Cache-Control": cache_control})
@@ -1,30 +1,47 @@
+import asyncio
 import json
+import logging
 import os
 import urllib
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException, status, Header
-from sqlalchemy import func, and_
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query
+from pydantic import ValidationError
+from sqlalchemy import func, and_, select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, aliased
-from typing import Annotated
-
-from starlette.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi import Request
-from starlette.templating import Jinja2Templates
-
-from database import get_db
-from models import Movie, Room, User, MoviesInRoom, Rating
-from services import get_next_unrated_movie_for_user
-from utilites import parse_init_data, get_current_user
-from schemas import MovieCreate, RoomCreate, RatingCreate  # создадим схемы ниже
-from utilites import get_movie_info_from_kp_url
+from typing import Annotated, Literal
+
+from starlette.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
+from fastapi import Request, WebSocket, WebSocketDisconnect
+
+from database import get_db, get_async_db
+from models import Movie, Room, User, MoviesInRoom, Rating, RoomMovieStats, RoomMember, IngestionJob
+from services import get_next_unrated_movie_for_user_async, get_room_history_page, HistoryCursor, HISTORY_SORTS, save_rating, get_movie_by_kinopoisk_id, \
+    get_next_unrated_movies_for_user_async, save_ratings, get_room_movie_stats, bump_room_version, \
+    get_unrated_movie_ids
+from utilites import parse_init_data, get_current_user, get_current_user_async, get_current_identity_async
+from telegram_auth import CachedIdentity
+from schemas import MovieCreate, RoomCreate, RatingCreate, RatingBatch, MovieImport  # создадим схемы ниже
+from movie_import import import_movies, parse_import_text, IMPORT_MAX_URLS
+from room_access import room_access, get_room_member, join_room, create_invite, get_valid_invite
+from room_export import export_csv, export_jsonl, restore_room, EXPORT_MEDIA_TYPES
+from ingestion import enqueue_movie, get_pending_job, job_view, ingestion_pool
+from poster_variants import movie_card
+from room_events import room_event_hub, ROOM_EVENTS_HEARTBEAT
+from rating_queue import mark_rated
+from room_stats import record_room_rating
+from recommender import room_recommender, rank_movies
+from response_cache import room_page_cache
+from search_index import movie_search
+from templating import templates, render_template
+from observability import log_event
 # from ..dependencies import get_current_user  # пока закомментируем или сделаем заглушку
 
 load_dotenv()  # Уже есть в database.py, но для безопасности
 KINO_KREKER = os.getenv("KINO_KREKER")
-
-templates = Jinja2Templates(directory="templates")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 30))
 
 
 rooms = APIRouter(
@@ -36,44 +53,30 @@ rooms = APIRouter(
 @rooms.get("/{room_id}")
 async def show_room(room_id: str,
                     request: Request,
-                    db: Session = Depends(get_db),
-                    user: User = Depends(get_current_user)
+                    db: AsyncSession = Depends(get_async_db),
+                    user: User = Depends(get_room_member)
                     ):
-    print('RUN: rooms -> show_room')
-    # Получить комнату и проверить членство
-    room = db.query(Room).filter(Room.id == room_id).first()
-    if not room:
-        raise HTTPException(status_code=404, detail="Room not found")
-
-    # 2. Получаем последний добавленный фильм через таблицу связи MoviesInRoom
-    # Используем join для доступа к дате добавления
+    async def render() -> bytes:
+        # Комнату проверил room_page_cache.respond по версии
+        room = await db.get(Room, room_id)
+        result = await get_next_unrated_movie_for_user_async(db, room_id, user.id)
+        if result:
+            current_movie, rating = result
+        else:
+            current_movie, rating = None, None
+        return render_template("room/detail.html", {
+            "request": request,
+            "room": room,
+            "room_id": room.id,
+            "current_movie": current_movie,
+            "user_rating": rating.score if rating else None
+        })
 
-    result = get_next_unrated_movie_for_user(db, room_id, user.id)
-    if result:
-        current_movie, rating = result
-    else:
-        current_movie, rating = None, None
-
-    # 3. Ищем оценку текущего пользователя (заглушка ID=1, пока нет системы сессий)
-    # # В реальном коде используйте user.id из get_current_user
-    # rating_obj = db.query(Rating).filter(
-    #     Rating.movie_id == current_movie.id,
-    #     Rating.user_id == user.id
-    # ).first()
-    # if rating_obj:
-    #     user_rating = rating_obj.score
-
-    return templates.TemplateResponse("room/detail.html", {
-        "request": request,
-        "room": room,
-        "room_id": room.id,
-        "current_movie": current_movie,
-        "user_rating": rating.score if rating else None
-    })
+    return await room_page_cache.respond(request, db, room_id, user.id, "room", render)
 
 
 @rooms.get("/")
-async def get_rooms(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+async def get_rooms(request: Request, db: AsyncSession = Depends(get_async_db), user: User = Depends(get_current_user_async)):
     """
     Если пользователь не зарегестрирован - зарегестрировать (пока что сразу с комнатой)
     TODO: Получить информацию о текущей комнате
@@ -89,23 +92,60 @@ async def get_rooms(request: Request, db: Session = Depends(get_db), user: User
     #     raise HTTPException(401, "Invalid initData")
     # user_data = json.loads(urllib.parse.unquote(user_str))
 
-    print('RUN: rooms -> get_rooms')
-    room = db.query(Room).filter(Room.id == KINO_KREKER).first()
-    user.rooms.append(room)
-    try:
-        db.commit()
-        db.refresh(room)
-    except IntegrityError:
-        db.rollback()  # Откат, чтобы сессия была чистой (ссылка на предыдущее объяснение)
+    # Повторный визит — без запросов: участие в комнате по умолчанию видно из кэша room_access
+    access = await room_access.get(KINO_KREKER, db)
+    if access is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if user.id not in access.members:
+        await join_room(db, KINO_KREKER, user.id)
+
+    return JSONResponse({"status": "success", "room_id": KINO_KREKER})
+
 
-    return JSONResponse({"status": "success", "room_id": room.id})
+@rooms.post("/{room_id}/join", name="join_room")
+async def join_public_room(room_id: str, db: AsyncSession = Depends(get_async_db),
+                           user: User = Depends(get_current_user_async)):
+    """Вход в публичную комнату; в закрытую — по приглашению (POST /rooms/invites/{code}/join). Повторный вход — не ошибка."""
+    access = await room_access.get(room_id, db)
+    if access is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if user.id in access.members:
+        return {"status": "success", "room_id": room_id, "joined": False}
+    if access.is_private:
+        raise HTTPException(status_code=403, detail="Room is private, join by invite")
+    return {"status": "success", "room_id": room_id, "joined": await join_room(db, room_id, user.id)}
+
+
+@rooms.post("/{room_id}/invites", name="create_room_invite", status_code=status.HTTP_201_CREATED)
+async def create_room_invite(room_id: str, request: Request, db: AsyncSession = Depends(get_async_db),
+                             user: User = Depends(get_room_member)):
+    """Приглашение для закрытой комнаты: код и ссылка входа, действует ROOM_INVITE_TTL_DAYS дней."""
+    invite = await create_invite(db, room_id, user.id)
+    return {
+        "code": invite.code,
+        "url": str(request.url_for("join_by_invite", code=invite.code)),
+        "expires_at": invite.expires_at.isoformat(),
+    }
+
+
+@rooms.post("/invites/{code}/join", name="join_by_invite")
+async def join_by_invite(code: str, db: AsyncSession = Depends(get_async_db),
+                         user: User = Depends(get_current_user_async)):
+    invite = await get_valid_invite(db, code)
+    if invite is None:
+        raise HTTPException(status_code=404, detail="Invite not found or expired")
+    room_id = invite.room_id
+    return {"status": "success", "room_id": room_id, "joined": await join_room(db, room_id, user.id)}
 
 @rooms.post("/create")
-def create_room(room: RoomCreate, db: Session = Depends(get_db)):
+def create_room(room: RoomCreate, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
     max_attempts = 5  # Ограничение попыток для безопасности
+    user_id = user.id  # после rollback объекты сессии просрочены, читаем id заранее
     for attempt in range(max_attempts):
         new_room = Room.create_with_id(name=room.name, is_private=True)  # MVP: private по умолчанию
         db.add(new_room)
+        # Создатель — первый участник: без членства эндпоинты комнаты ответят ему 403
+        db.add(RoomMember(room_id=new_room.id, user_id=user_id))
         try:
             db.commit()
             db.refresh(new_room)  # Опционально: обновляем объект из БД
@@ -125,94 +165,188 @@ def create_room(room: RoomCreate, db: Session = Depends(get_db)):
 async def add_movie_to_room(
     room_id: str,
     create_movie_data: MovieCreate,
-    user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    user: User = Depends(get_room_member),
+    db: AsyncSession = Depends(get_async_db),
     # current_user: Annotated[User, Depends(get_current_user)] = None  # пока можно закомментировать
 ):
     """
     Добавляет фильм в указанную комнату по kinopoisk_url.
 
-    В MVP предполагаем, что пользователь уже авторизован (потом добавим проверку).
+    Фильм уже в базе — 200 и фильм. Новый фильм не ждёт Кинопоиск: в комнату сразу попадает заглушка,
+    ответ 202 {"job": ..., "movie": ...}, метаданные и постеры догружает ingestion_pool
+    (итог — событие movie_ready / movie_failed или GET /rooms/{room_id}/movies/jobs/{job_id}).
     """
-    existing_film = db.query(Movie).filter(Movie.kinopoisk_url == create_movie_data.kinopoisk_url).first()
-    if not existing_film:
-        new_movie = await get_movie_info_from_kp_url(create_movie_data)
-        db.add(new_movie)
-        db.flush()
+    added_by = create_movie_data.added_by if create_movie_data.added_by else user.id
+    added_by_name = user.username
+
+    # Поиск по уникальному индексу kinopoisk_id: разные варианты ссылки на один фильм не дают повторной загрузки
+    new_movie = await get_movie_by_kinopoisk_id(db, create_movie_data.kinopoisk_id)
+    if new_movie:
+        job = await get_pending_job(db, new_movie.id)  # фильм ещё загружается для другой комнаты
     else:
-        new_movie = existing_film
+        try:
+            new_movie, job = await enqueue_movie(db, create_movie_data.kinopoisk_id)
+        except IntegrityError:
+            # Тот же фильм параллельно добавили из другого запроса — берём сохранённый
+            await db.rollback()
+            new_movie = await get_movie_by_kinopoisk_id(db, create_movie_data.kinopoisk_id)
+            if new_movie is None:
+                # Конфликт был не по kinopoisk_id (ссылку заняла другая запись) или параллельное добавление откатилось:
+                # сохранённого фильма нет — клиент может повторить запрос
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="MOVIE_CONFLICT")
+            job = await get_pending_job(db, new_movie.id)
 
-    room = db.query(Room).filter(Room.id == room_id).one_or_none()
-    added_by = create_movie_data.added_by if create_movie_data.added_by else user.id
     mv = MoviesInRoom(
         movie_id=new_movie.id,
-        room_id=room.id,
-        added_by=added_by,
-        room=room
+        room_id=room_id,
+        added_by=added_by
     )
     db.add(mv)
+    db.add(RoomMovieStats(room_id=room_id, movie_id=new_movie.id))
     try:
-        db.commit()
+        await db.flush()
+        await db.run_sync(bump_room_version, room_id)
+        await db.commit()
     except IntegrityError:
         # Если база данных вернула ошибку уникальности (дубликат PK)
-        db.rollback()  # Обязательно откатываем транзакцию после ошибки
+        await db.rollback()  # Обязательно откатываем транзакцию после ошибки
 
         # Бросаем 409, чтобы фронтенд показал пользователю "Фильм уже в комнате"
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="ALREADY_ADDED"
         )
-    return new_movie
+    movie_search.forget_room(room_id)
+    card = movie_card(new_movie)
+    await room_event_hub.publish(room_id, "movie_added", movie=card, added_by=added_by_name,
+                                 job_id=job.id if job else None)
+    if job is None:
+        return new_movie
+    ingestion_pool.wake()
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"job": job_view(job), "movie": card})
+
+
+@rooms.get("/{room_id}/movies/jobs/{job_id}", summary="Статус загрузки добавленного фильма")
+async def get_movie_job(
+    room_id: str,
+    job_id: int,
+    user: User = Depends(get_room_member),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    pending / running / done; для done — карточка фильма. Подписка вместо опроса — события комнаты.
+    Задача видна только из комнаты, где есть её фильм; у неудавшейся фильма уже нет (о ней — событие movie_failed).
+    """
+    job = await db.get(IngestionJob, job_id)
+    if job is None or job.movie_id is None or await db.get(MoviesInRoom, (job.movie_id, room_id)) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    result = job_view(job)
+    if job.status == "done" and job.movie_id is not None:
+        result["movie"] = movie_card(await db.get(Movie, job.movie_id))
+    return result
+
+@rooms.post(
+    "/{room_id}/movies/import",
+    summary="Массовый импорт фильмов в комнату",
+    response_class=StreamingResponse,
+)
+async def import_movies_to_room(
+    room_id: str,
+    request: Request,
+    user: User = Depends(get_room_member),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Принимает JSON {"urls": [...]} или текстовый/CSV файл телом запроса (text/plain, text/csv).
+    Отдаёт NDJSON: по строке на каждую ссылку (added / queued / already_in_room / duplicate / invalid)
+    и последнюю строку со сводкой. Новые фильмы (queued) догружаются в фоне, как в add_movie_to_room:
+    итог — события комнаты movie_ready / movie_failed с job_id из строки.
+    """
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            urls = MovieImport.model_validate_json(await request.body()).urls
+        except ValidationError as e:
+            # Как у обычных тел запроса: битый JSON или не та схема — 422, а не 500
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False, include_input=False))
+    else:
+        urls = parse_import_text((await request.body()).decode("utf-8-sig", errors="replace"))
+
+    if not urls:
+        raise HTTPException(status_code=422, detail="Не найдено ни одной ссылки на Кинопоиск")
+    if len(urls) > IMPORT_MAX_URLS:
+        raise HTTPException(status_code=413, detail=f"Не больше {IMPORT_MAX_URLS} ссылок за один импорт")
+
+    async def ndjson():
+        async for event in import_movies(room_id, user.id, urls):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@rooms.get("/{room_id}/export", summary="Выгрузка фильмов и оценок комнаты", response_class=StreamingResponse)
+async def export_room(
+    room_id: str,
+    format: Literal["csv", "jsonl"] = "csv",
+    user: User = Depends(get_room_member),
+):
+    """Строка на оценку участника (см. room_export.py). Отдаётся потоком, память не зависит от размера комнаты."""
+    body = export_csv(room_id) if format == "csv" else export_jsonl(room_id)
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[format], headers={
+        "Content-Disposition": f'attachment; filename="room-{room_id}.{format}"',
+    })
+
+
+@rooms.post("/{room_id}/import", summary="Восстановление комнаты из выгрузки")
+async def restore_room_from_export(
+    room_id: str,
+    request: Request,
+    user: User = Depends(get_room_member),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Тело — файл из GET /{room_id}/export (CSV или JSON Lines), читается потоком и пишется пачками.
+    Добавляется только недостающее; ответ — счётчики добавленного.
+    """
+    user_id = user.id
+    await db.commit()  # пачки пишутся своими сессиями — читающая транзакция запроса не нужна
+
+    try:
+        totals = await restore_room(room_id, user_id, request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Некорректный файл выгрузки, {e}")
+    log_event("room_restored", room_id=room_id, user_id=user_id, **totals)
+    return totals
+
 
 @rooms.post("/{room_id}/ratings", name="submit_rating")
 async def submit_rating(
                     room_id: str,
                     rating_create: RatingCreate,
-                    db: Session = Depends(get_db),
-                    user: User = Depends(get_current_user)
+                    db: AsyncSession = Depends(get_async_db),
+                    user: User = Depends(get_room_member)
 ):
-    # Получить комнату и проверить членство
-    room = db.query(Room).filter(Room.id == room_id).first()
-    if not room:
-        raise HTTPException(status_code=404, detail="Room not found")
-
-    existing_rating = db.query(Rating).filter(
-        Rating.user_id == user.id,
-        Rating.movie_id == rating_create.movie_id
-    ).first()
-
-    if existing_rating:
-        # Обновляем старую оценку
-        existing_rating.score = rating_create.score
-    else:
-        # Создаем новую запись
-        new_rating = Rating(
-            user_id=user.id,
-            movie_id=rating_create.movie_id,
-            score=rating_create.score,
-            skipped=False if rating_create.score else True
-        )
-        db.add(new_rating)
-
+    user_id, username = user.id, user.username
     try:
-        db.commit()
+        # Синхронная логика агрегатов выполняется на async-соединении через run_sync (без блокировки loop)
+        await db.run_sync(save_rating, room_id, user_id, rating_create.movie_id, rating_create.score)
+        await db.commit()
     except Exception as e:
-        print('!!!', e)
-        db.rollback()
+        log_event("rating_save_failed", logging.ERROR, exc_info=True, room_id=room_id, user_id=user_id)
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при сохранении оценки, {e}")
+    mark_rated(room_id, user_id, rating_create.movie_id)
+    record_room_rating(room_id, user_id, rating_create.movie_id, rating_create.score)
+    room_recommender.record_rating(room_id, user_id, rating_create.movie_id, rating_create.score)
+    await publish_ratings(db, room_id, user_id, username, [(rating_create.movie_id, rating_create.score)])
 
-    result = get_next_unrated_movie_for_user(db, room_id, user.id)
+    result = await get_next_unrated_movie_for_user_async(db, room_id, user_id)
     if result:
         next_movie_in_room, rating = result
 
         return {
             "status": "success",
             "has_next": True,
-            "movie": {
-                "id": next_movie_in_room.id,
-                "title": next_movie_in_room.title,
-                "poster_url": next_movie_in_room.poster_url or "/static/default.jpg"
-            }
+            "movie": movie_card(next_movie_in_room)
         }
     else:
         return {
@@ -221,74 +355,211 @@ async def submit_rating(
         }
 
 
+@rooms.get("/{room_id}/queue", name="get_movie_queue")
+async def get_movie_queue(
+                    room_id: str,
+                    limit: int = Query(10, ge=1, le=50),
+                    order: Literal["added", "recommended"] = "added",
+                    db: AsyncSession = Depends(get_async_db),
+                    user: User = Depends(get_room_member)
+):
+    """
+    Следующие limit неоценённых фильмов: клиент показывает их без запроса на каждый свайп.
+    order=recommended — сначала те, что группе должны понравиться больше (recommender.py).
+    """
+    if order == "recommended":
+        picks = await recommend_movies(db, room_id, user.id, limit)
+        return {"movies": [movie_card(movie) for movie, group_score, my_score in picks]}
+    rows = await get_next_unrated_movies_for_user_async(db, room_id, user.id, limit)
+    return {"movies": [movie_card(movie) for movie, rating in rows]}
+
+
+@rooms.get("/{room_id}/recommendations", name="get_room_recommendations")
+async def get_room_recommendations(
+                    room_id: str,
+                    limit: int = Query(10, ge=1, le=50),
+                    db: AsyncSession = Depends(get_async_db),
+                    user: User = Depends(get_room_member)
+):
+    """
+    «Что смотреть дальше»: неоценённые мной фильмы комнаты по предсказанной оценке группы
+    (group_score) и моей (my_score).
+    """
+    picks = await recommend_movies(db, room_id, user.id, limit)
+    return {"movies": [
+        {**movie_card(movie), "group_score": round(group_score, 2), "my_score": round(my_score, 2)}
+        for movie, group_score, my_score in picks
+    ]}
+
+
+async def recommend_movies(db: AsyncSession, room_id: str, user_id: int, limit: int) -> list[tuple[Movie, float, float]]:
+    """Первые limit неоценённых пользователем фильмов по рейтингу рекомендаций."""
+    candidates = await get_unrated_movie_ids(db, room_id, user_id)
+    predictions = await room_recommender.predictions(room_id)
+    ranked = rank_movies(predictions, user_id, candidates)[:limit]
+    movies = {movie.id: movie for movie in await db.scalars(
+        select(Movie).where(Movie.id.in_([movie_id for movie_id, _, _ in ranked]))
+    )}
+    return [(movies[movie_id], group_score, my_score)
+            for movie_id, group_score, my_score in ranked if movie_id in movies]
+
+
+@rooms.post("/{room_id}/ratings/batch", name="submit_ratings_batch")
+async def submit_ratings_batch(
+                    room_id: str,
+                    batch: RatingBatch,
+                    db: AsyncSession = Depends(get_async_db),
+                    user: User = Depends(get_room_member)
+):
+    """
+    Пачка оценок в одной транзакции и, если prefetch > 0, следующие фильмы в том же ответе:
+    клиент показывает оценку сразу, а на сервер отправляет накопленное раз в несколько свайпов.
+    """
+    user_id, username = user.id, user.username
+    ratings = [(item.movie_id, item.score) for item in batch.ratings]
+    try:
+        await db.run_sync(save_ratings, room_id, user_id, ratings)
+        await db.commit()
+    except Exception as e:
+        log_event("ratings_batch_save_failed", logging.ERROR, exc_info=True, room_id=room_id, user_id=user_id)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Ошибка при сохранении оценок, {e}")
+    for movie_id, score in ratings:
+        mark_rated(room_id, user_id, movie_id)
+        record_room_rating(room_id, user_id, movie_id, score)
+        room_recommender.record_rating(room_id, user_id, movie_id, score)
+    await publish_ratings(db, room_id, user_id, username, ratings)
+
+    movies = []
+    if batch.prefetch:
+        rows = await get_next_unrated_movies_for_user_async(db, room_id, user_id, batch.prefetch)
+        movies = [movie_card(movie) for movie, rating in rows]
+    return {"status": "success", "saved": len(ratings), "movies": movies}
+
+
+async def publish_ratings(db: AsyncSession, room_id: str, user_id: int, username: str,
+                          ratings: list[tuple[int, float | None]]) -> None:
+    """rating_changed по каждому фильму пачки (после коммита) с новой средней из room_movie_stats."""
+    scores = dict(ratings)  # при повторе фильма в пачке сохранена последняя оценка
+    if not scores:
+        return
+    stats = await get_room_movie_stats(db, room_id, list(scores))
+    for movie_id, score in scores.items():
+        movie_stats = stats.get(movie_id)
+        await room_event_hub.publish(
+            room_id, "rating_changed",
+            movie_id=movie_id, user_id=user_id, username=username, score=score,
+            avg_score=round(movie_stats.avg_score, 2) if movie_stats and movie_stats.avg_score is not None else None,
+            ratings_count=movie_stats.ratings_count if movie_stats else 0,
+        )
+
+
+@rooms.get("/{room_id}/events", name="room_events")
+async def room_events(room_id: str, identity: CachedIdentity = Depends(get_current_identity_async)):
+    """
+    Server-Sent Events комнаты (см. room_events.py). EventSource не умеет заголовки,
+    поэтому initData можно передать как ?init_data=...
+    """
+    await room_access.check(room_id, identity.user_id)
+
+    async def stream():
+        async with room_event_hub.subscribe(room_id) as subscriber:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), ROOM_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"  # держим соединение через прокси
+                    continue
+                yield event.sse
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@rooms.websocket("/{room_id}/ws")
+async def room_events_ws(websocket: WebSocket, room_id: str, init_data: str | None = None):
+    """То же, что /events, по WebSocket. Клиент только слушает; входящие сообщения игнорируются."""
+    try:
+        identity = await get_current_identity_async(init_data, websocket.headers.get("x-telegram-init-data"))
+        await room_access.check(room_id, identity.user_id)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    async with room_event_hub.subscribe(room_id) as subscriber:
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), ROOM_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    await websocket.send_text('{"type":"ping"}')
+                    continue
+                await websocket.send_text(event.json)
+        except (WebSocketDisconnect, RuntimeError):
+            # RuntimeError — отправка в уже закрытый сокет
+            pass
+
+
+def history_sort(sort_by: str) -> str:
+    """Неизвестная сортировка — по дате, как раньше (старые ссылки не ломаются)."""
+    return sort_by if sort_by in HISTORY_SORTS else "date"
+
+
+async def load_history_page(db: AsyncSession, room_id: str, user_id: int, sort_by: str,
+                            cursor: str | None) -> tuple[list[dict], str | None]:
+    try:
+        position = HistoryCursor.decode(sort_by, cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    history_list, next_cursor = await db.run_sync(
+        get_room_history_page, room_id, user_id, sort_by, position, HISTORY_PAGE_SIZE
+    )
+    return history_list, next_cursor.encode() if next_cursor else None
+
+
 @rooms.get("/{room_id}/history/", name="get_room_history")
 async def get_room_history(
                     room_id: str,
                     request: Request,
                     sort_by: str = "date",
-                    db: Session = Depends(get_db),
-                    user: User = Depends(get_current_user)
+                    db: AsyncSession = Depends(get_async_db),
+                    user: User = Depends(get_room_member)
 ):
-    print('RUN: rooms -> get_room_history')
-
-    my_rating_alias = aliased(Rating)
-
-    query = db.query(
-        Movie,
-        MoviesInRoom.added_date,
-        User.username.label("added_by_name"),
-        func.avg(Rating.score).label("avg_score")
-    ).join(MoviesInRoom, Movie.id == MoviesInRoom.movie_id) \
-        .join(User, MoviesInRoom.added_by == User.id) \
-        .outerjoin(Rating, Movie.id == Rating.movie_id) \
-        .filter(MoviesInRoom.room_id == room_id) \
-        .group_by(Movie.id, MoviesInRoom.added_date, User.username)
-
-    # Логика сортировки
-    if sort_by == "my_rating":
-        # Сложная сортировка: нужно джойнить оценки текущего пользователя
-        # Чтобы отсортировать по "моей" оценке, нужно приджойнить оценки текущего юзера
-        query = query.outerjoin(
-            my_rating_alias,
-            and_(Movie.id == my_rating_alias.movie_id, my_rating_alias.user_id == user.id)
-        ).order_by(my_rating_alias.score.desc().nulls_last())
-    elif sort_by == "avg_rating":
-        query = query.order_by(func.avg(Rating.score).desc().nulls_last())
-    else:
-        query = query.order_by(MoviesInRoom.added_date.desc())
-
-    movies_data = query.all()
-
-    history_list = []
-    for m, added_date, added_by_name, avg_score in movies_data:
-        # Получаем оценку текущего пользователя
-        my_rating = db.query(Rating.score).filter(
-            Rating.movie_id == m.id,
-            Rating.user_id == user.id
-        ).scalar()
-
-        if my_rating is None:
-            my_rating = '-'
-
-        # Получаем все оценки для попапа
-        all_ratings = (db.query(User.username, Rating.score)
-                       .join(User)
-                       .filter(Rating.movie_id == m.id)
-                       .order_by(Rating.score.desc())
-                       .all())
-
-        history_list.append({
-            "movie": m,
-            "added_date": added_date.strftime("%d.%m.%Y"),
-            "added_by": added_by_name,
-            "avg_score": round(avg_score, 2) if avg_score else 0,
-            "my_score": my_rating,
-            "details": [{"name": r[0], "score": r[1]} for r in all_ratings]
+    """Первая страница истории рендерится на сервере, следующие догружаются из /history/page."""
+    sort_by = history_sort(sort_by)
+
+    async def render() -> bytes:
+        history_list, next_cursor = await load_history_page(db, room_id, user.id, sort_by, None)
+        return render_template("room/history.html", {
+            "request": request,
+            "history": history_list,
+            "room_id": room_id,
+            "current_sort": sort_by,
+            "current_user_id": user.id,
+            "next_cursor": next_cursor,
         })
 
-    return templates.TemplateResponse("room/history.html", {
-        "request": request,
-        "history": history_list,
-        "room_id": room_id,
-        "current_sort": sort_by
-    })
+    return await room_page_cache.respond(request, db, room_id, user.id, f"history:{sort_by}", render)
+
+
+@rooms.get("/{room_id}/history/page", name="get_room_history_page")
+async def get_room_history_fragment(
+                    room_id: str,
+                    request: Request,
+                    cursor: str,
+                    sort_by: str = "date",
+                    db: AsyncSession = Depends(get_async_db),
+                    user: User = Depends(get_room_member)
+):
+    """Следующая страница истории для бесконечной прокрутки: готовый HTML карточек и курсор дальше."""
+    sort_by = history_sort(sort_by)
+
+    async def render() -> bytes:
+        history_list, next_cursor = await load_history_page(db, room_id, user.id, sort_by, cursor)
+        html = templates.get_template("room/_history_cards.html").render(history=history_list)
+        return json.dumps({"html": html, "next_cursor": next_cursor}, ensure_ascii=False).encode()
+
+    return await room_page_cache.respond(request, db, room_id, user.id, f"history-page:{sort_by}:{cursor}", render,
+                                         media_type="application/json")
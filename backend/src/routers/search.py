@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+from models import Movie, User
+from poster_variants import movie_card
+from room_access import get_room_member
+from search_index import movie_search
+from utilites import get_current_user_async
+
+search = APIRouter(
+    tags=["search"],
+    responses={404: {"description": "Not found"}}
+)
+
+
+async def search_response(db: AsyncSession, q: str, limit: int, movie_ids: frozenset[int] | None = None) -> dict:
+    """Найденные id из индекса (search_index.py) -> карточки одним запросом по первичным ключам."""
+    found = await movie_search.search(q, limit, movie_ids)
+    movies = {movie.id: movie for movie in await db.scalars(
+        select(Movie).where(Movie.id.in_([movie_id for movie_id, _ in found]))
+    )}
+    return {"movies": [
+        {**movie_card(movies[movie_id]), "year": movies[movie_id].year, "score": score}
+        for movie_id, score in found if movie_id in movies
+    ]}
+
+
+@search.get("/movies/search", name="search_movies")
+async def search_movies(
+        q: str = Query(..., min_length=1, max_length=200),
+        limit: int = Query(20, ge=1, le=50),
+        db: AsyncSession = Depends(get_async_db),
+        user: User = Depends(get_current_user_async),
+):
+    """Поиск по всему каталогу: название (с опечатками, по началу слова) и год."""
+    return await search_response(db, q, limit)
+
+
+@search.get("/rooms/{room_id}/movies/search", name="search_room_movies")
+async def search_room_movies(
+        room_id: str,
+        q: str = Query(..., min_length=1, max_length=200),
+        limit: int = Query(20, ge=1, le=50),
+        db: AsyncSession = Depends(get_async_db),
+        user: User = Depends(get_room_member),
+):
+    """Поиск среди фильмов комнаты (состав комнаты — из кэша search_index)."""
+    return await search_response(db, q, limit, await movie_search.room_movie_ids(db, room_id))
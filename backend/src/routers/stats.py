@@ -0,0 +1,51 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query
+
+from models import User
+from room_access import get_room_member
+from room_stats import room_stats_cache, room_summary, movie_table, divisive_movies, agreement_matrix, RoomStats
+
+stats = APIRouter(
+    prefix="/rooms",
+    tags=["stats"],
+    responses={404: {"description": "Not found"}}
+)
+
+
+async def get_room_stats(room_id: str, user: User = Depends(get_room_member)) -> RoomStats:
+    """Статистика комнаты из кэша (см. room_stats.py), пересчитывается после новой оценки."""
+    return await room_stats_cache.get(room_id)
+
+
+@stats.get("/{room_id}/stats", name="get_room_stats")
+async def get_room_summary(room_stats: RoomStats = Depends(get_room_stats)):
+    """Итоги комнаты, средние и гистограммы по участникам."""
+    return room_summary(room_stats)
+
+
+@stats.get("/{room_id}/stats/movies", name="get_room_movie_stats")
+async def get_movie_stats(
+        room_stats: RoomStats = Depends(get_room_stats),
+        sort_by: Literal["avg_score", "stddev", "median", "ratings_count", "spread"] = "avg_score",
+        order: Literal["asc", "desc"] = "desc",
+        limit: int = Query(50, ge=1, le=500),
+        offset: int = Query(0, ge=0),
+):
+    """Среднее, отклонение, медиана и размах оценок по фильмам комнаты."""
+    return movie_table(room_stats, sort_by, order == "desc", limit, offset)
+
+
+@stats.get("/{room_id}/stats/divisive", name="get_divisive_movies")
+async def get_divisive_movies(
+        room_stats: RoomStats = Depends(get_room_stats),
+        limit: int = Query(10, ge=1, le=100),
+):
+    """Фильмы, по которым участники расходятся сильнее всего."""
+    return {"movies": divisive_movies(room_stats, limit)}
+
+
+@stats.get("/{room_id}/stats/agreement", name="get_member_agreement")
+async def get_member_agreement(room_stats: RoomStats = Depends(get_room_stats)):
+    """Насколько совпадают вкусы участников: общие фильмы, корреляция, среднеквадратичное расхождение."""
+    return agreement_matrix(room_stats)
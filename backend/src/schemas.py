@@ -2,6 +2,8 @@ from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, field_validator, Field
 
+from kinopoisk_urls import canonicalize_kinopoisk_url, extract_kinopoisk_id
+
 
 class UserBase(BaseModel):
     telegram_id: str
@@ -41,8 +43,17 @@ class MovieCreate(BaseModel):
 
     @field_validator("kinopoisk_url")
     @classmethod
-    def strip_trailing_slash(cls, value: str) -> str:
-        return value.rstrip("/")
+    def canonicalize_url(cls, value: str) -> str:
+        # Любой вариант ссылки (utm-метки, /series/, http, m.) -> https://www.kinopoisk.ru/film/<id>
+        return canonicalize_kinopoisk_url(value)
+
+    @property
+    def kinopoisk_id(self) -> int:
+        return extract_kinopoisk_id(self.kinopoisk_url)
+
+class MovieImport(BaseModel):
+    urls: List[str]  # Ссылки на Кинопоиск для массового импорта
+
 
 # class Movie(MovieBase):
 #     id: int
@@ -66,6 +77,10 @@ class RatingCreate(RatingBase):
 class Rating(RatingBase):
     id: int
 
+class RatingBatch(BaseModel):
+    ratings: List[RatingCreate] = Field(default_factory=list, max_length=100)  # Оценки, накопленные клиентом
+    prefetch: int = Field(0, ge=0, le=50)  # Сколько следующих фильмов вернуть в ответе
+
 class RoomMemberBase(BaseModel):
     room_id: int
     user_id: int
@@ -0,0 +1,296 @@
+"""
+Поиск фильмов по названию и году: по всему каталогу (GET /movies/search) и внутри комнаты
+(GET /rooms/{room_id}/movies/search). Рассчитан на поиск по мере набора на каталоге в 100k фильмов.
+
+Индекс — в памяти процесса, одинаково для SQLite и PostgreSQL (FTS5 есть только в SQLite):
+- название нормализуется: NFKC, casefold, «ё» -> «е», всё кроме букв и цифр — пробел (кириллица — как латиница)
+- каждое слово дополняется пробелами и режется на триграммы («  ма», « ма», «мат», ...);
+  posting-список триграммы — номера фильмов (array('i')), векторно складываются через np.bincount
+- последнее слово запроса ищется как префикс (без закрывающей триграммы) — набранное «матр» уже находит «Матрицу»
+- опечатки: фильм подходит, если совпала доля SEARCH_MIN_MATCH триграмм запроса, а не все
+- ранжирование: доля совпавших триграмм запроса и коэффициент Дайса (короче лишнее в названии — выше),
+  затем для первых кандидатов бонус за совпадение начала названия / слова
+- четырёхзначное число в запросе (1870–2100) — фильтр по году
+
+Индекс строится из БД при первом запросе (в отдельном потоке) и пополняется на месте:
+новые фильмы импорта и загруженные фоном (ingestion.py) — сразу после коммита (record_movie),
+фильмы из других процессов — догрузкой id больше последнего известного не чаще SEARCH_REFRESH_SECONDS.
+Раз в SEARCH_INDEX_TTL индекс перестраивается целиком в фоне (переименования из других процессов,
+место удалённых), пока запросы идут по старому.
+
+Поиск в комнате ограничивается множеством id её фильмов. Оно кэшируется (room_id -> frozenset) и сбрасывается
+в этом процессе после коммита изменения состава (forget_room): добавление, импорт, восстановление из файла,
+удаление не загрузившегося фильма. Изменения из других процессов видны не позже SEARCH_ROOM_SCOPE_TTL.
+Счётчики — GET /metrics/search.
+"""
+import asyncio
+import math
+import os
+import re
+import time
+import unicodedata
+from array import array
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from caching import KeyVersions, SingleFlight, TTLCache
+from database import AsyncSessionLocal
+from models import Movie, MoviesInRoom
+from observability import log_event
+
+load_dotenv()
+SEARCH_MIN_MATCH = float(os.getenv("SEARCH_MIN_MATCH", 0.4))
+SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", 5))
+SEARCH_INDEX_TTL = int(os.getenv("SEARCH_INDEX_TTL", 30 * 60))
+SEARCH_ROOM_SCOPE_TTL = int(os.getenv("SEARCH_ROOM_SCOPE_TTL", 60))
+SEARCH_ROOM_SCOPE_CACHE_SIZE = int(os.getenv("SEARCH_ROOM_SCOPE_CACHE_SIZE", 1024))
+SEARCH_RERANK = 200  # столько лучших по триграммам кандидатов получают бонус за начало названия
+
+MIN_YEAR, MAX_YEAR = 1870, 2100
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return " ".join(_WORD.findall(text))
+
+
+def trigrams(normalized: str, prefix: bool = False) -> set[str]:
+    """Триграммы слов с отступом «  слово »; prefix — последнее слово без закрывающей (ещё набирается)."""
+    words = normalized.split()
+    grams = set()
+    for i, word in enumerate(words):
+        padded = f"  {word}" if prefix and i == len(words) - 1 else f"  {word} "
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+
+def parse_query(query: str) -> tuple[str, list[int]]:
+    """Текст запроса и годы из него."""
+    words, years = [], []
+    for word in normalize(query).split():
+        if len(word) == 4 and word.isdigit() and MIN_YEAR <= int(word) <= MAX_YEAR:
+            years.append(int(word))
+        else:
+            words.append(word)
+    return " ".join(words), years
+
+
+class MovieSearchIndex:
+    """Триграммный индекс названий. Номер фильма в индексе (slot) не переиспользуется: удалённые помечаются."""
+
+    def __init__(self, capacity: int = 1024):
+        self._postings: dict[str, array] = {}
+        self._slots: dict[int, int] = {}  # movie_id -> slot
+        self._titles: list[str] = []  # нормализованные
+        self._movie_ids = np.zeros(capacity, dtype=np.int64)
+        self._years = np.zeros(capacity, dtype=np.int32)
+        self._grams = np.ones(capacity, dtype=np.int32)  # число триграмм названия
+        self._alive = np.zeros(capacity, dtype=bool)
+        self.max_movie_id = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def trigram_count(self) -> int:
+        return len(self._postings)
+
+    def _grow(self) -> None:
+        for name in ("_movie_ids", "_years", "_grams", "_alive"):
+            column = getattr(self, name)
+            grown = np.zeros(len(column) * 2, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def add(self, movie_id: int, title: str, year: int | None) -> None:
+        """Новый фильм или новое название уже известного."""
+        self.remove(movie_id)
+        slot = len(self._titles)
+        if slot == len(self._alive):
+            self._grow()
+        normalized = normalize(title)
+        grams = trigrams(normalized)
+        self._titles.append(normalized)
+        self._movie_ids[slot] = movie_id
+        self._years[slot] = year or 0
+        self._grams[slot] = max(len(grams), 1)
+        self._alive[slot] = True
+        self._slots[movie_id] = slot
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("i")
+            postings.append(slot)
+        self.max_movie_id = max(self.max_movie_id, movie_id)
+
+    def remove(self, movie_id: int) -> None:
+        slot = self._slots.pop(movie_id, None)
+        if slot is not None:
+            self._alive[slot] = False
+
+    def search(self, query: str, limit: int, movie_ids: frozenset[int] | None = None) -> list[tuple[int, float]]:
+        """(movie_id, релевантность 0..1+) по убыванию; movie_ids — искать только среди них (комната)."""
+        text, years = parse_query(query)
+        size = len(self._titles)
+        if not size or not (text or years):
+            return []
+
+        candidates = self._alive[:size].copy()
+        if movie_ids is not None:
+            scope = np.zeros(size, dtype=bool)
+            scope[np.fromiter((self._slots[m] for m in movie_ids if m in self._slots), dtype=np.int64)] = True
+            candidates &= scope
+        if years:
+            candidates &= np.isin(self._years[:size], years)
+
+        if text:
+            grams = trigrams(text, prefix=True)
+            # Временные представления posting-списков живут только до concatenate
+            postings = [self._postings[gram] for gram in grams if gram in self._postings]
+            if not postings:
+                return []
+            counts = np.bincount(np.concatenate([np.frombuffer(p, dtype=np.int32) for p in postings]), minlength=size)
+            candidates &= counts >= max(1, math.ceil(len(grams) * SEARCH_MIN_MATCH))
+            slots = np.flatnonzero(candidates)
+            matched = counts[slots]
+            scores = 0.7 * matched / len(grams) + 0.3 * 2 * matched / (len(grams) + self._grams[slots])
+        else:
+            slots = np.flatnonzero(candidates)
+            scores = np.ones(len(slots))
+
+        if len(slots) > SEARCH_RERANK:
+            best = np.argpartition(-scores, SEARCH_RERANK)[:SEARCH_RERANK]
+            slots, scores = slots[best], scores[best]
+        ranked = []
+        first_word = text.split()[0] if text else ""
+        for slot, score in zip(slots.tolist(), scores.tolist()):
+            title = self._titles[slot]
+            if text and title.startswith(text):
+                score += 0.3
+            elif first_word and f" {first_word}" in f" {title}":
+                score += 0.1
+            ranked.append((score, -len(title), slot))
+        ranked.sort(reverse=True)
+        return [(int(self._movie_ids[slot]), round(score, 3)) for score, _, slot in ranked[:limit]]
+
+
+async def load_movie_rows(after_id: int = 0) -> list[tuple[int, str, int]]:
+    async with AsyncSessionLocal() as db:
+        conn = await db.connection()
+        return (await conn.execute(
+            select(Movie.id, Movie.title, Movie.year).where(Movie.id > after_id).order_by(Movie.id)
+        )).all()
+
+
+def build_index(rows: list[tuple[int, str, int]]) -> MovieSearchIndex:
+    index = MovieSearchIndex(capacity=max(1024, len(rows) * 2))
+    for movie_id, title, year in rows:
+        index.add(movie_id, title, year)
+    return index
+
+
+class MovieSearch:
+    """Текущий индекс процесса: построение при первом запросе, догрузка новых id и фоновое перестроение."""
+
+    def __init__(self):
+        self._index: MovieSearchIndex | None = None
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        self._rebuilding: asyncio.Task | None = None
+        self._flight = SingleFlight()
+        self._room_movies = TTLCache(maxsize=SEARCH_ROOM_SCOPE_CACHE_SIZE, ttl=SEARCH_ROOM_SCOPE_TTL)
+        self._room_versions = KeyVersions(maxsize=SEARCH_ROOM_SCOPE_CACHE_SIZE, ttl=SEARCH_ROOM_SCOPE_TTL)
+        self.queries = 0
+        self.builds = 0
+        self.build_ms = 0.0
+        self.recorded = 0
+        self.caught_up = 0
+
+    async def _build(self) -> MovieSearchIndex:
+        started = time.perf_counter()
+        rows = await load_movie_rows()
+        index = await asyncio.to_thread(build_index, rows)
+        # Фильмы, записанные в этом процессе, пока строился индекс, догрузятся по max_movie_id
+        self._index, self._built_at, self._refreshed_at = index, time.monotonic(), time.monotonic()
+        self.builds += 1
+        self.build_ms = (time.perf_counter() - started) * 1000
+        log_event("search_index_built", movies=len(index), ms=round(self.build_ms, 1))
+        return index
+
+    async def _catch_up(self, index: MovieSearchIndex) -> None:
+        self._refreshed_at = time.monotonic()
+        for movie_id, title, year in await load_movie_rows(index.max_movie_id):
+            index.add(movie_id, title, year)
+            self.caught_up += 1
+
+    async def get_index(self) -> MovieSearchIndex:
+        index = self._index
+        if index is None:
+            return await self._flight.do("build", self._build)
+        now = time.monotonic()
+        if now - self._built_at > SEARCH_INDEX_TTL and self._rebuilding is None:
+            self._rebuilding = asyncio.create_task(self._rebuild())
+        if now - self._refreshed_at > SEARCH_REFRESH_SECONDS:
+            await self._catch_up(index)
+        return index
+
+    async def _rebuild(self) -> None:
+        try:
+            await self._flight.do("build", self._build)
+        except Exception as e:
+            log_event("search_index_rebuild_failed", error=str(e))
+            self._built_at = time.monotonic()  # следующая попытка — через SEARCH_INDEX_TTL
+        finally:
+            self._rebuilding = None
+
+    async def search(self, query: str, limit: int, movie_ids: frozenset[int] | None = None) -> list[tuple[int, float]]:
+        index = await self.get_index()
+        self.queries += 1
+        return index.search(query, limit, movie_ids)
+
+    async def room_movie_ids(self, db: AsyncSession, room_id: str) -> frozenset[int]:
+        """id фильмов комнаты; на промахе — запросом в сессии db. Прочитанное до forget_room в кэш не попадает."""
+        movie_ids = self._room_movies.get(room_id)
+        if movie_ids is None:
+            version = self._room_versions.get(room_id)
+            movie_ids = frozenset(await db.scalars(
+                select(MoviesInRoom.movie_id).where(MoviesInRoom.room_id == room_id)
+            ))
+            if self._room_versions.get(room_id) == version:
+                self._room_movies.set(room_id, movie_ids)
+        return movie_ids
+
+    def forget_room(self, room_id: str) -> None:
+        """После коммита изменения состава комнаты."""
+        self._room_versions.bump(room_id)
+        self._room_movies.delete(room_id)
+
+    def record_movie(self, movie_id: int, title: str, year: int | None) -> None:
+        """После коммита нового фильма или его названия. Индекс ещё не построен — прочитает из БД."""
+        if self._index is not None:
+            self._index.add(movie_id, title, year)
+            self.recorded += 1
+
+    def forget_movie(self, movie_id: int) -> None:
+        if self._index is not None:
+            self._index.remove(movie_id)
+
+    def stats(self) -> dict:
+        return {
+            "movies": len(self._index) if self._index is not None else 0,
+            "trigrams": self._index.trigram_count if self._index is not None else 0,
+            "queries": self.queries,
+            "builds": self.builds,
+            "build_ms": round(self.build_ms, 1),
+            "recorded": self.recorded,
+            "caught_up": self.caught_up,
+            "room_scopes": self._room_movies.stats(),
+        }
+
+
+movie_search = MovieSearch()
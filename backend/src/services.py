@@ -1,17 +1,468 @@
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
-from models import Movie, MoviesInRoom, Rating
+import base64
+import binascii
+import json
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
 
-def get_next_unrated_movie_for_user(db: Session, room_id: str, user_id: int) -> Movie | None:
+from sqlalchemy import or_, func, and_, case, update, delete, insert, select, tuple_, Select, ColumnElement, Row
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+from models import Movie, MoviesInRoom, Rating, Room, User, RoomMovieStats, RoomVersion
+from kinopoisk_urls import extract_kinopoisk_id
+from rating_queue import get_rating_queue, RATING_QUEUE_SIZE
+
+def _rating_join(room_id: str, user_id: int):
+    return and_(Rating.user_id == user_id, Rating.movie_id == MoviesInRoom.movie_id, Rating.room_id == room_id)
+
+
+_QUEUE_HEAD_PROBE = 4
+
+# Фильм не оценён, если у пользователя нет строки оценки в этой комнате (ни оценки, ни пропуска)
+_UNRATED = and_(Rating.score.is_(None), Rating.skipped.is_(None))
+
+
+def _queue_head_query(room_id: str, user_id: int, movie_ids: list[int]):
+    """
+    Неоценённые фильмы среди id из очереди: поиск по первичным ключам, без обхода комнаты.
+    Без ORDER BY — иначе планировщик идёт по индексу комнаты ради сортировки; порядок задаёт сама очередь.
+    """
+    return select(Movie, Rating) \
+             .join(MoviesInRoom, and_(MoviesInRoom.movie_id == Movie.id, MoviesInRoom.room_id == room_id)) \
+             .outerjoin(Rating, _rating_join(room_id, user_id)) \
+             .where(MoviesInRoom.movie_id.in_(movie_ids), _UNRATED)
+
+
+def _queue_refill_query(room_id: str, user_id: int, cursor: tuple | None, limit: int, exclude: set[int] = frozenset()):
+    """Следующие limit неоценённых фильмов после курсора (индекс ix_movies_in_room_room_added), кроме exclude."""
+    query = select(MoviesInRoom.movie_id, MoviesInRoom.added_date) \
+             .outerjoin(Rating, _rating_join(room_id, user_id)) \
+             .where(MoviesInRoom.room_id == room_id, _UNRATED)
+    if cursor is not None:
+        query = query.where(tuple_(MoviesInRoom.added_date, MoviesInRoom.movie_id) > tuple_(*cursor))
+    if exclude:
+        query = query.where(MoviesInRoom.movie_id.not_in(exclude))
+    return query.order_by(MoviesInRoom.added_date.asc(), MoviesInRoom.movie_id.asc()).limit(limit)
+
+
+def get_next_unrated_movies_for_user(db: Session, room_id: str, user_id: int, limit: int) -> list[tuple[Movie, Rating | None]]:
+    """
+    Следующие limit фильмов, которые пользователь еще не видел, в порядке показа.
+    Через очередь rating_queue: обычно один запрос по id из очереди, дозаполнение — когда очередь кончилась.
+    """
+    queue = get_rating_queue(room_id, user_id)
+    result = []
+    taken = set()  # id, уже проверенные и не оценённые, — по id, а не по позиции: очередь могут менять параллельно
+    rechecked = queue.cursor is None
+    while len(result) < limit:
+        pending = [movie_id for movie_id in queue.movie_ids if movie_id not in taken]
+        if not pending:
+            size = max(RATING_QUEUE_SIZE, limit - len(result))
+            rows = db.execute(_queue_refill_query(room_id, user_id, queue.cursor, size)).all()
+            if not rows and not rechecked:
+                # После курсора пусто — перепроверяем всю комнату: фильм, закоммиченный позже соседей
+                # с большим added_date, курсор мог уже пройти (см. rating_queue)
+                rechecked = True
+                rows = db.execute(_queue_refill_query(room_id, user_id, None, size, exclude=taken)).all()
+            if not rows:
+                break
+            queue.extend(rows)
+            continue
+
+        # Обычно первые фильмы очереди не оценены: проверяем столько, сколько нужно, а не всю пачку
+        probe = pending[:max(_QUEUE_HEAD_PROBE, limit - len(result))]
+        rows = {row[0].id: row for row in db.execute(_queue_head_query(room_id, user_id, probe))}
+        for movie_id in probe:
+            if movie_id in rows:
+                result.append(rows[movie_id])
+                taken.add(movie_id)
+            else:
+                # Уже оценён (например, в другом процессе)
+                queue.discard(movie_id)
+    return result[:limit]
+
+
+def get_next_unrated_movie_for_user(db: Session, room_id: str, user_id: int) -> tuple[Movie, Rating | None] | None:
     """
     Чистая бизнес-логика: найти фильм, который пользователь еще не видел.
     """
-    return db.query(Movie, Rating) \
-             .outerjoin(Rating, (Rating.user_id == user_id) & (Rating.movie_id == Movie.id)) \
-             .join(MoviesInRoom) \
-             .filter(MoviesInRoom.room_id == room_id) \
-             .filter(Rating.score.is_(None)) \
-             .filter(Rating.skipped.is_not(False)) \
-             .filter(or_(Rating.skipped.is_(None),Rating.skipped.is_(False))) \
-             .order_by(MoviesInRoom.added_date.asc()) \
-             .first()
\ No newline at end of file
+    rows = get_next_unrated_movies_for_user(db, room_id, user_id, 1)
+    return rows[0] if rows else None
+
+
+async def get_next_unrated_movie_for_user_async(db: AsyncSession, room_id: str, user_id: int) -> tuple[Movie, Rating | None] | None:
+    """
+    То же, что get_next_unrated_movie_for_user, для AsyncSession.
+    """
+    return await db.run_sync(get_next_unrated_movie_for_user, room_id, user_id)
+
+
+async def get_next_unrated_movies_for_user_async(db: AsyncSession, room_id: str, user_id: int, limit: int) -> list[tuple[Movie, Rating | None]]:
+    return await db.run_sync(get_next_unrated_movies_for_user, room_id, user_id, limit)
+
+
+async def get_unrated_movie_ids(db: AsyncSession, room_id: str, user_id: int) -> list[int]:
+    """Все неоценённые пользователем фильмы комнаты в порядке добавления — кандидаты для рекомендаций."""
+    return list(await db.scalars(
+        select(MoviesInRoom.movie_id)
+        .outerjoin(Rating, _rating_join(room_id, user_id))
+        .where(MoviesInRoom.room_id == room_id, _UNRATED)
+        .order_by(MoviesInRoom.added_date.asc(), MoviesInRoom.movie_id.asc())
+    ))
+
+
+async def get_room_movie_stats(db: AsyncSession, room_id: str, movie_ids: list[int]) -> dict[int, RoomMovieStats]:
+    stats = await db.scalars(
+        select(RoomMovieStats).where(RoomMovieStats.room_id == room_id, RoomMovieStats.movie_id.in_(movie_ids))
+    )
+    return {row.movie_id: row for row in stats}
+
+
+async def get_movie_by_kinopoisk_id(db: AsyncSession, kinopoisk_id: int) -> Movie | None:
+    return await db.scalar(select(Movie).where(Movie.kinopoisk_id == kinopoisk_id))
+
+
+async def resolve_kinopoisk_urls(db: AsyncSession, urls: list[str]) -> dict[str, int | Movie | None]:
+    """
+    Пакетное сопоставление ссылок с фильмами в БД: один запрос IN по kinopoisk_id на все ссылки.
+
+    Возвращает {ссылка: Movie} для известных фильмов, {ссылка: kinopoisk_id} для ещё не загруженных
+    и {ссылка: None} для ссылок, из которых id не извлекается.
+    """
+    ids_by_url = {}
+    for url in urls:
+        try:
+            ids_by_url[url] = extract_kinopoisk_id(url)
+        except ValueError:
+            ids_by_url[url] = None
+
+    known_ids = {kp_id for kp_id in ids_by_url.values() if kp_id is not None}
+    movies = {}
+    if known_ids:
+        movies = {m.kinopoisk_id: m for m in await db.scalars(select(Movie).where(Movie.kinopoisk_id.in_(known_ids)))}
+
+    return {url: movies.get(kp_id, kp_id) for url, kp_id in ids_by_url.items()}
+
+
+def save_rating(db: Session, room_id: str, user_id: int, movie_id: int, score: float | None) -> Rating:
+    """
+    Создаёт/обновляет оценку пользователя в комнате и в той же транзакции
+    обновляет агрегат room_movie_stats. Коммит — на вызывающей стороне.
+    """
+    rating = db.get(Rating, {"user_id": user_id, "movie_id": movie_id, "room_id": room_id})
+    old_score = rating.score if rating else None
+
+    if rating:
+        # Обновляем старую оценку
+        rating.score = score
+    else:
+        # Создаем новую запись
+        rating = Rating(
+            user_id=user_id,
+            movie_id=movie_id,
+            room_id=room_id,
+            score=score,
+            skipped=False if score else True
+        )
+        db.add(rating)
+
+    db.flush()
+    update_room_movie_stats(db, room_id, movie_id, old_score, score)
+    bump_room_version(db, room_id)
+    return rating
+
+
+def save_ratings(db: Session, room_id: str, user_id: int, ratings: list[tuple[int, float | None]]) -> None:
+    """
+    Пачка оценок (movie_id, score) в одной транзакции. Повтор movie_id в пачке — побеждает последняя оценка.
+    Коммит — на вызывающей стороне.
+    """
+    for movie_id, score in ratings:
+        save_rating(db, room_id, user_id, movie_id, score)
+
+
+def update_room_movie_stats(db: Session, room_id: str, movie_id: int, old_score: float | None, new_score: float | None) -> None:
+    """
+    Инкрементальное обновление агрегата при смене оценки old_score -> new_score.
+    count/sum/sum of squares считаются дельтой одним атомарным UPDATE.
+    min/max при добавлении оценки сдвигаются без чтения, а при замене/удалении старой —
+    пересчитываются подзапросом по индексу ratings(room_id, movie_id).
+    """
+    if old_score == new_score:
+        return
+
+    old = old_score if old_score is not None else 0
+    new = new_score if new_score is not None else 0
+    values = {
+        "ratings_count": RoomMovieStats.ratings_count + (new_score is not None) - (old_score is not None),
+        "score_sum": RoomMovieStats.score_sum + (new - old),
+        "score_sq_sum": RoomMovieStats.score_sq_sum + (new * new - old * old),
+    }
+
+    if old_score is not None:
+        scores = select(Rating.score).where(Rating.room_id == room_id, Rating.movie_id == movie_id)
+        values["score_min"] = scores.with_only_columns(func.min(Rating.score)).scalar_subquery()
+        values["score_max"] = scores.with_only_columns(func.max(Rating.score)).scalar_subquery()
+    elif new_score is not None:
+        values["score_min"] = case(
+            (or_(RoomMovieStats.score_min.is_(None), RoomMovieStats.score_min > new_score), new_score),
+            else_=RoomMovieStats.score_min
+        )
+        values["score_max"] = case(
+            (or_(RoomMovieStats.score_max.is_(None), RoomMovieStats.score_max < new_score), new_score),
+            else_=RoomMovieStats.score_max
+        )
+
+    result = db.execute(
+        update(RoomMovieStats)
+        .where(RoomMovieStats.room_id == room_id, RoomMovieStats.movie_id == movie_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        # Строки агрегата ещё нет (фильм добавлен до появления таблицы) — считаем с нуля
+        rebuild_room_movie_stats(db, room_id=room_id, movie_id=movie_id)
+
+
+def _room_movie_stats_select(room_id: str | None = None, movie_id: int | None = None):
+    """
+    Эталонный расчёт агрегата по таблице ratings (для пересборки и проверки).
+    Оценки сначала группируются одним проходом, потом присоединяются к фильмам комнаты: при join по каждому фильму
+    SQLite выбирает покрывающий ix_ratings_room_user_score и перебирает все оценки комнаты на каждый фильм.
+    """
+    ratings = select(
+        Rating.room_id,
+        Rating.movie_id,
+        func.count(Rating.score).label("ratings_count"),
+        func.sum(Rating.score).label("score_sum"),
+        func.sum(Rating.score * Rating.score).label("score_sq_sum"),
+        func.min(Rating.score).label("score_min"),
+        func.max(Rating.score).label("score_max"),
+    ).group_by(Rating.room_id, Rating.movie_id)
+    query = select(MoviesInRoom.room_id, MoviesInRoom.movie_id)
+
+    if room_id is not None:
+        ratings = ratings.where(Rating.room_id == room_id)
+        query = query.where(MoviesInRoom.room_id == room_id)
+    if movie_id is not None:
+        ratings = ratings.where(Rating.movie_id == movie_id)
+        query = query.where(MoviesInRoom.movie_id == movie_id)
+
+    ratings = ratings.subquery()
+    return query.add_columns(
+        func.coalesce(ratings.c.ratings_count, 0),
+        func.coalesce(ratings.c.score_sum, 0),
+        func.coalesce(ratings.c.score_sq_sum, 0),
+        ratings.c.score_min,
+        ratings.c.score_max,
+    ).outerjoin(ratings, and_(ratings.c.room_id == MoviesInRoom.room_id, ratings.c.movie_id == MoviesInRoom.movie_id))
+
+
+def rebuild_room_movie_stats(db: Session, room_id: str | None = None, movie_id: int | None = None) -> None:
+    """Полная пересборка room_movie_stats (всей таблицы, комнаты или одного фильма в комнате)."""
+    stmt = delete(RoomMovieStats)
+    if room_id is not None:
+        stmt = stmt.where(RoomMovieStats.room_id == room_id)
+    if movie_id is not None:
+        stmt = stmt.where(RoomMovieStats.movie_id == movie_id)
+    db.execute(stmt)
+
+    db.execute(insert(RoomMovieStats).from_select(
+        ["room_id", "movie_id", "ratings_count", "score_sum", "score_sq_sum", "score_min", "score_max"],
+        _room_movie_stats_select(room_id, movie_id)
+    ))
+
+
+def check_room_movie_stats(db: Session, room_id: str | None = None) -> list[dict]:
+    """
+    Сверяет room_movie_stats с пересчётом по ratings.
+    Возвращает список расхождений (пустой — всё консистентно).
+    """
+    stored = {
+        (s.room_id, s.movie_id): (s.ratings_count, s.score_sum, s.score_sq_sum, s.score_min, s.score_max)
+        for s in db.scalars(
+            select(RoomMovieStats).where(RoomMovieStats.room_id == room_id) if room_id is not None
+            else select(RoomMovieStats)
+        )
+    }
+
+    problems = []
+    for row_room_id, row_movie_id, *expected in db.execute(_room_movie_stats_select(room_id)):
+        actual = stored.pop((row_room_id, row_movie_id), None)
+        if actual is None or any(
+            (a is None) != (e is None) or (a is not None and abs(a - e) > 1e-6)
+            for a, e in zip(actual, expected)
+        ):
+            problems.append({"room_id": row_room_id, "movie_id": row_movie_id, "expected": tuple(expected), "actual": actual})
+
+    # Строки агрегата для фильмов, которых уже нет в комнате
+    for (row_room_id, row_movie_id), actual in stored.items():
+        problems.append({"room_id": row_room_id, "movie_id": row_movie_id, "expected": None, "actual": actual})
+
+    return problems
+
+
+def bump_room_version(db: Session, room_id: str) -> None:
+    """Версия комнаты +1 (upsert, в транзакции вызывающего). Коммит — на вызывающей стороне."""
+    insert_ = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = insert_(RoomVersion).values(room_id=room_id, version=1, updated_at=datetime.utcnow())
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[RoomVersion.room_id],
+        set_={"version": RoomVersion.version + 1, "updated_at": stmt.excluded.updated_at},
+    ))
+
+
+async def get_room_version(db: AsyncSession, room_id: str) -> tuple[int, datetime | None] | None:
+    """Версия комнаты и время изменения одним запросом по первичному ключу; None — комнаты нет."""
+    row = (await db.execute(
+        select(RoomVersion.version, RoomVersion.updated_at)
+        .select_from(Room)
+        .outerjoin(RoomVersion, RoomVersion.room_id == Room.id)
+        .where(Room.id == room_id)
+    )).first()
+    if row is None:
+        return None
+    return row.version or 0, row.updated_at
+
+
+HISTORY_SORTS = ("date", "avg_rating", "my_rating")
+
+
+@dataclass(frozen=True)
+class HistoryCursor:
+    """
+    Позиция последнего фильма страницы истории: ключ сортировки и movie_id (при равных ключах).
+    Для my_rating unrated=True — курсор уже в хвосте из фильмов без моей оценки (там ключ — дата добавления).
+    """
+    key: float | datetime
+    movie_id: int
+    unrated: bool = False
+
+    def encode(self) -> str:
+        key = self.key.isoformat() if isinstance(self.key, datetime) else self.key
+        payload = json.dumps([key, self.movie_id, self.unrated], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, sort_by: str, value: str) -> "HistoryCursor":
+        """ValueError — курсор испорчен или от другой сортировки."""
+        try:
+            key, movie_id, unrated = json.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+            if sort_by == "date" or unrated:
+                key = datetime.fromisoformat(key)
+            elif not isinstance(key, (int, float)) or isinstance(key, bool):
+                raise ValueError(key)
+            if not isinstance(movie_id, int) or (unrated and sort_by != "my_rating"):
+                raise ValueError(movie_id)
+        except (TypeError, ValueError, binascii.Error) as e:
+            raise ValueError(f"Некорректный курсор: {e}") from None
+        return cls(key, movie_id, bool(unrated))
+
+
+@dataclass
+class _HistoryOrder:
+    query: Select
+    key: ColumnElement
+    movie_id: ColumnElement
+    unrated: bool = False
+
+    def fetch(self, db: Session, cursor: HistoryCursor | None, limit: int) -> list[tuple[Row, HistoryCursor]]:
+        query = self.query.add_columns(self.key.label("sort_key"))
+        if cursor is not None:
+            # (key, movie_id) < курсора. Не tuple_: в такой форме SQLite ищет по индексу и когда ключ — выражение
+            query = query.where(self.key <= cursor.key, or_(self.key < cursor.key, self.movie_id < cursor.movie_id))
+        rows = db.execute(query.order_by(self.key.desc(), self.movie_id.desc()).limit(limit)).all()
+        return [(row, HistoryCursor(row.sort_key, row.Movie.id, self.unrated)) for row in rows]
+
+
+def _history_orders(room_id: str, user_id: int, sort_by: str) -> list[_HistoryOrder]:
+    """
+    Порядок страниц истории, для каждой сортировки — по своему индексу и с фильтром по комнате
+    на колонке ведущей таблицы, остальное — поиском по первичным ключам. Поэтому страница стоит
+    одинаково и в комнате на 20 фильмов, и на 20 000:
+    - date: ix_movies_in_room_room_added
+    - avg_rating: ix_room_movie_stats_room_avg (выражение RoomMovieStats.avg_sort_key)
+    - my_rating: ix_ratings_room_user_score по моим оценкам, затем фильмы без моей оценки по дате
+    room_movie_stats присоединяется внешним соединением (строки может ещё не быть — фильм всё равно в истории),
+    внутренним — только для avg_rating, где она ведущая таблица.
+    """
+    my_rating = aliased(Rating)
+    my_rating_join = and_(my_rating.movie_id == MoviesInRoom.movie_id,
+                          my_rating.user_id == user_id,
+                          my_rating.room_id == room_id)
+
+    def base(my_rating_required: bool = False, stats_required: bool = False) -> Select:
+        return select(
+            Movie,
+            MoviesInRoom.added_date,
+            User.username.label("added_by_name"),
+            func.coalesce(RoomMovieStats.avg_score, 0).label("avg_score"),
+            my_rating.score.label("my_score"),
+        ).select_from(MoviesInRoom) \
+            .join(Movie, Movie.id == MoviesInRoom.movie_id) \
+            .join(User, MoviesInRoom.added_by == User.id) \
+            .join(RoomMovieStats, and_(RoomMovieStats.room_id == MoviesInRoom.room_id,
+                                       RoomMovieStats.movie_id == MoviesInRoom.movie_id), isouter=not stats_required) \
+            .join(my_rating, my_rating_join, isouter=not my_rating_required)
+
+    by_date = _HistoryOrder(base().where(MoviesInRoom.room_id == room_id),
+                            MoviesInRoom.added_date, MoviesInRoom.movie_id)
+    if sort_by == "avg_rating":
+        return [_HistoryOrder(base(stats_required=True).where(RoomMovieStats.room_id == room_id),
+                              RoomMovieStats.avg_sort_key, RoomMovieStats.movie_id)]
+    if sort_by == "my_rating":
+        rated = _HistoryOrder(base(my_rating_required=True)
+                              .where(my_rating.score.is_not(None), MoviesInRoom.room_id == room_id),
+                              my_rating.score, my_rating.movie_id)
+        unrated = _HistoryOrder(by_date.query.where(my_rating.score.is_(None)),
+                                by_date.key, by_date.movie_id, unrated=True)
+        return [rated, unrated]
+    return [by_date]
+
+
+def get_room_history_page(db: Session, room_id: str, user_id: int, sort_by: str = "date",
+                          cursor: HistoryCursor | None = None, limit: int = 30) -> tuple[list[dict], HistoryCursor | None]:
+    """
+    Страница истории просмотров комнаты (keyset-пагинация) и курсор следующей (None — это последняя).
+    Запросов — 2-3 на страницу, независимо от числа фильмов в комнате:
+    1. Фильмы страницы + кто добавил + средняя оценка из room_movie_stats + моя оценка
+    2. Оценки участников только по фильмам страницы, группируем в Python для попапа
+    """
+    rows = []
+    for order in _history_orders(room_id, user_id, sort_by):
+        if cursor is not None and cursor.unrated and not order.unrated:
+            continue  # часть с моими оценками уже пройдена
+        # Курсор относится к своей части; следующая часть начинается с начала
+        order_cursor = cursor if cursor is not None and cursor.unrated == order.unrated else None
+        rows += order.fetch(db, order_cursor, limit + 1 - len(rows))  # +1 — есть ли следующая страница
+        if len(rows) > limit:
+            break
+    next_cursor = rows[limit - 1][1] if len(rows) > limit else None
+    rows = [row for row, _ in rows[:limit]]
+
+    page_ids = [row.Movie.id for row in rows]
+    page_ratings = db.execute(
+        select(Rating.movie_id, User.username, Rating.score)
+        .join(User, Rating.user_id == User.id)
+        .where(Rating.room_id == room_id, Rating.movie_id.in_(page_ids))
+        .order_by(Rating.movie_id, Rating.score.desc())
+    ).all() if page_ids else []
+
+    details_by_movie = defaultdict(list)
+    for movie_id, username, score in page_ratings:
+        details_by_movie[movie_id].append({"name": username, "score": score})
+
+    history_list = []
+    for m, added_date, added_by_name, avg_score, my_score, _ in rows:
+        history_list.append({
+            "movie": m,
+            "added_date": added_date.strftime("%d.%m.%Y"),
+            "added_by": added_by_name,
+            "avg_score": round(avg_score, 2) if avg_score else 0,
+            "my_score": my_score if my_score is not None else '-',
+            "details": details_by_movie[m.id]
+        })
+
+    return history_list, next_cursor
@@ -0,0 +1,108 @@
+"""
+Проверка initData Telegram Mini App и кэш уже проверенных сессий.
+
+Алгоритм проверки: https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+    secret_key = HMAC_SHA256(key="WebAppData", msg=bot_token)
+    hash = hex(HMAC_SHA256(key=secret_key, msg=data_check_string))
+где data_check_string — все поля кроме hash, отсортированные по ключу, в виде "key=value" через "\n".
+
+initData одной сессии Mini App не меняется между запросами, поэтому результат
+(проверка подписи + пользователь в БД) кэшируется по самой строке initData.
+"""
+import hashlib
+import hmac
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import parse_qsl
+
+from dotenv import load_dotenv
+
+from caching import TTLCache
+
+load_dotenv()
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+
+# Сколько секунд initData считается действительной после auth_date (0 — не проверять)
+INIT_DATA_MAX_AGE = int(os.getenv("TELEGRAM_INIT_DATA_MAX_AGE", 24 * 60 * 60))
+# Размер и TTL кэша проверенных initData
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10_000))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 15 * 60))
+
+
+class InitDataError(ValueError):
+    """initData не прошла проверку (нет подписи, подпись неверна, истекла)."""
+
+
+def secret_key_for(bot_token: str) -> bytes:
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+def sign_init_data(fields: dict[str, str], bot_token: str) -> str:
+    """Вычисляет hash для набора полей initData (используется и в проверке, и в тестовых скриптах)."""
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    return hmac.new(secret_key_for(bot_token), check_string.encode(), hashlib.sha256).hexdigest()
+
+
+def check_init_data(init_data: str, bot_token: str | None = None, max_age: int | None = None,
+                    now: float | None = None) -> dict[str, Any]:
+    """
+    Проверяет подпись и срок initData. Возвращает поля initData, где user уже разобран из JSON.
+    """
+    bot_token = bot_token or TELEGRAM_BOT_TOKEN
+    max_age = INIT_DATA_MAX_AGE if max_age is None else max_age
+    if not bot_token:
+        raise RuntimeError("TELEGRAM_BOT_TOKEN не задан")
+    if not init_data:
+        raise InitDataError("Empty initData")
+
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop("hash", None)
+    if not received_hash:
+        raise InitDataError("Missing hash")
+
+    if not hmac.compare_digest(sign_init_data(fields, bot_token), received_hash):
+        raise InitDataError("Invalid hash")
+
+    try:
+        auth_date = int(fields["auth_date"])
+    except (KeyError, ValueError):
+        raise InitDataError("Invalid auth_date")
+    if max_age and (now or time.time()) - auth_date > max_age:
+        raise InitDataError("initData expired")
+
+    try:
+        fields["user"] = json.loads(fields["user"])
+    except (KeyError, json.JSONDecodeError):
+        raise InitDataError("Invalid user")
+    # Без id пользователя не найти и не создать — такой initData не годится для авторизации
+    if not isinstance(fields["user"], dict) or "id" not in fields["user"]:
+        raise InitDataError("Invalid user")
+
+    return fields
+
+
+def username_from_telegram_user(user_data: dict) -> str:
+    # username в Telegram необязателен, а в users.username — NOT NULL
+    return user_data.get("username") or user_data.get("first_name") or str(user_data["id"])
+
+
+@dataclass(frozen=True)
+class CachedIdentity:
+    """То, что нужно знать о пользователе без похода в БД."""
+    user_id: int
+    telegram_id: str
+    username: str
+
+
+identity_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def cache_ttl_for(fields: dict[str, Any]) -> float:
+    """Запись в кэше не должна пережить срок действия самой initData."""
+    if not INIT_DATA_MAX_AGE:
+        return AUTH_CACHE_TTL
+    expires_in = int(fields["auth_date"]) + INIT_DATA_MAX_AGE - time.time()
+    return min(AUTH_CACHE_TTL, expires_in)
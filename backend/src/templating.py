@@ -0,0 +1,122 @@
+"""
+Общее окружение Jinja для всех роутеров: один Jinja2Templates на процесс.
+
+- Шаблоны компилируются при старте (precompile_templates) и складываются байткодом в TEMPLATES_BYTECODE_DIR:
+  следующий процесс/воркер читает готовый байткод вместо разбора исходников
+- TEMPLATES_AUTO_RELOAD=false (по умолчанию) — без stat() файла шаблона на каждый рендер;
+  для разработки включить TEMPLATES_AUTO_RELOAD=true
+- Каждый рендер верхнего шаблона замеряется (включая extends/include внутри него):
+  p50/p99 по последним TEMPLATES_TIMING_SAMPLES рендерам каждого шаблона — GET /metrics/templates.
+  Так видно, сколько в show_room / get_room_history занимает шаблон, а сколько — запросы к БД
+  (то же по отдельному запросу — template_ms рядом с sql_ms в логе запроса, см. observability.py)
+"""
+import os
+import time
+from collections import deque
+
+import jinja2
+from dotenv import load_dotenv
+from starlette.templating import Jinja2Templates
+
+from database import env_bool, env_int
+from observability import current_request_stats
+from poster_variants import poster_variant_url, poster_srcset
+
+load_dotenv()
+TEMPLATES_DIR = os.getenv("TEMPLATES_DIR", "templates")
+TEMPLATES_AUTO_RELOAD = env_bool("TEMPLATES_AUTO_RELOAD", False)
+TEMPLATES_BYTECODE_DIR = os.getenv("TEMPLATES_BYTECODE_DIR", os.path.join("cache", "jinja_bytecode"))
+TEMPLATES_TIMING_SAMPLES = env_int("TEMPLATES_TIMING_SAMPLES", 1000)
+
+
+def _percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+class RenderTimings:
+    """Последние длительности рендера по имени шаблона (скользящее окно) и общие счётчики."""
+
+    def __init__(self, samples: int = TEMPLATES_TIMING_SAMPLES):
+        self.samples = samples
+        self._timings: dict[str, deque[float]] = {}
+        self._counts: dict[str, int] = {}
+        self.precompiled = 0
+        self.precompile_ms = 0.0
+
+    def record(self, name: str, seconds: float) -> None:
+        timings = self._timings.get(name)
+        if timings is None:
+            timings = self._timings[name] = deque(maxlen=self.samples)
+        timings.append(seconds * 1000)
+        self._counts[name] = self._counts.get(name, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "auto_reload": TEMPLATES_AUTO_RELOAD,
+            "bytecode_dir": TEMPLATES_BYTECODE_DIR,
+            "precompiled": self.precompiled,
+            "precompile_ms": round(self.precompile_ms, 1),
+            "templates": {
+                name: {
+                    "renders": self._counts[name],
+                    "p50_ms": round(_percentile(list(timings), 50), 3),
+                    "p99_ms": round(_percentile(list(timings), 99), 3),
+                    "max_ms": round(max(timings), 3),
+                }
+                for name, timings in sorted(self._timings.items())
+            },
+        }
+
+
+render_timings = RenderTimings()
+
+
+class TimedTemplate(jinja2.Template):
+    """Шаблон, замеряющий render(). Вложенные extends/include не замеряются отдельно — входят во внешний."""
+
+    def render(self, *args, **kwargs) -> str:
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            render_timings.record(self.name, elapsed)
+            stats = current_request_stats()
+            if stats is not None:
+                stats.template_seconds += elapsed
+
+
+def _create_environment() -> jinja2.Environment:
+    os.makedirs(TEMPLATES_BYTECODE_DIR, exist_ok=True)
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+        autoescape=True,
+        auto_reload=TEMPLATES_AUTO_RELOAD,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(TEMPLATES_BYTECODE_DIR),
+        cache_size=-1,  # все шаблоны остаются в памяти, без вытеснения
+    )
+    env.template_class = TimedTemplate
+    env.filters["poster_variant"] = poster_variant_url
+    env.filters["poster_srcset"] = poster_srcset
+    return env
+
+
+templates = Jinja2Templates(env=_create_environment())
+
+
+def render_template(name: str, context: dict) -> bytes:
+    """Рендер шаблона в байты — для страниц, которые кладутся в room_page_cache."""
+    return templates.get_template(name).render(context).encode()
+
+
+def precompile_templates() -> int:
+    """Компилирует все .html-шаблоны (байткод — в TEMPLATES_BYTECODE_DIR). Вызывается на старте приложения."""
+    started = time.perf_counter()
+    names = templates.env.list_templates(extensions=["html"])
+    for name in names:
+        templates.env.get_template(name)
+    render_timings.precompiled = len(names)
+    render_timings.precompile_ms = (time.perf_counter() - started) * 1000
+    return len(names)
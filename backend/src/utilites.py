@@ -8,13 +8,28 @@ from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 
 import httpx
 from dotenv import load_dotenv
-from fastapi import HTTPException, Depends, Header, Request
+from fastapi import HTTPException, Depends, Header, Request, Query
 from httpx import Response
-from sqlalchemy.orm import Session
-
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from database import get_db, get_async_db, AsyncSessionLocal
+from http_client import get_http_client, KINOPOISK_TIMEOUT
+from kinopoisk_cache import kinopoisk_cache
+from kinopoisk_urls import extract_kinopoisk_id
 from models import Movie, User
+from poster_storage import save_poster
 from schemas import MovieCreate, MovieBase
+from telegram_auth import (check_init_data, InitDataError, CachedIdentity, identity_cache, cache_ttl_for,
+                           username_from_telegram_user)
+
+load_dotenv()
+KINOPOISK_API_KEY = os.getenv("KINOPOISK_API_KEY")
+KINOPOISK_API_BASE_URL = os.getenv('KINOPOISK_API_BASE_URL')
+KINOPOISK_API_VERSION = os.getenv('KINOPOISK_API_VERSION')
 
 
 async def get_movie_info_from_kp_url(create_movie_data: MovieCreate) -> Movie:
@@ -28,25 +43,17 @@ async def get_movie_info_from_kp_url(create_movie_data: MovieCreate) -> Movie:
     Возвращает: MovieBase или поднимает исключение
     """
     film_url = create_movie_data.kinopoisk_url
-    load_dotenv()
-    KINOPOISK_API_KEY = os.getenv("KINOPOISK_API_KEY")
-    KINOPOISK_API_BASE_URL = os.getenv('KINOPOISK_API_BASE_URL')
-    KINOPOISK_API_VERSION = os.getenv('KINOPOISK_API_VERSION')
-
-    if not ("kinopoisk.ru/film/" in film_url or "kinopoisk.ru/series/" in film_url):
-        raise ValueError("Некорректная ссылка на Кинопоиск")
+    film_id = extract_kinopoisk_id(film_url)
 
     try:
-        parsed_url = urlparse(film_url)
-        film_id = int(parsed_url.path.strip("/").split("/")[-1])
-    except (ValueError, IndexError):
-        raise ValueError(f"Не удалось извлечь ID фильма из ссылки: {film_url}")
-
-    try:
-        response = await get_film_data_from_kinopoisk(KINOPOISK_API_BASE_URL, KINOPOISK_API_KEY, KINOPOISK_API_VERSION, film_id)
+        # Через кэш: повторные и одновременные запросы одного фильма не тратят квоту API
+        film_json = await kinopoisk_cache.get_film_json(
+            film_id,
+            lambda kp_id: get_film_data_from_kinopoisk(KINOPOISK_API_BASE_URL, KINOPOISK_API_KEY, KINOPOISK_API_VERSION, kp_id)
+        )
 
         try:
-            data = json.loads(response.text)
+            data = json.loads(film_json)
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Некорректный JSON от Kinopoisk API")
 
@@ -54,19 +61,25 @@ async def get_movie_info_from_kp_url(create_movie_data: MovieCreate) -> Movie:
             poster_url = data['posterUrl']
             poster_url_preview = data['posterUrlPreview']
 
+            # Постер и превью качаются параллельно по общему пулу соединений
+            saved_poster, saved_preview = await asyncio.gather(
+                download_and_save_film_poster(poster_url),
+                download_and_save_film_poster(poster_url_preview),
+            )
+
             movie_data = Movie(
                 title=data['nameRu'],
                 year=data['year'],
                 kinopoisk_url=data['webUrl'].strip('/'),
                 kinopoisk_id=data['kinopoiskId'],
-                poster_url=await download_and_save_film_poster(poster_url, data['kinopoiskId']),
-                poster_preview_url=await download_and_save_film_poster(poster_url_preview, data['kinopoiskId'], 'preview')
+                poster_url=saved_poster,
+                poster_preview_url=saved_preview
             )
         except ValueError as e:
             raise HTTPException(status_code=422, detail=f"Ошибка валидации данных фильма: {str(e)}")
 
     except Exception as e:
-        raise RuntimeError(f"Неизвестная ошибка при получении данных фильма {film_url}: {e}")
+        raise RuntimeError(f"Неизвестная ошибка при получении данных фильма {film_url}: {e}") from e
 
     return movie_data
 
@@ -78,9 +91,8 @@ async def get_film_data_from_kinopoisk(KINOPOISK_API_BASE_URL: str | None, KINOP
         "X-API-KEY": KINOPOISK_API_KEY,
     }
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
+        response = await get_http_client().get(url, headers=headers, timeout=KINOPOISK_TIMEOUT)
+        response.raise_for_status()
 
     except httpx.HTTPStatusError as e:
         raise HTTPException(
@@ -96,31 +108,9 @@ async def get_film_data_from_kinopoisk(KINOPOISK_API_BASE_URL: str | None, KINOP
     return response
 
 
-async def download_and_save_film_poster(poster_url, film_id, suffix = '') -> str:
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(poster_url, follow_redirects=True, timeout=10.0)
-            response.raise_for_status()
-
-    except httpx.HTTPStatusError as e:
-        raise HTTPException(
-            status_code=e.response.status_code,
-            detail=e.response.text,
-        )
-
-    except httpx.RequestError:
-        raise HTTPException(
-            status_code=502,
-            detail="External API unavailable",
-        )
-
-    extension = poster_url.split('.')[-1]
-    file_name = f"{film_id}{suffix}.{extension}"
-    file_path = os.path.join('static', 'film_posters', file_name)
-
-    with open(file_path, 'wb+') as f:
-        f.write(response.content)  # content — байты ответа
-    return file_path
+async def download_and_save_film_poster(poster_url: str) -> str:
+    """Сохраняет постер в static/film_posters (см. poster_storage) и возвращает его URL."""
+    return await save_poster(poster_url)
 
 #
 # if __name__ == '__main__':
@@ -130,31 +120,95 @@ def parse_init_data(init_data: str) -> dict:
     return {k: v for k, v in [pair.split('=') for pair in init_data.split('&')]}
 
 
+def _verified_init_data(x_telegram_init_data: str | None) -> dict:
+    try:
+        return check_init_data(x_telegram_init_data)
+    except InitDataError as e:
+        raise HTTPException(401, f"Invalid initData: {e}")
+
+
+def _insert_user_if_missing(dialect_name: str, telegram_user: dict):
+    """INSERT ... ON CONFLICT DO NOTHING: два параллельных первых запроса не упадут на unique(telegram_id)."""
+    insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+    return insert(User).values(
+        telegram_id=str(telegram_user["id"]),
+        username=username_from_telegram_user(telegram_user),
+        current_room=None,
+    ).on_conflict_do_nothing(index_elements=[User.telegram_id])
+
+
+def _identity_user(identity: CachedIdentity) -> User:
+    """Пользователь из кэша: detached-объект без запроса в БД, к сессии привязывается через merge(load=False)."""
+    user = User(id=identity.user_id, telegram_id=identity.telegram_id, username=identity.username)
+    make_transient_to_detached(user)
+    return user
+
+
 def get_current_user(
     request: Request,
     db: Session = Depends(get_db),
     x_telegram_init_data: str = Header(None)
 ) -> User:
+    """
+    Пользователь по заголовку X-Telegram-Init-Data.
+    Подпись проверяется один раз на строку initData, дальше — из identity_cache без БД.
+    """
+    identity = identity_cache.get(x_telegram_init_data)
+    if identity:
+        return db.merge(_identity_user(identity), load=False)
 
-    telegram_data = parse_init_data(x_telegram_init_data)
+    telegram_data = _verified_init_data(x_telegram_init_data)
+    telegram_id = str(telegram_data["user"]["id"])
 
-    user_data_str = telegram_data.get("user")
-    if not user_data_str:
-        raise HTTPException(401, "Invalid initData")
+    user = db.scalar(select(User).where(User.telegram_id == telegram_id))
+    if not user:
+        db.execute(_insert_user_if_missing(db.get_bind().dialect.name, telegram_data["user"]))
+        db.commit()
+        user = db.scalar(select(User).where(User.telegram_id == telegram_id))
 
-    user_data = json.loads(urllib.parse.unquote(user_data_str))
-    telegram_id = str(user_data.get("id"))
+    identity_cache.set(x_telegram_init_data, CachedIdentity(user.id, user.telegram_id, user.username),
+                       ttl=cache_ttl_for(telegram_data))
+    return user
 
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
 
+async def get_current_user_async(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    x_telegram_init_data: str = Header(None)
+) -> User:
+    """
+    То же, что get_current_user, для async def эндпоинтов (AsyncSession).
+    """
+    identity = identity_cache.get(x_telegram_init_data)
+    if identity:
+        return await db.merge(_identity_user(identity), load=False)
+
+    telegram_data = _verified_init_data(x_telegram_init_data)
+    telegram_id = str(telegram_data["user"]["id"])
+
+    user = await db.scalar(select(User).where(User.telegram_id == telegram_id))
     if not user:
-        user = User(
-            telegram_id=telegram_id,
-            username=telegram_data.get("username"),
-            current_room=None,
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.execute(_insert_user_if_missing(db.get_bind().dialect.name, telegram_data["user"]))
+        await db.commit()
+        user = await db.scalar(select(User).where(User.telegram_id == telegram_id))
+
+    identity_cache.set(x_telegram_init_data, CachedIdentity(user.id, user.telegram_id, user.username),
+                       ttl=cache_ttl_for(telegram_data))
+    return user
+
 
-    return user
\ No newline at end of file
+async def get_current_identity_async(
+    init_data: str | None = Query(None),
+    x_telegram_init_data: str | None = Header(None),
+) -> CachedIdentity:
+    """
+    Пользователь для долгих соединений (SSE, WebSocket): без сессии БД на всё время соединения,
+    в БД — только при промахе identity_cache. initData — из заголовка или ?init_data= (EventSource не умеет заголовки).
+    """
+    init_data = x_telegram_init_data or init_data
+    identity = identity_cache.get(init_data)
+    if identity:
+        return identity
+    async with AsyncSessionLocal() as db:
+        user = await get_current_user_async(None, db, init_data)
+        return CachedIdentity(user.id, user.telegram_id, user.username)
@@ -0,0 +1,48 @@
+"""
+End-to-end латентность POST /rooms/{room_id}/movies для новых (ещё не известных) фильмов.
+
+Сервер должен смотреть на заглушку tests/load/fake_kinopoisk.py, иначе тратится квота Кинопоиска:
+    python tests/load/add_movie_bench.py --room ROOM_ID --init-data "$INIT_DATA" --count 50 --start-id 700000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from concurrency_bench import percentile
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--room", required=True)
+    parser.add_argument("--init-data", required=True)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--start-id", type=int, default=700_000, help="первый kinopoisk_id; берите новый диапазон на каждый запуск")
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    film_ids = iter(range(args.start_id, args.start_id + args.count))
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+
+    async with httpx.AsyncClient(base_url=args.base_url, headers={"X-Telegram-Init-Data": args.init_data}, timeout=60) as client:
+        async def worker():
+            for film_id in film_ids:
+                started = time.perf_counter()
+                response = await client.post(f"/rooms/{args.room}/movies",
+                                             json={"kinopoisk_url": f"https://www.kinopoisk.ru/film/{film_id}/"})
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+    print(f"requests={len(latencies)} statuses={statuses}")
+    print(f"p50={statistics.median(latencies):.1f} ms  p95={percentile(latencies, 95):.1f} ms  "
+          f"p99={percentile(latencies, 99):.1f} ms  max={max(latencies):.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
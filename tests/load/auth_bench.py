@@ -0,0 +1,45 @@
+"""
+Микробенчмарк накладных расходов авторизации на один запрос (без сети и БД).
+
+    cd backend/src && python ../../tests/load/auth_bench.py
+
+Сравнивает: проверку подписи initData (промах кэша) и попадание в identity_cache.
+Поход в БД за пользователем при промахе сюда не входит — он тоже пропускается при попадании.
+"""
+import json
+import os
+import sys
+import time
+import timeit
+from urllib.parse import urlencode
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench-token")
+sys.path.insert(0, os.getcwd())
+
+from telegram_auth import check_init_data, sign_init_data, identity_cache, CachedIdentity  # noqa: E402
+
+
+def make_init_data(telegram_id: int) -> str:
+    fields = {
+        "query_id": "AAFzgOMMAAAAAHOA4wwB1fMk",
+        "user": json.dumps({"id": telegram_id, "first_name": "Bench", "username": "bench", "language_code": "ru"}),
+        "auth_date": str(int(time.time())),
+    }
+    return urlencode({**fields, "hash": sign_init_data(fields, os.environ["TELEGRAM_BOT_TOKEN"])})
+
+
+def main(number: int = 20_000) -> None:
+    init_data = make_init_data(216236147)
+    identity_cache.set(init_data, CachedIdentity(1, "216236147", "bench"))
+
+    cases = {
+        "verify (cache miss)": lambda: check_init_data(init_data),
+        "identity_cache hit": lambda: identity_cache.get(init_data),
+    }
+    for name, fn in cases.items():
+        seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f"{name:<22} {seconds * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
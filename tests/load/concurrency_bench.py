@@ -0,0 +1,93 @@
+"""
+Нагрузочный замер латентности под конкурентными клиентами.
+
+Бьёт в уже запущенный сервер (uvicorn main:app) и печатает p50/p95/p99 по каждому
+уровню конкурентности — отдельно для быстрого маршрута (открытие комнаты) и медленного (история)
+и для всех вместе. Вопрос замера — тормозит ли медленный запрос остальных: если запросы к БД
+блокируют event loop, хвост быстрого маршрута растёт вместе с историей. Для сравнения "до/после"
+запускается на двух ревизиях против одной и той же БД.
+
+На локальной SQLite запрос к БД почти не ждёт ввода-вывода, и замер упирается в CPU (рендер истории) —
+блокировка event loop там не видна. Сетевую БД имитирует db_latency_server.py (задержка на каждый SQL-запрос).
+
+    python tests/load/concurrency_bench.py --base-url http://localhost:8000 --room ROOM_ID \
+        --init-data "$INIT_DATA" --concurrency 50 100 200 --requests 2000 --history-every 10
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies: list[float]) -> dict:
+    return {
+        "p50": statistics.median(latencies),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+async def run_level(base_url: str, paths: list[tuple[str, str]], headers: dict, concurrency: int, total: int) -> dict:
+    """paths — (маршрут, путь); латентности собираются по маршрутам."""
+    latencies: dict[str, list[float]] = {route: [] for route, _ in paths}
+    errors = 0
+    counter = iter(range(total))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                route, path = paths[i % len(paths)]
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies[route].append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    routes = {route: summarize(values) for route, values in latencies.items()}
+    routes["all"] = summarize([value for values in latencies.values() for value in values])
+    return {"concurrency": concurrency, "rps": total / elapsed, "routes": routes, "errors": errors}
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--room", required=True)
+    parser.add_argument("--init-data", required=True, help="значение заголовка X-Telegram-Init-Data")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на уровень конкурентности")
+    parser.add_argument("--history-every", type=int, default=2,
+                        help="каждый N-й запрос — история (остальные — открытие комнаты)")
+    args = parser.parse_args()
+
+    # Смесь открытия комнаты и истории во всех сортировках: медленная история не должна тормозить остальных
+    sorts = ["date", "avg_rating", "my_rating"]
+    paths = []
+    for sort_by in sorts:
+        paths += [("room", f"/rooms/{args.room}")] * (args.history_every - 1)
+        paths.append(("history", f"/rooms/{args.room}/history/?sort_by={sort_by}"))
+    headers = {"X-Telegram-Init-Data": args.init_data}
+
+    print(f"{'clients':>8} {'route':>8} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for concurrency in args.concurrency:
+        r = await run_level(args.base_url, paths, headers, concurrency, args.requests)
+        for route, t in r["routes"].items():
+            rps, errors = (f"{r['rps']:>8.1f}", f"{r['errors']:>7}") if route == "all" else (f"{'':>8}", f"{'':>7}")
+            print(f"{r['concurrency']:>8} {route:>8} {rps} {t['p50']:>8.1f} {t['p95']:>8.1f} {t['p99']:>8.1f} {errors}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+"""
+Запуск приложения с искусственной задержкой каждого SQL-запроса — имитация сетевой БД для concurrency_bench.py.
+
+    cd backend/src && python ../../tests/load/db_latency_server.py --port 8000 --rtt-ms 5
+
+Задержка ставится через trace callback sqlite3: он вызывается в том потоке, который выполняет запрос.
+Синхронная Session внутри async-эндпоинта выполняет запрос в потоке event loop — задержка останавливает
+все запросы воркера; aiosqlite выполняет его в своём потоке — ждёт только сам запрос. Так на локальной
+SQLite видно то, что на Postgres по сети даёт round-trip. Работает и на ревизиях без async_engine.
+"""
+import argparse
+import os
+import sys
+import time
+
+import uvicorn
+from sqlalchemy import event
+
+sys.path.insert(0, os.getcwd())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--rtt-ms", type=float, default=5.0, help="задержка на каждый SQL-запрос")
+    args = parser.parse_args()
+
+    import database
+
+    delay = args.rtt_ms / 1000
+
+    def on_statement(_statement: str) -> None:
+        time.sleep(delay)
+
+    @event.listens_for(database.engine, "connect")
+    def slow_sync_connection(dbapi_connection, _record):
+        dbapi_connection.set_trace_callback(on_statement)
+
+    async_engine = getattr(database, "async_engine", None)
+    if async_engine is not None:
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def slow_async_connection(dbapi_connection, _record):
+            # Callback ставится внутри потока aiosqlite — там же он и будет вызываться
+            dbapi_connection.await_(dbapi_connection._connection.set_trace_callback(on_statement))
+
+    from main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
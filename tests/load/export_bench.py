@@ -0,0 +1,95 @@
+"""
+Бенчмарк выгрузки и восстановления комнаты (room_export) на большой комнате (без сети, на отдельной SQLite).
+
+    cd backend/src && python ../../tests/load/export_bench.py --movies 5000 --users 50 --density 0.7
+
+Для CSV и JSON Lines печатает время до первой порции байт, общее время, строк в секунду
+и пиковую память Python (tracemalloc) во время выгрузки — она не должна расти с размером комнаты
+(сравните запуски с разным --movies). Затем восстанавливает выгрузку CSV в пустую комнату
+от имени участника RESTORED_BY и сверяет число оценок: восстанавливаются только его собственные.
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+# Та же комната и отдельная SQLite, что у room_stats_bench (он же настраивает DATABASE_URL до импорта приложения)
+from room_stats_bench import DB_PATH, ROOM_ID, seed
+
+from sqlalchemy import func, select
+
+from database import AsyncSessionLocal, SessionLocal
+from models import Rating, Room, RoomMember
+from room_export import export_csv, export_jsonl, restore_room
+
+RESTORED_ROOM_ID = "RESTORED"
+RESTORED_BY = 1
+
+
+async def measure_export(export) -> tuple[float, float, int, int, bytes]:
+    """(мс до первой порции, мс всего, строк, пик памяти в байтах, первые 64 KiB выгрузки)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    first = None
+    lines = size = 0
+    head = b""
+    async for chunk in export(ROOM_ID):
+        if first is None:
+            first = time.perf_counter()
+        lines += chunk.count(b"\n")
+        size += len(chunk)
+        if len(head) < 65536:
+            head += chunk
+    total = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (first - started) * 1000, total * 1000, lines, peak, head
+
+
+async def collect(export) -> list[bytes]:
+    return [chunk async for chunk in export(ROOM_ID)]
+
+
+async def measure_restore(chunks: list[bytes]) -> tuple[float, dict, int]:
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    started = time.perf_counter()
+    totals = await restore_room(RESTORED_ROOM_ID, RESTORED_BY, body())
+    elapsed = time.perf_counter() - started
+    async with AsyncSessionLocal() as db:
+        restored = await db.scalar(select(func.count()).select_from(Rating).where(Rating.room_id == RESTORED_ROOM_ID))
+    return elapsed * 1000, totals, restored
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--density", type=float, default=0.7, help="доля фильмов, оценённых каждым участником")
+    args = parser.parse_args()
+
+    count = seed(args.movies, args.users, args.density)
+    with SessionLocal() as db:
+        own = db.scalar(select(func.count()).select_from(Rating).where(
+            Rating.room_id == ROOM_ID, Rating.user_id == RESTORED_BY))
+        db.add(Room(id=RESTORED_ROOM_ID, name="restored"))
+        db.flush()
+        db.add(RoomMember(room_id=RESTORED_ROOM_ID, user_id=RESTORED_BY))
+        db.commit()
+    print(f"комната: {args.movies} фильмов, {args.users} участников, {count} оценок, БД {DB_PATH}")
+
+    print(f"\n{'format':>8} {'first ms':>9} {'total ms':>9} {'rows':>8} {'rows/s':>9} {'peak KiB':>9}")
+    for name, export in (("csv", export_csv), ("jsonl", export_jsonl)):
+        first, total, lines, peak, _ = asyncio.run(measure_export(export))
+        print(f"{name:>8} {first:>9.1f} {total:>9.0f} {lines:>8} {lines / total * 1000:>9.0f} {peak / 1024:>9.0f}")
+
+    elapsed, totals, restored = asyncio.run(measure_restore(asyncio.run(collect(export_csv))))
+    print(f"\nвосстановление CSV: {totals['rows']} строк за {elapsed:.0f} ms "
+          f"({totals['rows'] / elapsed * 1000:.0f} строк/с), оценок {restored} из {own} своих, "
+          f"чужих пропущено {totals['skipped_ratings']}")
+
+
+if __name__ == "__main__":
+    main()
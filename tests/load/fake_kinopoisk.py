@@ -0,0 +1,76 @@
+"""
+Локальная заглушка Kinopoisk API и CDN постеров для тестов и бенчмарков.
+
+    python tests/load/fake_kinopoisk.py --port 8900 --latency-ms 80
+
+Бэкенд направляется на неё через окружение:
+    KINOPOISK_API_BASE_URL=http://localhost:8900/api KINOPOISK_API_VERSION=v2.2
+
+Фильмы с id > --missing-above отвечают 404 (для проверки негативного кэша).
+"""
+import argparse
+import asyncio
+import os
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from starlette.responses import Response
+
+app = FastAPI()
+settings = {"latency": 0.0, "missing_above": 90_000_000, "poster_bytes": 200_000}
+counters = {"films": 0, "posters": 0}
+
+
+def poster_body(film_id: int, size: int) -> bytes:
+    # Детерминированные "картинки": одинаковый id -> одинаковые байты
+    seed = f"{film_id}:".encode()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+@app.get("/api/{version}/films/{film_id}")
+async def film(version: str, film_id: int, request: Request):
+    counters["films"] += 1
+    await asyncio.sleep(settings["latency"])
+    if film_id > settings["missing_above"]:
+        raise HTTPException(status_code=404, detail="Film not found")
+
+    base = str(request.base_url).rstrip("/")
+    return {
+        "kinopoiskId": film_id,
+        "nameRu": f"Фильм {film_id}",
+        "year": 1990 + film_id % 35,
+        "webUrl": f"https://www.kinopoisk.ru/film/{film_id}/",
+        "posterUrl": f"{base}/posters/{film_id}.jpg",
+        "posterUrlPreview": f"{base}/posters/{film_id}preview.jpg",
+    }
+
+
+@app.get("/posters/{name}")
+async def poster(name: str):
+    counters["posters"] += 1
+    await asyncio.sleep(settings["latency"])
+    film_id = int(name.split(".")[0].removesuffix("preview"))
+    size = settings["poster_bytes"] // (4 if "preview" in name else 1)
+    return Response(poster_body(film_id, size), media_type="image/jpeg")
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_KINOPOISK_PORT", 8900)))
+    parser.add_argument("--latency-ms", type=float, default=80, help="задержка ответа, имитация внешней сети")
+    parser.add_argument("--missing-above", type=int, default=90_000_000)
+    parser.add_argument("--poster-bytes", type=int, default=200_000)
+    args = parser.parse_args()
+
+    settings.update(latency=args.latency_ms / 1000, missing_above=args.missing_above, poster_bytes=args.poster_bytes)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
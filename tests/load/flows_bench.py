@@ -0,0 +1,403 @@
+"""
+Нагрузочный прогон основных сценариев с сохранением результата в базовую линию.
+
+    cd backend/src && python ../../tests/load/flows_bench.py                    # прогон и сравнение с базовой линией
+    cd backend/src && python ../../tests/load/flows_bench.py --save-baseline    # записать новую базовую линию
+    cd backend/src && python ../../tests/load/flows_bench.py --check            # код выхода 1 при регрессии
+
+Что делает:
+1. Создаёт отдельную БД (по умолчанию временная SQLite; --database-url — например, локальный Postgres)
+   и заполняет её: --users участников, --rooms комнат по --movies фильмов, доля --density оценена
+2. Поднимает заглушку Кинопоиска/постеров (fake_kinopoisk.py) и приложение (uvicorn) во временном
+   рабочем каталоге — скачанные постеры не попадают в static/ репозитория
+3. --concurrency клиентов (каждый — свой участник со своим initData) гоняют смесь сценариев (--mix):
+   open_room, queue (пачка следующих фильмов), rate (оценка и следующий фильм), add_movie (новый фильм через заглушку),
+   history_date / history_avg_rating / history_my_rating
+4. Печатает по сценарию: запросы, ошибки, rps, p50/p95/p99 и число SQL-запросов на запрос
+   (из /metrics приложения; три сортировки истории — один маршрут, у них общее значение)
+
+Результат сравнивается с --baseline (JSON): рост p95 или падение rps больше --tolerance процентов
+и любой рост числа SQL-запросов на запрос считаются регрессией. Задержки зависят от машины —
+базовую линию стоит писать на той же машине, что и сравнение; число запросов к БД от машины не зависит.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SRC_DIR = os.getcwd()
+LOAD_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(LOAD_DIR, "flows_baseline.json")
+WORK_DIR = tempfile.mkdtemp(prefix="flows-bench-")
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench-token")
+os.environ["DB_ECHO"] = "false"
+sys.path.insert(0, SRC_DIR)
+
+import httpx  # noqa: E402
+
+from auth_bench import make_init_data  # noqa: E402
+from concurrency_bench import percentile  # noqa: E402
+
+FLOWS = ("open_room", "queue", "rate", "add_movie", "history_date", "history_avg_rating", "history_my_rating")
+DEFAULT_MIX = "open_room=25,queue=10,rate=30,add_movie=5,history_date=10,history_avg_rating=10,history_my_rating=10"
+# Маршрут приложения для каждого сценария — ключ в гистограммах /metrics
+FLOW_ROUTES = {
+    "open_room": ("GET", "/rooms/{room_id}"),
+    "queue": ("GET", "/rooms/{room_id}/queue"),
+    "rate": ("POST", "/rooms/{room_id}/ratings"),
+    "add_movie": ("POST", "/rooms/{room_id}/movies"),
+    "history_date": ("GET", "/rooms/{room_id}/history/"),
+    "history_avg_rating": ("GET", "/rooms/{room_id}/history/"),
+    "history_my_rating": ("GET", "/rooms/{room_id}/history/"),
+}
+TELEGRAM_ID_OFFSET = 500_000_000
+NEW_MOVIE_KINOPOISK_ID = 5_000_000  # id новых фильмов для add_movie: заглушка отвечает на любой id
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def room_id(index: int) -> str:
+    return f"BENCH{index:05d}"
+
+
+def seed(users: int, rooms: int, movies: int, density: float) -> None:
+    """Фильмы у каждой комнаты свои; каждый участник состоит во всех комнатах и оценил долю density фильмов."""
+    from sqlalchemy import insert
+
+    from database import engine, SessionLocal
+    from models import Base, Movie, MoviesInRoom, Rating, Room, RoomMember, User
+    from services import rebuild_room_movie_stats
+
+    rng = random.Random(1)
+    started = datetime(2024, 1, 1)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.execute(insert(User), [
+            {"id": i, "telegram_id": str(TELEGRAM_ID_OFFSET + i), "username": f"bench{i}"} for i in range(1, users + 1)
+        ])
+        db.execute(insert(Movie), [
+            {"id": i, "title": f"Movie {i}", "year": 1990 + i % 35, "kinopoisk_id": i,
+             "kinopoisk_url": f"https://www.kinopoisk.ru/film/{i}/"}
+            for i in range(1, rooms * movies + 1)
+        ])
+        for r in range(rooms):
+            db.add(Room(id=room_id(r), name=f"bench {r}"))
+            db.flush()
+            movie_ids = range(r * movies + 1, (r + 1) * movies + 1)
+            db.execute(insert(RoomMember), [{"room_id": room_id(r), "user_id": u} for u in range(1, users + 1)])
+            db.execute(insert(MoviesInRoom), [
+                {"movie_id": m, "room_id": room_id(r), "added_by": rng.randint(1, users),
+                 "added_date": started + timedelta(minutes=m)}
+                for m in movie_ids
+            ])
+            ratings = [
+                {"user_id": u, "movie_id": m, "room_id": room_id(r), "score": rng.randint(0, 20) / 2, "skipped": False}
+                for u in range(1, users + 1)
+                for m in movie_ids
+                if rng.random() < density
+            ]
+            if ratings:
+                db.execute(insert(Rating), ratings)
+        rebuild_room_movie_stats(db)
+        db.commit()
+
+
+def prepare_workdir() -> None:
+    """Рабочий каталог приложения: шаблоны из репозитория, свой static/ и cache/."""
+    os.symlink(os.path.join(SRC_DIR, "templates"), os.path.join(WORK_DIR, "templates"))
+    os.makedirs(os.path.join(WORK_DIR, "static", "film_posters"))
+
+
+def start_process(name: str, args: list[str], env: dict) -> subprocess.Popen:
+    # Вывод — в файл: непрочитанный PIPE заполнится и заблокирует процесс на записи лога
+    log = open(os.path.join(WORK_DIR, f"{name}.log"), "wb")
+    return subprocess.Popen(args, env=env, cwd=WORK_DIR, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url}: процесс завершился, см. логи в {WORK_DIR}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url}: не дождались запуска")
+
+
+def parse_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in FLOWS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name}, есть: {', '.join(FLOWS)}")
+        mix[name] = int(weight)
+    return mix
+
+
+def scrape_sql(client: httpx.Client) -> dict[tuple[str, str], tuple[float, float]]:
+    """(метод, маршрут) -> (сумма SQL-запросов, число HTTP-запросов) из /metrics."""
+    totals: dict[tuple[str, str], list[float]] = {}
+    pattern = re.compile(r'^http_request_sql_statements_(sum|count)\{method="([^"]+)",route="([^"]+)"\} (\S+)$')
+    for line in client.get("/metrics").text.splitlines():
+        match = pattern.match(line)
+        if match:
+            kind, method, route, value = match.groups()
+            totals.setdefault((method, route), [0.0, 0.0])[0 if kind == "sum" else 1] = float(value)
+    return {key: (s, c) for key, (s, c) in totals.items()}
+
+
+class VirtualUser:
+    """Один клиент: свой участник, своя текущая комната и следующий фильм для оценки."""
+
+    def __init__(self, index: int, users: int, rooms: int, movies: int, rng: random.Random):
+        self.user_id = index % users + 1
+        self.headers = {"X-Telegram-Init-Data": make_init_data(TELEGRAM_ID_OFFSET + self.user_id)}
+        self.rooms = rooms
+        self.movies = movies
+        self.rng = rng
+        self.room = rng.randrange(rooms)
+        self.next_movie: int | None = None
+
+    def request(self, flow: str, new_movie_ids) -> tuple[str, str, str, dict | None]:
+        """(сценарий, метод, путь, json) очередного запроса."""
+        room = room_id(self.room)
+        if flow == "queue":
+            return flow, "GET", f"/rooms/{room}/queue?limit=5", None
+        if flow == "rate":
+            # Первая оценка — после запроса очереди, дальше следующий фильм приходит в ответе на оценку
+            if self.next_movie is None:
+                return "queue", "GET", f"/rooms/{room}/queue?limit=1", None
+            return "rate", "POST", f"/rooms/{room}/ratings", {"movie_id": self.next_movie,
+                                                              "score": self.rng.randint(0, 20) / 2}
+        if flow == "add_movie":
+            return flow, "POST", f"/rooms/{room}/movies", {
+                "kinopoisk_url": f"https://www.kinopoisk.ru/film/{next(new_movie_ids)}/"}
+        if flow.startswith("history_"):
+            return flow, "GET", f"/rooms/{room}/history/?sort_by={flow.removeprefix('history_')}", None
+        return "open_room", "GET", f"/rooms/{room}", None
+
+    def handle(self, flow: str, response: httpx.Response) -> None:
+        if flow == "queue" and response.status_code == 200:
+            movies = response.json()["movies"]
+            self.next_movie = movies[0]["id"] if movies else self.any_movie()
+        elif flow == "rate" and response.status_code == 200:
+            body = response.json()
+            # Всё оценено — переоцениваем случайный фильм комнаты (upsert оценки)
+            self.next_movie = body["movie"]["id"] if body.get("has_next") else self.any_movie()
+
+    def any_movie(self) -> int:
+        return self.room * self.movies + self.rng.randint(1, self.movies)
+
+
+async def drive(base_url: str, users: list[VirtualUser], mix: dict[str, int], total: int, rng: random.Random,
+                new_movie_ids) -> tuple[dict[str, list[float]], dict[str, dict[str, int]], float]:
+    latencies: dict[str, list[float]] = {flow: [] for flow in FLOWS}
+    errors: dict[str, dict[str, int]] = {flow: {} for flow in FLOWS}  # сценарий -> статус ответа -> сколько
+    names, weights = list(mix), list(mix.values())
+    counter = iter(range(total))
+
+    limits = httpx.Limits(max_connections=len(users), max_keepalive_connections=len(users))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker(user: VirtualUser) -> None:
+            for _ in counter:
+                flow, method, path, body = user.request(rng.choices(names, weights)[0], new_movie_ids)
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body, headers=user.headers)
+                except httpx.TransportError as e:
+                    errors[flow][type(e).__name__] = errors[flow].get(type(e).__name__, 0) + 1
+                    continue
+                latencies[flow].append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    status = str(response.status_code)
+                    errors[flow][status] = errors[flow].get(status, 0) + 1
+                user.handle(flow, response)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(user) for user in users))
+        elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+
+def summarize(latencies: dict[str, list[float]], errors: dict[str, dict[str, int]], elapsed: float,
+              sql_before: dict, sql_after: dict) -> dict:
+    flows = {}
+    for flow in FLOWS:
+        timings = latencies[flow]
+        if not timings and not errors[flow]:
+            continue
+        key = FLOW_ROUTES[flow]
+        statements = sql_after.get(key, (0, 0))[0] - sql_before.get(key, (0, 0))[0]
+        requests = sql_after.get(key, (0, 0))[1] - sql_before.get(key, (0, 0))[1]
+        flows[flow] = {
+            "requests": len(timings),
+            "errors": sum(errors[flow].values()),
+            "error_statuses": errors[flow],
+            "rps": round(len(timings) / elapsed, 1),
+            "p50_ms": round(statistics.median(timings), 2) if timings else None,
+            "p95_ms": round(percentile(timings, 95), 2) if timings else None,
+            "p99_ms": round(percentile(timings, 99), 2) if timings else None,
+            "sql_per_request": round(statements / requests, 2) if requests else None,
+        }
+    count = sum(len(t) for t in latencies.values())
+    return {"requests": count, "rps": round(count / elapsed, 1), "seconds": round(elapsed, 2), "flows": flows}
+
+
+def print_report(result: dict, baseline: dict | None) -> None:
+    print(f"\n{'flow':>20} {'reqs':>6} {'err':>4} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8}"
+          + ("  vs baseline" if baseline else ""))
+    for flow, r in result["flows"].items():
+        line = (f"{flow:>20} {r['requests']:>6} {r['errors']:>4} {r['rps']:>7.1f} {_num(r['p50_ms'])} "
+                f"{_num(r['p95_ms'])} {_num(r['p99_ms'])} {_num(r['sql_per_request'])}")
+        base = (baseline or {}).get("flows", {}).get(flow)
+        if base:
+            line += f"  p95 {_delta(r['p95_ms'], base['p95_ms'])}, sql {_delta(r['sql_per_request'], base['sql_per_request'])}"
+        print(line)
+    print(f"{'total':>20} {result['requests']:>6} {'':>4} {result['rps']:>7.1f}  за {result['seconds']} с")
+    for flow, r in result["flows"].items():
+        if r["errors"]:
+            print(f"ошибки {flow}: {r['error_statuses']}")
+
+
+def _num(value) -> str:
+    return f"{value:>8.2f}" if value is not None else f"{'-':>8}"
+
+
+def _delta(value, base) -> str:
+    if value is None or not base:
+        return "-"
+    return f"{(value - base) / base * 100:+.0f}%"
+
+
+def regressions(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    problems = []
+    for flow, base in baseline.get("flows", {}).items():
+        current = result["flows"].get(flow)
+        if current is None:
+            continue
+        if base["p95_ms"] and current["p95_ms"] and current["p95_ms"] > base["p95_ms"] * (1 + tolerance / 100):
+            problems.append(f"{flow}: p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+        if base["rps"] and current["rps"] < base["rps"] * (1 - tolerance / 100):
+            problems.append(f"{flow}: rps {base['rps']} -> {current['rps']}")
+        if base["sql_per_request"] is not None and current["sql_per_request"] is not None \
+                and current["sql_per_request"] > base["sql_per_request"]:
+            problems.append(f"{flow}: SQL на запрос {base['sql_per_request']} -> {current['sql_per_request']}")
+    return problems
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=SRC_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--movies", type=int, default=500, help="фильмов в каждой комнате")
+    parser.add_argument("--density", type=float, default=0.5, help="доля фильмов, оценённых каждым участником")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=200, help="запросов до замера (кэши, компиляция шаблонов)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"веса сценариев, по умолчанию {DEFAULT_MIX}")
+    parser.add_argument("--fake-latency-ms", type=float, default=20, help="задержка заглушки Кинопоиска")
+    parser.add_argument("--database-url", help="вместо временной SQLite, например postgresql://bench@localhost/bench (пустая БД)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="записать результат в --baseline")
+    parser.add_argument("--check", action="store_true", help="код выхода 1, если есть регрессия относительно --baseline")
+    parser.add_argument("--tolerance", type=float, default=20, help="допуск по p95 и rps, проценты")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    seed(args.users, args.rooms, args.movies, args.density)
+    prepare_workdir()
+    print(f"БД {database_url}: {args.users} участников, {args.rooms} комнат по {args.movies} фильмов; каталог {WORK_DIR}")
+
+    fake_port, app_port = free_port(), free_port()
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "KINOPOISK_API_BASE_URL": f"http://127.0.0.1:{fake_port}/api",
+        "KINOPOISK_API_VERSION": "v2.2",
+        "KINOPOISK_API_KEY": "bench",
+        "ACCESS_LOG": "false",
+        "PYTHONPATH": SRC_DIR,
+    }
+    fake = start_process("fake_kinopoisk", [sys.executable, os.path.join(LOAD_DIR, "fake_kinopoisk.py"),
+                                            "--port", str(fake_port), "--latency-ms", str(args.fake_latency_ms)], env)
+    app = start_process("app", [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port),
+                                "--log-level", "warning", "--app-dir", SRC_DIR], env)
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        wait_ready(f"http://127.0.0.1:{fake_port}/stats", fake)
+        wait_ready(f"{base_url}/metrics", app)
+
+        rng = random.Random(args.seed)
+        users = [VirtualUser(i, args.users, args.rooms, args.movies, rng) for i in range(args.concurrency)]
+        new_movie_ids = iter(range(NEW_MOVIE_KINOPOISK_ID, NEW_MOVIE_KINOPOISK_ID + args.warmup + args.requests))
+        asyncio.run(drive(base_url, users, args.mix, args.warmup, rng, new_movie_ids))
+        with httpx.Client(base_url=base_url) as client:
+            sql_before = scrape_sql(client)
+            latencies, errors, elapsed = asyncio.run(drive(base_url, users, args.mix, args.requests, rng, new_movie_ids))
+            sql_after = scrape_sql(client)
+    finally:
+        for process in (app, fake):
+            process.terminate()
+            process.wait(10)
+
+    result = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "machine": f"{platform.machine()} {os.cpu_count()} cpu, python {platform.python_version()}",
+        "config": {key: getattr(args, key) for key in ("users", "rooms", "movies", "density", "concurrency",
+                                                       "requests", "warmup", "mix", "fake_latency_ms", "seed")},
+        "database": database_url.split(":", 1)[0],
+        **summarize(latencies, errors, elapsed, sql_before, sql_after),
+    }
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != result["config"] or baseline.get("database") != result["database"]:
+            print(f"базовая линия {args.baseline} снята с другими параметрами — сравнение только для справки")
+    print_report(result, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"базовая линия записана: {args.baseline}")
+    elif baseline is not None:
+        problems = regressions(result, baseline, args.tolerance)
+        for problem in problems:
+            print(f"РЕГРЕССИЯ {problem}")
+        if problems and args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Бенчмарк страниц истории комнаты (services.get_room_history_page) — без сети, на отдельной SQLite.
+
+    cd backend/src && python ../../tests/load/history_page_bench.py --sizes 20 2000 20000
+
+Для каждой комнаты и сортировки (date / avg_rating / my_rating):
+- проходит историю целиком по курсорам и сверяет порядок с эталонной сортировкой в Python
+  (без пропусков и повторов, равные ключи — по movie_id по убыванию)
+- печатает p50/p95 первой страницы и страницы из середины списка
+Планы запросов (EXPLAIN QUERY PLAN) печатаются для самой большой комнаты.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="history-page-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["DB_ECHO"] = "false"
+sys.path.insert(0, os.getcwd())
+
+from sqlalchemy import insert, text  # noqa: E402
+
+from database import engine, SessionLocal  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Rating, Room, User  # noqa: E402
+from services import get_room_history_page, rebuild_room_movie_stats, _history_orders, HISTORY_SORTS  # noqa: E402
+
+USERS = 8
+USER_ID = 1
+PAGE_SIZE = 30
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def seed(room_id: str, movies: int) -> None:
+    """
+    Много равных ключей: даты добавления пачками, оценки с шагом 0.5 — проверяется порядок по movie_id.
+    Комнаты делят одни и те же фильмы: страница не должна подхватывать строки чужой комнаты.
+    """
+    rng = random.Random(movies)
+    started = datetime(2024, 1, 1)
+    movie_ids = range(1, movies + 1)
+    with SessionLocal() as db:
+        db.add(Room(id=room_id, name=room_id))
+        db.execute(insert(MoviesInRoom), [
+            {"movie_id": i, "room_id": room_id, "added_by": rng.randint(1, USERS),
+             "added_date": started + timedelta(hours=i // 5)}
+            for i in movie_ids
+        ])
+        ratings = [
+            {"user_id": user_id, "movie_id": i, "room_id": room_id,
+             "score": rng.randint(2, 20) / 2 if rng.random() < 0.9 else None, "skipped": False}
+            for i in movie_ids
+            for user_id in range(1, USERS + 1)
+            if rng.random() < 0.6
+        ]
+        db.execute(insert(Rating), ratings)
+        rebuild_room_movie_stats(db, room_id=room_id)
+        db.commit()
+
+
+def reference_order(room_id: str, sort_by: str) -> list[int]:
+    with SessionLocal() as db:
+        rows = db.execute(text(
+            "SELECT mir.movie_id, mir.added_date, s.ratings_count, s.score_sum, r.score "
+            "FROM movies_in_room mir JOIN room_movie_stats s ON s.room_id = mir.room_id AND s.movie_id = mir.movie_id "
+            "LEFT JOIN ratings r ON r.room_id = mir.room_id AND r.movie_id = mir.movie_id AND r.user_id = :user "
+            "WHERE mir.room_id = :room"
+        ), {"room": room_id, "user": USER_ID}).all()
+    if sort_by == "avg_rating":
+        key = lambda row: (row.score_sum / row.ratings_count if row.ratings_count else -1, row.movie_id)
+    elif sort_by == "my_rating":
+        key = lambda row: (row.score is not None, row.score if row.score is not None else row.added_date, row.movie_id)
+    else:
+        key = lambda row: (row.added_date, row.movie_id)
+    return [row.movie_id for row in sorted(rows, key=key, reverse=True)]
+
+
+def walk(room_id: str, sort_by: str) -> tuple[list[int], list]:
+    """Все страницы подряд: id фильмов и курсоры страниц."""
+    movie_ids, cursors, cursor = [], [None], None
+    with SessionLocal() as db:
+        while True:
+            items, cursor = get_room_history_page(db, room_id, USER_ID, sort_by, cursor, PAGE_SIZE)
+            movie_ids += [item["movie"].id for item in items]
+            if cursor is None:
+                return movie_ids, cursors
+            cursors.append(cursor)
+
+
+def time_page(room_id: str, sort_by: str, cursor, repeats: int) -> list[float]:
+    timings = []
+    with SessionLocal() as db:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            get_room_history_page(db, room_id, USER_ID, sort_by, cursor, PAGE_SIZE)
+            timings.append((time.perf_counter() - started) * 1000)
+            db.expunge_all()
+    return timings
+
+
+def explain(room_id: str) -> None:
+    with SessionLocal() as db:
+        for sort_by in HISTORY_SORTS:
+            for order in _history_orders(room_id, USER_ID, sort_by):
+                query = order.query.add_columns(order.key.label("sort_key")) \
+                    .order_by(order.key.desc(), order.movie_id.desc()).limit(PAGE_SIZE + 1)
+                compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+                plan = db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+                label = f"{sort_by}{' (без моей оценки)' if order.unrated else ''}"
+                print(f"план {label}:\n" + "\n".join(f"    {row[-1]}" for row in plan))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 2000, 20000])
+    parser.add_argument("--repeats", type=int, default=30)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.execute(insert(User), [{"id": i, "telegram_id": str(i), "username": f"user{i}"} for i in range(1, USERS + 1)])
+        db.execute(insert(Movie), [
+            {"id": i, "title": f"Movie {i}", "year": 2000, "kinopoisk_url": f"https://www.kinopoisk.ru/film/{i}",
+             "kinopoisk_id": i}
+            for i in range(1, max(args.sizes) + 1)
+        ])
+        db.commit()
+    for size in args.sizes:
+        seed(f"ROOM{size}", size)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+    explain(f"ROOM{max(args.sizes)}")
+    print(f"\n{'movies':>7} {'sort':>11} {'order':>6} {'first p50':>10} {'first p95':>10} {'mid p50':>8} {'mid p95':>8}")
+    for size in args.sizes:
+        room_id = f"ROOM{size}"
+        for sort_by in HISTORY_SORTS:
+            movie_ids, cursors = walk(room_id, sort_by)
+            ok = "ok" if movie_ids == reference_order(room_id, sort_by) else "FAIL"
+            first = time_page(room_id, sort_by, None, args.repeats)
+            middle = time_page(room_id, sort_by, cursors[len(cursors) // 2], args.repeats)
+            print(f"{size:>7} {sort_by:>11} {ok:>6} {statistics.median(first):>10.2f} {percentile(first, 95):>10.2f} "
+                  f"{statistics.median(middle):>8.2f} {percentile(middle, 95):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Бенчмарк «оценил -> следующий фильм» на комнате с большим числом фильмов (без сети, на отдельной SQLite).
+
+    cd backend/src && python ../../tests/load/rating_queue_bench.py --movies 10000 --rated 0 9000 --swipes 200
+
+Для каждой стартовой позиции (сколько фильмов пользователь уже оценил) сравнивает:
+- legacy: прежний запрос get_next_unrated_movie_for_user (anti-join всей комнаты на каждый показ)
+- queue:  очередь rating_queue (запрос по id из очереди, дозаполнение после курсора)
+и печатает p50/p95 одного шага save_rating + commit + выбор следующего фильма и отдельно — самого выбора.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="rating-queue-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["DB_ECHO"] = "false"
+sys.path.insert(0, os.getcwd())
+
+from sqlalchemy import insert, or_, select, text  # noqa: E402
+
+from database import engine, SessionLocal  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Rating, Room, RoomMovieStats, User  # noqa: E402
+from rating_queue import mark_rated, rating_queues  # noqa: E402
+from services import get_next_unrated_movie_for_user, save_rating, _queue_head_query, _queue_refill_query  # noqa: E402
+
+ROOM_ID = "BENCHROOM"
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def legacy_next_unrated(db, room_id: str, user_id: int):
+    # Запрос до очереди — для сравнения
+    return db.execute(
+        select(Movie, Rating)
+        .outerjoin(Rating, (Rating.user_id == user_id) & (Rating.movie_id == Movie.id) & (Rating.room_id == room_id))
+        .join(MoviesInRoom, MoviesInRoom.movie_id == Movie.id)
+        .where(MoviesInRoom.room_id == room_id)
+        .where(Rating.score.is_(None))
+        .where(Rating.skipped.is_not(False))
+        .where(or_(Rating.skipped.is_(None), Rating.skipped.is_(False)))
+        .order_by(MoviesInRoom.added_date.asc())
+        .limit(1)
+    ).first()
+
+
+def seed(movies: int, users: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    started = datetime(2024, 1, 1)
+    with SessionLocal() as db:
+        db.execute(insert(User), [{"id": i, "telegram_id": str(i), "username": f"user{i}"} for i in range(1, users + 1)])
+        db.add(Room(id=ROOM_ID, name="bench"))
+        db.execute(insert(Movie), [
+            {"id": i, "title": f"Movie {i}", "year": 2000, "kinopoisk_url": f"https://www.kinopoisk.ru/film/{i}",
+             "kinopoisk_id": i}
+            for i in range(1, movies + 1)
+        ])
+        db.execute(insert(MoviesInRoom), [
+            {"movie_id": i, "room_id": ROOM_ID, "added_by": 1, "added_date": started + timedelta(minutes=i)}
+            for i in range(1, movies + 1)
+        ])
+        db.execute(insert(RoomMovieStats), [{"room_id": ROOM_ID, "movie_id": i} for i in range(1, movies + 1)])
+        db.commit()
+
+
+def prerate(user_id: int, count: int) -> None:
+    with SessionLocal() as db:
+        if count:
+            db.execute(insert(Rating), [
+                {"user_id": user_id, "movie_id": i, "room_id": ROOM_ID, "score": 7.0, "skipped": False}
+                for i in range(1, count + 1)
+            ])
+        db.commit()
+
+
+def swipe(user_id: int, swipes: int, use_queue: bool) -> tuple[list[float], list[float]]:
+    """Время шага целиком и отдельно выбора следующего фильма (мс)."""
+    timings, lookups = [], []
+    with SessionLocal() as db:
+        find_next = get_next_unrated_movie_for_user if use_queue else legacy_next_unrated
+        row = find_next(db, ROOM_ID, user_id)
+        for _ in range(swipes):
+            if row is None:
+                break
+            movie_id = row[0].id
+            started = time.perf_counter()
+            save_rating(db, ROOM_ID, user_id, movie_id, 8.0)
+            db.commit()
+            if use_queue:
+                mark_rated(ROOM_ID, user_id, movie_id)
+            lookup_started = time.perf_counter()
+            row = find_next(db, ROOM_ID, user_id)
+            finished = time.perf_counter()
+            timings.append((finished - started) * 1000)
+            lookups.append((finished - lookup_started) * 1000)
+    return timings, lookups
+
+
+def explain(query) -> str:
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        return "\n".join(f"    {row[-1]}" for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=10_000)
+    parser.add_argument("--rated", type=int, nargs="+", default=[0, 5000, 9000],
+                        help="сколько фильмов пользователь уже оценил перед замером")
+    parser.add_argument("--swipes", type=int, default=200)
+    args = parser.parse_args()
+
+    users = 2 * len(args.rated)
+    seed(args.movies, users)
+    print(f"комната: {args.movies} фильмов, БД {DB_PATH}")
+    print("план выдачи из очереди:\n" + explain(_queue_head_query(ROOM_ID, 1, list(range(1, 21)))))
+    print("план дозаполнения после курсора:\n" + explain(_queue_refill_query(ROOM_ID, 1, (datetime(2024, 1, 2), 1440), 20)))
+
+    print(f"\n{'rated':>6} {'mode':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'next p50':>9} {'next p95':>9}")
+    for index, rated in enumerate(args.rated):
+        for offset, use_queue in enumerate((False, True)):
+            user_id = 2 * index + offset + 1
+            prerate(user_id, rated)
+            rating_queues.clear()
+            timings, lookups = swipe(user_id, args.swipes, use_queue)
+            mode = "queue" if use_queue else "legacy"
+            print(f"{rated:>6} {mode:>7} {statistics.median(timings):>8.2f} {percentile(timings, 95):>8.2f} "
+                  f"{max(timings):>8.2f} {statistics.median(lookups):>9.3f} {percentile(lookups, 95):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Бенчмарк рекомендаций комнаты (recommender) на большой комнате (без сети, на отдельной SQLite).
+
+    cd backend/src && python ../../tests/load/recommender_bench.py --movies 5000 --users 50 --density 0.7
+
+Печатает p50/p95:
+- build — загрузка оценок из БД и построение индекса (один раз на комнату)
+- predict — предсказания для всей комнаты по готовому индексу
+- rank — «top picks» участника: ранжирование всех его неоценённых фильмов
+- rated — то, что происходит после новой оценки: правка индекса на месте, предсказания и ранжирование
+И проверяет, что индекс после серии правок совпадает с построенным заново по тем же оценкам.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from dataclasses import replace
+
+# Та же комната и отдельная SQLite, что у room_stats_bench (он же настраивает DATABASE_URL до импорта приложения)
+from room_stats_bench import DB_PATH, ROOM_ID, seed, percentile, timed
+
+import numpy as np
+
+from recommender import RoomIndex, rank_movies, room_recommender
+from room_stats import load_room_ratings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--density", type=float, default=0.7, help="доля фильмов, оценённых каждым участником")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    count = seed(args.movies, args.users, args.density)
+    print(f"комната: {args.movies} фильмов, {args.users} участников, {count} оценок, БД {DB_PATH}")
+
+    ratings = asyncio.run(load_room_ratings(ROOM_ID))
+    index = RoomIndex(ratings)
+    user_id = int(ratings.user_ids[0])
+    candidates = ratings.movie_ids[np.isnan(ratings.scores[0])].tolist()
+    print(f"кандидатов у участника {user_id}: {len(candidates)}")
+
+    def predict() -> None:
+        index._predictions = None
+        index.predictions()
+
+    async def build() -> None:
+        RoomIndex(await load_room_ratings(ROOM_ID)).predictions()
+
+    async def measure_rated() -> tuple[list[float], np.ndarray]:
+        await room_recommender.get(ROOM_ID)
+        rng = random.Random(7)
+        scores = ratings.scores.copy()
+        timings = []
+        for _ in range(args.repeats):
+            row, column = rng.randrange(args.users), rng.randrange(args.movies)
+            score = None if rng.random() < 0.1 else rng.randint(0, 20) / 2
+            scores[row, column] = np.nan if score is None else score
+            started = time.perf_counter()
+            room_recommender.record_rating(ROOM_ID, row + 1, column + 1, score)
+            rank_movies(await room_recommender.predictions(ROOM_ID), user_id, candidates)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings, scores
+
+    rated, expected_scores = asyncio.run(measure_rated())
+    rows = [
+        ("build", timed(lambda: asyncio.run(build()), args.repeats)),
+        ("predict", timed(predict, args.repeats)),
+        ("rank", timed(lambda: rank_movies(index.predictions(), user_id, candidates), args.repeats)),
+        ("rated", rated),
+    ]
+    print(f"\n{'step':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, timings in rows:
+        print(f"{name:>8} {statistics.median(timings):>8.2f} {percentile(timings, 95):>8.2f}")
+
+    updated = asyncio.run(room_recommender.get(ROOM_ID))
+    rebuilt = RoomIndex(replace(ratings, scores=expected_scores))
+    consistent = all(np.allclose(getattr(updated, name), getattr(rebuilt, name))
+                     for name in ("known", "values", "common", "sum_x", "sum_xx", "sum_xy"))
+    print(f"\nиндекс после правок совпадает с построенным заново: {'да' if consistent else 'НЕТ'}")
+    if not consistent:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Бенчмарк статистики комнаты (room_stats) на большой комнате (без сети, на отдельной SQLite).
+
+    cd backend/src && python ../../tests/load/room_stats_bench.py --movies 5000 --users 50 --density 0.7
+
+Печатает p50/p95 загрузки матрицы оценок из БД, векторного расчёта и сборки JSON-ответов,
+ответа из кэша (то, что получает экран статистики до следующей оценки) и ответа сразу после новой оценки
+(rated: матрица правится в кэше, пересчёт без чтения БД).
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="room-stats-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["DB_ECHO"] = "false"
+sys.path.insert(0, os.getcwd())
+
+from sqlalchemy import insert  # noqa: E402
+
+from database import engine, SessionLocal  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Rating, Room, User  # noqa: E402
+from room_stats import (load_room_ratings, compute_room_stats, room_summary, movie_table,  # noqa: E402
+                        divisive_movies, agreement_matrix, room_stats_cache, record_room_rating)
+
+ROOM_ID = "BENCHROOM"
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def seed(movies: int, users: int, density: float) -> int:
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(42)
+    ratings = [
+        {"user_id": user_id, "movie_id": movie_id, "room_id": ROOM_ID, "score": rng.randint(0, 20) / 2, "skipped": False}
+        for user_id in range(1, users + 1)
+        for movie_id in range(1, movies + 1)
+        if rng.random() < density
+    ]
+    with SessionLocal() as db:
+        db.execute(insert(User), [{"id": i, "telegram_id": str(i), "username": f"user{i}"} for i in range(1, users + 1)])
+        db.add(Room(id=ROOM_ID, name="bench"))
+        db.execute(insert(Movie), [
+            {"id": i, "title": f"Movie {i}", "year": 2000, "kinopoisk_url": f"https://www.kinopoisk.ru/film/{i}",
+             "kinopoisk_id": i}
+            for i in range(1, movies + 1)
+        ])
+        db.execute(insert(MoviesInRoom), [{"movie_id": i, "room_id": ROOM_ID, "added_by": 1} for i in range(1, movies + 1)])
+        db.execute(insert(Rating), ratings)
+        db.commit()
+    return len(ratings)
+
+
+def build_responses(stats) -> None:
+    room_summary(stats)
+    movie_table(stats, "avg_score", True, 50, 0)
+    divisive_movies(stats, 10)
+    agreement_matrix(stats)
+
+
+def timed(fn, repeats: int) -> list[float]:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--density", type=float, default=0.7, help="доля фильмов, оценённых каждым участником")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    count = seed(args.movies, args.users, args.density)
+    print(f"комната: {args.movies} фильмов, {args.users} участников, {count} оценок, БД {DB_PATH}")
+
+    ratings = asyncio.run(load_room_ratings(ROOM_ID))
+    stats = compute_room_stats(ratings)
+    print(f"матрица {ratings.scores.shape}, {ratings.scores.nbytes / 1024:.0f} KiB")
+
+    async def measure_cached() -> list[float]:
+        await room_stats_cache.get(ROOM_ID)
+        timings = []
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            build_responses(await room_stats_cache.get(ROOM_ID))
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    async def measure_rated() -> list[float]:
+        # Оценка уже известного участника известному фильму: матрица правится в кэше, БД не читается
+        rng = random.Random(7)
+        timings = []
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            record_room_rating(ROOM_ID, rng.randint(1, args.users), rng.randint(1, args.movies), rng.randint(0, 20) / 2)
+            build_responses(await room_stats_cache.get(ROOM_ID))
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    async def measure() -> tuple[list[float], list[float]]:
+        return await measure_cached(), await measure_rated()
+
+    cached, rated = asyncio.run(measure())
+    rows = [
+        ("load", timed(lambda: asyncio.run(load_room_ratings(ROOM_ID)), args.repeats)),
+        ("compute", timed(lambda: compute_room_stats(ratings), args.repeats)),
+        ("json", timed(lambda: build_responses(stats), args.repeats)),
+        ("cached", cached),
+        ("rated", rated),
+    ]
+    print(f"\n{'step':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, timings in rows:
+        print(f"{name:>8} {statistics.median(timings):>8.2f} {percentile(timings, 95):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Бенчмарк поиска фильмов (search_index) на синтетическом каталоге (без сети и БД).
+
+    cd backend/src && python ../../tests/load/search_bench.py --movies 100000
+
+Названия — случайные сочетания русских и английских слов. Печатает время построения индекса
+и p50/p95/p99 запроса для:
+- prefix — набор по буквам: префиксы названия длиной 2, 4, 6... (то, что шлёт поле поиска по мере набора)
+- typo — полное название с одной опечаткой (пропуск, замена или перестановка букв)
+- year — слово названия и год
+- room — то же, что typo, в пределах комнаты на --room-movies фильмов
+Для typo и room — доля запросов, где в первой десятке есть фильм с исходным названием (recall@10;
+по названию, а не id: словарь маленький, одинаковых названий в каталоге много).
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ["DATABASE_URL"] = "sqlite://"  # индекс строится из сгенерированных строк, БД не читается
+os.environ["DB_ECHO"] = "false"
+sys.path.insert(0, os.getcwd())
+
+from concurrency_bench import percentile  # noqa: E402
+from search_index import build_index  # noqa: E402
+
+WORDS = (
+    "ночь день город тень свет дорога война мир любовь зима лето море небо звезда огонь вода земля дом сердце "
+    "брат сестра отец мать друг враг король королева путь время память тайна остров лес река гора песня "
+    "последний первый тёмный белый красный чёрный золотой долгий новый старый большой маленький ёлка ёжик "
+    "night day city shadow light road war peace love winter summer sea sky star fire water earth home heart "
+    "brother sister father mother friend enemy king queen way time memory secret island forest river mountain"
+).split()
+
+
+def make_title(rng: random.Random) -> str:
+    title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+    return title.capitalize() + (f" {rng.randint(2, 9)}" if rng.random() < 0.1 else "")
+
+
+def with_typo(title: str, rng: random.Random) -> str:
+    letters = [i for i, char in enumerate(title) if char.isalpha()]
+    i = rng.choice(letters)
+    kind = rng.choice(("drop", "replace", "swap"))
+    if kind == "drop":
+        return title[:i] + title[i + 1:]
+    if kind == "replace":
+        return title[:i] + rng.choice("аеиоуabcdeo") + title[i + 1:]
+    j = min(i + 1, len(title) - 1)
+    return title[:i] + title[j] + title[i] + title[j + 1:]
+
+
+def measure(index, titles: dict[int, tuple[str, int]], queries: list[tuple[str, int]],
+            movie_ids: list[int] | None = None) -> tuple[list[float], float]:
+    timings, found = [], 0
+    for query, expected in queries:
+        started = time.perf_counter()
+        results = index.search(query, 10, movie_ids)
+        timings.append((time.perf_counter() - started) * 1000)
+        found += any(titles[movie_id][0] == titles[expected][0] for movie_id, _ in results)
+    return timings, found / len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--movies", type=int, default=100_000)
+    parser.add_argument("--room-movies", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    rows = [(movie_id, make_title(rng), rng.randint(1950, 2024)) for movie_id in range(1, args.movies + 1)]
+    titles = {movie_id: (title, year) for movie_id, title, year in rows}
+
+    started = time.perf_counter()
+    index = build_index(rows)
+    print(f"индекс: {len(index)} фильмов, {index.trigram_count} триграмм, "
+          f"построение {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    sample = rng.sample(range(1, args.movies + 1), args.queries)
+    prefixes = [(titles[movie_id][0][:length], movie_id)
+                for movie_id in sample[:args.queries // 3] for length in range(2, len(titles[movie_id][0]) + 1, 2)]
+    typos = [(with_typo(titles[movie_id][0], rng), movie_id) for movie_id in sample]
+    years = [(f"{titles[movie_id][0].split()[0]} {titles[movie_id][1]}", movie_id) for movie_id in sample]
+    room_ids = sorted(set(rng.sample(range(1, args.movies + 1), args.room_movies)) | set(sample))
+    room = [(with_typo(titles[movie_id][0], rng), movie_id) for movie_id in sample]
+
+    print(f"\n{'query':>8} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'recall@10':>10}")
+    for name, queries, movie_ids in (("prefix", prefixes, None), ("typo", typos, None),
+                                     ("year", years, None), ("room", room, room_ids)):
+        timings, recall = measure(index, titles, queries, movie_ids)
+        shown = f"{recall:.2f}" if name in ("typo", "room") else "-"
+        print(f"{name:>8} {len(queries):>6} {statistics.median(timings):>8.2f} {percentile(timings, 95):>8.2f} "
+              f"{percentile(timings, 99):>8.2f} {shown:>10}")
+
+
+if __name__ == "__main__":
+    main()
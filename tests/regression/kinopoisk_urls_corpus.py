@@ -0,0 +1,187 @@
+"""
+Корпус вариантов ссылок на Кинопоиск для kinopoisk_urls и services.resolve_kinopoisk_urls — без сети, на отдельной SQLite.
+
+    cd backend/src && python ../../tests/regression/kinopoisk_urls_corpus.py --cases 5000
+
+Свойства, которые проверяются на случайных (воспроизводимых по --seed) сочетаниях схемы, хоста, регистра,
+раздела (film/series), хвоста пути, query, fragment и пробелов вокруг:
+- из любого варианта извлекается исходный kinopoisk_id
+- canonicalize_kinopoisk_url одинаков для всех вариантов одного фильма и не меняется при повторном применении
+- испорченные варианты (чужой хост, схема, раздел, нецифровой или отсутствующий id) дают ValueError
+- resolve_kinopoisk_urls сопоставляет пачку вариантов одним запросом к БД
+Плюс фиксированный список ссылок, которые уже встречались в комнатах. Код выхода 1 при любом нарушении.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="kinopoisk-urls-"), "check.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["DB_ECHO"] = "false"
+sys.path.insert(0, os.getcwd())
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from database import engine, async_engine, SessionLocal, AsyncSessionLocal  # noqa: E402
+from kinopoisk_urls import extract_kinopoisk_id, canonicalize_kinopoisk_url, canonical_kinopoisk_url  # noqa: E402
+from models import Base, Movie  # noqa: E402
+from services import resolve_kinopoisk_urls  # noqa: E402
+
+KNOWN_VALID = {
+    "https://www.kinopoisk.ru/film/594/": 594,
+    "https://www.kinopoisk.ru/film/594": 594,
+    "http://kinopoisk.ru/film/594?utm_referrer=www.google.com": 594,
+    "https://www.kinopoisk.ru/film/594/?utm_referrer=www.google.com": 594,
+    "https://m.kinopoisk.ru/series/594/episodes/#season": 594,
+    "www.kinopoisk.ru/film/594": 594,
+    "  https://www.kinopoisk.ru/film/4926453/  ": 4926453,
+    "HTTPS://WWW.KINOPOISK.RU/FILM/4926453/": 4926453,
+    "https://www.kinopoisk.ru/series/1234567/": 1234567,
+    "https://www.kinopoisk.ru:443/film/326/": 326,
+}
+KNOWN_INVALID = [
+    "",
+    "кинопоиск",
+    "https://www.kinopoisk.ru/",
+    "https://www.kinopoisk.ru/film/",
+    "https://www.kinopoisk.ru/film/abc/",
+    "https://www.kinopoisk.ru/film/５９４/",  # полноширинные цифры: isdigit() да, ascii нет
+    "https://www.kinopoisk.ru/name/594/",
+    "https://www.kinopoisk.ru/lists/movies/594/",
+    "https://kinopoisk.ru.evil.com/film/594/",
+    "https://evil.com/www.kinopoisk.ru/film/594/",
+    "ftp://www.kinopoisk.ru/film/594/",
+    "javascript://www.kinopoisk.ru/film/594/",
+    "https://hd.kinopoisk.ru/film/594/",
+]
+
+SCHEMES = ["https://", "http://", "HTTPS://", ""]
+HOSTS = ["www.kinopoisk.ru", "kinopoisk.ru", "m.kinopoisk.ru", "WWW.Kinopoisk.RU"]
+SECTIONS = ["film", "series", "FILM", "Series"]
+TAILS = ["", "/", "/episodes/", "/reviews/", "/cast/who_is/actor/", "//"]
+QUERIES = ["", "?utm_referrer=www.google.com", "?from=search&utm_source=tg", "?"]
+FRAGMENTS = ["", "#season", "#", "#/film/1/"]
+SPACES = ["", " ", "\t", "\n "]
+
+
+def variant(rng: random.Random, kinopoisk_id: int) -> str:
+    return (rng.choice(SPACES) + rng.choice(SCHEMES) + rng.choice(HOSTS) + "/" + rng.choice(SECTIONS)
+            + f"/{kinopoisk_id}" + rng.choice(TAILS) + rng.choice(QUERIES) + rng.choice(FRAGMENTS) + rng.choice(SPACES))
+
+
+def broken_variant(rng: random.Random, kinopoisk_id: int) -> str:
+    """Вариант, испорченный ровно в одном месте."""
+    scheme, host, section, movie_id = rng.choice(SCHEMES[:2]), rng.choice(HOSTS), rng.choice(SECTIONS), str(kinopoisk_id)
+    damage = rng.choice(["host", "scheme", "section", "id", "no_id"])
+    if damage == "host":
+        host = rng.choice(["kinopoisk.com", "www.kinopoisk.ru.example.org", "imdb.com", "kinopoisk"])
+    elif damage == "scheme":
+        scheme = rng.choice(["ftp://", "file://", "mailto://"])
+    elif damage == "section":
+        section = rng.choice(["name", "lists", "films", "user", ""])
+    elif damage == "id":
+        movie_id = rng.choice([f"{kinopoisk_id}a", f"-{kinopoisk_id}", f"{kinopoisk_id}.5", "id594"])
+    else:
+        movie_id = ""
+    return f"{scheme}{host}/{section}/{movie_id}/" + rng.choice(QUERIES)
+
+
+def check_corpus(rng: random.Random, cases: int) -> list[str]:
+    failures = []
+
+    def expect_id(url: str, expected: int) -> None:
+        try:
+            found = extract_kinopoisk_id(url)
+        except ValueError as e:
+            failures.append(f"{url!r}: ValueError {e}")
+            return
+        if found != expected:
+            failures.append(f"{url!r}: {found} вместо {expected}")
+            return
+        canonical = canonicalize_kinopoisk_url(url)
+        if canonical != canonical_kinopoisk_url(expected) or canonicalize_kinopoisk_url(canonical) != canonical:
+            failures.append(f"{url!r}: каноническая ссылка {canonical!r}")
+
+    def expect_invalid(url: str) -> None:
+        try:
+            found = extract_kinopoisk_id(url)
+        except ValueError:
+            return
+        failures.append(f"{url!r}: принята как {found}")
+
+    for url, expected in KNOWN_VALID.items():
+        expect_id(url, expected)
+    for url in KNOWN_INVALID:
+        expect_invalid(url)
+    for _ in range(cases):
+        kinopoisk_id = rng.choice([rng.randint(1, 999), rng.randint(1, 9_999_999)])
+        expect_id(variant(rng, kinopoisk_id), kinopoisk_id)
+        expect_invalid(broken_variant(rng, kinopoisk_id))
+    return failures
+
+
+async def check_resolve(rng: random.Random) -> list[str]:
+    """Пачка вариантов десяти фильмов (пять в БД) и мусора — один запрос, правильное сопоставление."""
+    Base.metadata.create_all(bind=engine)
+    known = list(range(1001, 1006))
+    with SessionLocal() as db:
+        db.execute(insert(Movie), [
+            {"title": f"Movie {i}", "year": 2000, "kinopoisk_url": canonical_kinopoisk_url(i), "kinopoisk_id": i}
+            for i in known
+        ])
+        db.commit()
+
+    expected = {}
+    for kinopoisk_id in range(1001, 1011):
+        for _ in range(5):
+            expected[variant(rng, kinopoisk_id)] = kinopoisk_id
+    for url in KNOWN_INVALID:
+        expected[url] = None
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])  # noqa: E731
+    event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+    async with AsyncSessionLocal() as db:
+        resolved = await resolve_kinopoisk_urls(db, list(expected))
+    event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
+
+    failures = []
+    if len(statements) != 1:
+        failures.append(f"resolve_kinopoisk_urls: {len(statements)} запросов вместо одного")
+    for url, kinopoisk_id in expected.items():
+        value = resolved.get(url)
+        if kinopoisk_id is None:
+            ok = value is None
+        elif kinopoisk_id in known:
+            ok = isinstance(value, Movie) and value.kinopoisk_id == kinopoisk_id
+        else:
+            ok = value == kinopoisk_id
+        if not ok:
+            failures.append(f"resolve {url!r}: {value!r}, ожидался {kinopoisk_id}")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=5000, help="случайных корректных и испорченных вариантов")
+    parser.add_argument("--seed", type=int, default=594)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = check_corpus(rng, args.cases)
+    failures += asyncio.run(check_resolve(rng))
+
+    for failure in failures[:50]:
+        print(f"ОШИБКА {failure}")
+    if failures:
+        print(f"\nнарушений: {len(failures)} (seed {args.seed})")
+        sys.exit(1)
+    print(f"ссылок проверено: {len(KNOWN_VALID) + len(KNOWN_INVALID) + 2 * args.cases}, "
+          f"resolve_kinopoisk_urls — один запрос на пачку")
+
+
+if __name__ == "__main__":
+    main()
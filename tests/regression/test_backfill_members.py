@@ -0,0 +1,56 @@
+"""
+Регрессионная проверка manage.py backfill-members: участники комнат, созданных до room_members
+(создатель из rooms.created_by, добавлявшие фильмы, оценившие), дописываются, и повторный запуск ничего не меняет.
+
+    python -m pytest tests/regression/test_backfill_members.py
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+"""
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='backfill-members-'), 'check.db')}")
+os.environ.setdefault("DB_ECHO", "false")
+sys.path.insert(0, SRC_DIR)
+
+from sqlalchemy import inspect, insert, select, text  # noqa: E402
+
+from database import engine, SessionLocal  # noqa: E402
+from manage import backfill_room_members, check_schema, room_members_need_backfill  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Rating, Room, RoomMember, User  # noqa: E402
+
+ROOM_ID = "BACKFILL"
+CREATOR, ADDER, RATER, MEMBER = 9_300_001, 9_300_002, 9_300_003, 9_300_004
+MOVIE_ID = 9_300_001
+
+
+def test_members_are_backfilled_from_room_activity():
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        # Колонка из старых баз: в models.py её нет
+        if "created_by" not in {c["name"] for c in inspect(conn).get_columns("rooms")}:
+            conn.execute(text("ALTER TABLE rooms ADD COLUMN created_by INTEGER"))
+    with SessionLocal() as db:
+        for user_id in (CREATOR, ADDER, RATER, MEMBER):
+            db.add(User(id=user_id, telegram_id=str(user_id), username=f"user{user_id}"))
+        db.add(Room(id=ROOM_ID, name=ROOM_ID))
+        db.flush()
+        db.execute(text("UPDATE rooms SET created_by = :user_id WHERE id = :room_id"),
+                   {"user_id": CREATOR, "room_id": ROOM_ID})
+        db.execute(insert(Movie).values(id=MOVIE_ID, title="Movie", year=2000, kinopoisk_id=MOVIE_ID,
+                                        kinopoisk_url=f"https://www.kinopoisk.ru/film/{MOVIE_ID}"))
+        db.execute(insert(MoviesInRoom).values(movie_id=MOVIE_ID, room_id=ROOM_ID, added_by=ADDER))
+        db.execute(insert(Rating).values(user_id=RATER, movie_id=MOVIE_ID, room_id=ROOM_ID, score=7, skipped=False))
+        db.add(RoomMember(room_id=ROOM_ID, user_id=MEMBER))
+        db.commit()
+
+    assert room_members_need_backfill()
+    check_schema()  # при старте недостающие участники дописываются
+    assert not room_members_need_backfill()
+    assert backfill_room_members() == 0
+
+    with SessionLocal() as db:
+        members = set(db.scalars(select(RoomMember.user_id).where(RoomMember.room_id == ROOM_ID)))
+    assert members == {CREATOR, ADDER, RATER, MEMBER}
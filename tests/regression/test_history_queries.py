@@ -0,0 +1,136 @@
+"""
+Регрессионная проверка числа SQL-запросов страницы истории (services.get_room_history_page) — без сети, на отдельной SQLite.
+
+    python -m pytest tests/regression/test_history_queries.py                          # тест (комнаты 20/400/2000)
+    python tests/regression/test_history_queries.py --sizes 20 400 5000                # таблица по размерам
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+Засевает комнаты разного размера и для каждой сортировки проходит историю по курсорам, считая запросы
+на каждую страницу. Число запросов не должно зависеть от размера комнаты и не должно
+превышать --max-statements (сейчас 2 на страницу, 3 — когда страница my_rating переходит
+к фильмам без моей оценки). Код выхода 1, если это не так.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix="history-queries-"), "check.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["DB_ECHO"] = "false"
+sys.path.insert(0, SRC_DIR)
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from database import engine, SessionLocal  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Rating, Room, User  # noqa: E402
+from services import get_room_history_page, rebuild_room_movie_stats, HISTORY_SORTS  # noqa: E402
+
+USERS = 8
+USER_ID = 1
+PAGE_SIZE = 30
+TEST_SIZES = [20, 400, 2000]
+MAX_STATEMENTS = 3
+
+
+def seed(room_id: str, movies: int, first_movie_id: int) -> None:
+    rng = random.Random(movies)
+    started = datetime(2024, 1, 1)
+    movie_ids = range(first_movie_id, first_movie_id + movies)
+    with SessionLocal() as db:
+        db.add(Room(id=room_id, name=room_id))
+        db.execute(insert(Movie), [
+            {"id": i, "title": f"Movie {i}", "year": 2000, "kinopoisk_url": f"https://www.kinopoisk.ru/film/{i}",
+             "kinopoisk_id": i}
+            for i in movie_ids
+        ])
+        db.execute(insert(MoviesInRoom), [
+            {"movie_id": i, "room_id": room_id, "added_by": rng.randint(1, USERS),
+             "added_date": started + timedelta(hours=i)}
+            for i in movie_ids
+        ])
+        # Моя оценка — у половины фильмов: my_rating проходит обе части (с оценкой и без)
+        db.execute(insert(Rating), [
+            {"user_id": user_id, "movie_id": i, "room_id": room_id, "score": rng.randint(2, 20) / 2, "skipped": False}
+            for i in movie_ids for user_id in range(1, USERS + 1)
+            if rng.random() < (0.5 if user_id == USER_ID else 0.8)
+        ])
+        rebuild_room_movie_stats(db, room_id)
+        db.commit()
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args) -> None:
+        self.count += 1
+
+    def measure(self, fn) -> tuple[int, object]:
+        before = self.count
+        result = fn()
+        return self.count - before, result
+
+
+def page_statements(counter: StatementCounter, room_id: str, sort_by: str) -> list[int]:
+    """Запросы на каждую страницу при проходе истории целиком."""
+    counts, cursor = [], None
+    with SessionLocal() as db:
+        while True:
+            statements, (_, cursor) = counter.measure(
+                lambda: get_room_history_page(db, room_id, USER_ID, sort_by, cursor, PAGE_SIZE))
+            counts.append(statements)
+            if cursor is None:
+                return counts
+
+
+def check(sizes: list[int], max_statements: int) -> list[str]:
+    """Засевает комнаты, проходит историю во всех сортировках, печатает таблицу; возвращает нарушения."""
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.execute(insert(User), [{"id": i, "telegram_id": str(i), "username": f"user{i}"} for i in range(1, USERS + 1)])
+        db.commit()
+    first_movie_id = 1
+    for size in sizes:
+        seed(f"ROOM{size}", size, first_movie_id)
+        first_movie_id += size
+
+    counter = StatementCounter()
+    failures = []
+    print(f"{'sort':>12} " + " ".join(f"{f'{size} фильмов':>14}" for size in sizes))
+    for sort_by in HISTORY_SORTS:
+        per_size = [page_statements(counter, f"ROOM{size}", sort_by) for size in sizes]
+        print(f"{sort_by:>12} " + " ".join(f"{f'{min(c)}..{max(c)} ({len(c)} стр.)':>14}" for c in per_size))
+        worst = max(max(counts) for counts in per_size)
+        if worst > max_statements:
+            failures.append(f"{sort_by}: до {worst} запросов на страницу (допустимо {max_statements})")
+        if len({max(counts) for counts in per_size}) > 1:
+            failures.append(f"{sort_by}: число запросов на страницу зависит от размера комнаты "
+                            f"{[max(counts) for counts in per_size]}")
+    return failures
+
+
+def test_history_statements_do_not_depend_on_room_size():
+    assert check(TEST_SIZES, MAX_STATEMENTS) == []
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 400, 5000])
+    parser.add_argument("--max-statements", type=int, default=MAX_STATEMENTS)
+    args = parser.parse_args()
+
+    failures = check(args.sizes, args.max_statements)
+    for failure in failures:
+        print(f"ОШИБКА {failure}")
+    if failures:
+        sys.exit(1)
+    print("\nчисло запросов на страницу не зависит от размера комнаты")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Регрессионная проверка: initData с подписью, но без id пользователя — 401, а не 500 (KeyError).
+
+    python -m pytest tests/regression/test_init_data_user.py
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='init-data-'), 'check.db')}")
+sys.path.insert(0, SRC_DIR)
+
+import pytest  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+import telegram_auth  # noqa: E402
+from telegram_auth import sign_init_data  # noqa: E402
+from utilites import get_current_user, get_current_user_async  # noqa: E402
+
+BOT_TOKEN = "123456:regression-token"
+
+
+def signed_init_data(user: dict) -> str:
+    fields = {"user": json.dumps(user), "auth_date": str(int(time.time()))}
+    return urlencode({**fields, "hash": sign_init_data(fields, BOT_TOKEN)})
+
+
+@pytest.mark.parametrize("user", [{"first_name": "NoId"}, ["id"]])
+def test_user_without_id_is_unauthorized(user, monkeypatch):
+    monkeypatch.setattr(telegram_auth, "TELEGRAM_BOT_TOKEN", BOT_TOKEN)
+    init_data = signed_init_data(user)
+
+    # До БД дело не доходит: initData отклоняется при проверке
+    with pytest.raises(HTTPException) as sync_error:
+        get_current_user(None, None, init_data)
+    with pytest.raises(HTTPException) as async_error:
+        asyncio.run(get_current_user_async(None, None, init_data))
+
+    assert sync_error.value.status_code == async_error.value.status_code == 401
@@ -0,0 +1,66 @@
+"""
+Регрессионная проверка очереди неоценённых фильмов (rating_queue): фильм, закоммиченный позже соседа
+с большим added_date, не теряется, хотя курсор очереди его уже прошёл.
+
+    python -m pytest tests/regression/test_rating_queue_cursor.py
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='rating-queue-'), 'check.db')}")
+os.environ.setdefault("DB_ECHO", "false")
+sys.path.insert(0, SRC_DIR)
+
+from sqlalchemy import insert  # noqa: E402
+
+from database import engine, SessionLocal  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Rating, Room  # noqa: E402
+from services import get_next_unrated_movie_for_user  # noqa: E402
+
+ROOM_ID = "QUEUE-CURSOR"
+USER_ID = 1
+FIRST, LATE, LAST = 9_000_001, 9_000_002, 9_000_003
+
+
+def add_to_room(db, movie_id: int, added_date: datetime) -> None:
+    db.execute(insert(Movie).values(id=movie_id, title=f"Movie {movie_id}", year=2000, kinopoisk_id=movie_id,
+                                    kinopoisk_url=f"https://www.kinopoisk.ru/film/{movie_id}"))
+    db.execute(insert(MoviesInRoom).values(movie_id=movie_id, room_id=ROOM_ID, added_by=USER_ID, added_date=added_date))
+
+
+def rate(db, movie_id: int) -> None:
+    db.execute(insert(Rating).values(user_id=USER_ID, movie_id=movie_id, room_id=ROOM_ID, score=7, skipped=False))
+
+
+def next_movie_id(db) -> int | None:
+    result = get_next_unrated_movie_for_user(db, ROOM_ID, USER_ID)
+    return result[0].id if result else None
+
+
+def test_movie_committed_behind_cursor_is_not_lost():
+    Base.metadata.create_all(bind=engine)
+    started = datetime(2024, 1, 1)
+    with SessionLocal() as db:
+        db.add(Room(id=ROOM_ID, name=ROOM_ID))
+        add_to_room(db, FIRST, started)
+        add_to_room(db, LAST, started + timedelta(seconds=2))
+        db.commit()
+
+        # Очередь дозаполнена: курсор уже на LAST
+        assert next_movie_id(db) == FIRST
+
+        # Параллельная транзакция закоммитила фильм с added_date между ними уже после дозаполнения
+        add_to_room(db, LATE, started + timedelta(seconds=1))
+        rate(db, FIRST)
+        rate(db, LAST)
+        db.commit()
+
+        assert next_movie_id(db) == LATE
+        rate(db, LATE)
+        db.commit()
+        assert next_movie_id(db) is None
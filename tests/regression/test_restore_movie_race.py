@@ -0,0 +1,66 @@
+"""
+Регрессионная проверка восстановления комнаты (room_export.restore_batch): фильм, который другой запрос сохранил
+между проверкой «есть ли он в базе» и вставкой, не роняет пачку IntegrityError, а берётся сохранённый.
+
+    python -m pytest tests/regression/test_restore_movie_race.py
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+"""
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='restore-race-'), 'check.db')}")
+os.environ.setdefault("DB_ECHO", "false")
+sys.path.insert(0, SRC_DIR)
+
+from sqlalchemy import event, insert, select  # noqa: E402
+
+from database import engine, SessionLocal  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Room  # noqa: E402
+from room_export import restore_batch  # noqa: E402
+
+ROOM_ID = "RESTORE-RACE"
+RACED, FRESH = 9_200_001, 9_200_002
+
+
+def movie_values(kinopoisk_id: int) -> dict:
+    return {"kinopoisk_id": kinopoisk_id, "title": f"Movie {kinopoisk_id}", "year": 2000,
+            "kinopoisk_url": f"https://www.kinopoisk.ru/film/{kinopoisk_id}", "poster_url": None,
+            "poster_preview_url": None}
+
+
+def file_row(kinopoisk_id: int) -> dict:
+    return {**movie_values(kinopoisk_id), "added_by_telegram_id": None, "added_date": None, "discussion_date": None,
+            "rater_telegram_id": None, "rater_username": "", "score": None, "skipped": False}
+
+
+def test_movie_saved_concurrently_is_reused():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(Room(id=ROOM_ID, name=ROOM_ID))
+        db.commit()
+
+        raced = False
+
+        @event.listens_for(db, "do_orm_execute")
+        def save_after_lookup(state):
+            # Первая выборка фильмов пачки ещё не видит RACED — сразу после неё его «сохраняет другой запрос»
+            nonlocal raced
+            if raced or not state.is_select:
+                return None
+            raced = True
+            result = state.invoke_statement()
+            db.execute(insert(Movie).values(movie_values(RACED)))
+            return result
+
+        counts = restore_batch(db, ROOM_ID, 1, [file_row(RACED), file_row(FRESH)])
+        db.commit()
+
+        assert raced
+        assert counts["movies"] == 1
+        assert counts["room_movies"] == 2
+        room_kinopoisk_ids = set(db.scalars(select(Movie.kinopoisk_id).join(MoviesInRoom)
+                                            .where(MoviesInRoom.room_id == ROOM_ID)))
+        assert room_kinopoisk_ids == {RACED, FRESH}
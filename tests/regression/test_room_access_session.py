@@ -0,0 +1,52 @@
+"""
+Регрессионная проверка: проверка доступа к комнате (room_access.RoomAccessCache.get) не коммитит
+транзакцию сессии запроса — незакоммиченное запросом до зависимости откатывается вместе с ним.
+
+    python -m pytest tests/regression/test_room_access_session.py
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='room-access-'), 'check.db')}")
+os.environ.setdefault("DB_ECHO", "false")
+sys.path.insert(0, SRC_DIR)
+
+from sqlalchemy import insert  # noqa: E402
+
+from database import engine, async_engine, AsyncSessionLocal, SessionLocal  # noqa: E402
+from models import Base, Room, RoomMember, User  # noqa: E402
+from room_access import RoomAccessCache  # noqa: E402
+
+ROOM_ID, UNCOMMITTED_ROOM_ID = "ACCESS-SESSION", "ACCESS-SESSION-ROLLBACK"
+USER_ID = 9_400_001
+
+
+def test_access_check_keeps_request_transaction_open():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(User(id=USER_ID, telegram_id=str(USER_ID), username="member"))
+        db.add(Room(id=ROOM_ID, name=ROOM_ID))
+        db.flush()
+        db.add(RoomMember(room_id=ROOM_ID, user_id=USER_ID))
+        db.commit()
+    cache = RoomAccessCache()
+
+    async def scenario():
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(Room).values(id=UNCOMMITTED_ROOM_ID, name=UNCOMMITTED_ROOM_ID))
+                await cache.check(ROOM_ID, USER_ID, db)
+                assert db.in_transaction()
+                await db.rollback()
+            async with AsyncSessionLocal() as db:
+                assert await db.get(Room, UNCOMMITTED_ROOM_ID) is None
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(scenario())
+    assert cache.stats()["loaded"] == 1
@@ -0,0 +1,58 @@
+"""
+Регрессионная проверка состава комнаты для поиска (search_index.MovieSearch.room_movie_ids): читается из БД
+один раз, а не на каждое нажатие клавиши, и перечитывается после forget_room.
+
+    python -m pytest tests/regression/test_room_search_scope.py
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='room-search-'), 'check.db')}")
+os.environ.setdefault("DB_ECHO", "false")
+sys.path.insert(0, SRC_DIR)
+
+from sqlalchemy import insert  # noqa: E402
+
+from database import engine, async_engine, AsyncSessionLocal, SessionLocal  # noqa: E402
+from models import Base, Movie, MoviesInRoom, Room  # noqa: E402
+from search_index import MovieSearch  # noqa: E402
+
+ROOM_ID = "SEARCH-SCOPE"
+FIRST, SECOND = 9_100_001, 9_100_002
+
+
+def add_to_room(movie_id: int) -> None:
+    with SessionLocal() as db:
+        db.execute(insert(Movie).values(id=movie_id, title=f"Movie {movie_id}", year=2000, kinopoisk_id=movie_id,
+                                        kinopoisk_url=f"https://www.kinopoisk.ru/film/{movie_id}"))
+        db.execute(insert(MoviesInRoom).values(movie_id=movie_id, room_id=ROOM_ID, added_by=1))
+        db.commit()
+
+
+def test_room_scope_is_cached_until_forget_room():
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(Room(id=ROOM_ID, name=ROOM_ID))
+        db.commit()
+    add_to_room(FIRST)
+    search = MovieSearch()
+
+    async def scenario():
+        try:
+            async with AsyncSessionLocal() as db:
+                assert await search.room_movie_ids(db, ROOM_ID) == {FIRST}
+                add_to_room(SECOND)
+                # Без сброса — из кэша, без запроса
+                assert await search.room_movie_ids(db, ROOM_ID) == {FIRST}
+                search.forget_room(ROOM_ID)
+                assert await search.room_movie_ids(db, ROOM_ID) == {FIRST, SECOND}
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(scenario())
+    assert search.stats()["room_scopes"]["misses"] == 2
@@ -0,0 +1,89 @@
+"""
+Регрессионная проверка очереди пишущих транзакций SQLite (database.SqliteWriteQueue) на отдельной SQLite.
+
+    python -m pytest tests/regression/test_sqlite_write_queue.py
+
+Запускается из любого каталога: backend/src добавляется в sys.path здесь же.
+Очередь отпускается по концу транзакции, а не по возврату соединения в пул, и корутина,
+пишущая в двух сессиях, не ждёт сама себя до SQLITE_WRITE_QUEUE_TIMEOUT.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "backend", "src"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='write-queue-'), 'check.db')}")
+os.environ.setdefault("DB_ECHO", "false")
+sys.path.insert(0, SRC_DIR)
+
+import pytest  # noqa: E402
+from sqlalchemy import insert, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from database import engine, async_engine, AsyncSessionLocal, sqlite_write_queue, SQLITE_BUSY_TIMEOUT_MS  # noqa: E402
+from models import Base, Room  # noqa: E402
+
+# Заметно меньше SQLITE_WRITE_QUEUE_TIMEOUT: зависание в очереди не ждём целиком
+DEADLINE = 10
+
+
+def run(fn) -> None:
+    async def main():
+        try:
+            await asyncio.wait_for(fn(), DEADLINE)
+        finally:
+            # Соединения aiosqlite привязаны к циклу событий, а у каждого теста свой asyncio.run
+            await async_engine.dispose()
+
+    Base.metadata.create_all(bind=engine)
+    asyncio.run(main())
+
+
+def add_room(room_id: str):
+    return insert(Room).values(id=room_id, name=room_id)
+
+
+def test_second_session_after_commit_does_not_wait_for_checkin():
+    async def scenario():
+        async with async_engine.connect() as conn:
+            await conn.execute(add_room("WQ-COMMIT-1"))
+            await conn.commit()
+            # Соединение ещё не вернулось в пул, но транзакция закончена — очередь свободна
+            assert not sqlite_write_queue.held()
+            async with AsyncSessionLocal() as db:
+                await db.execute(add_room("WQ-COMMIT-2"))
+                await db.commit()
+
+    run(scenario)
+    assert not sqlite_write_queue.held()
+
+
+def test_nested_session_inside_write_transaction_fails_in_busy_timeout():
+    async def scenario():
+        async with AsyncSessionLocal() as outer:
+            await outer.execute(add_room("WQ-NESTED-1"))
+            assert sqlite_write_queue.held()
+            async with async_engine.connect() as inner:
+                await inner.execute(text("PRAGMA busy_timeout=100"))
+                # Очередь держит эта же задача: вложенная запись не ждёт её, а сразу упирается в блокировку SQLite
+                with pytest.raises(OperationalError, match="database is locked"):
+                    await inner.execute(add_room("WQ-NESTED-2"))
+                await inner.rollback()
+                await inner.execute(text(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}"))
+            await outer.commit()
+        assert not sqlite_write_queue.held()
+
+    run(scenario)
+
+
+def test_invalidated_connection_releases_queue():
+    async def scenario():
+        async with async_engine.connect() as conn:
+            await conn.execute(add_room("WQ-INVALIDATE"))
+            assert sqlite_write_queue.held()
+            await conn.invalidate()
+            assert not sqlite_write_queue.held()
+            await conn.rollback()
+
+    run(scenario)